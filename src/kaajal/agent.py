@@ -0,0 +1,635 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal connection agent
+
+Background process that keeps the authenticated SSH transports of the
+hosts, like the ControlMaster of OpenSSH. The kaajal commands send their
+remote commands and file operations to the agent over a local Unix
+socket, so back to back commands skip the key exchange and the auth.
+
+Every call is a new connection to the socket. The messages are JSON
+lines, followed by "size" bytes of data when the line has a size.
+"""
+
+import json
+import logging
+import os
+import socket
+import subprocess  # nosec B404
+import sys
+import threading
+import time
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import cast
+
+import paramiko
+
+from kaajal.config import app_config
+from kaajal.connection import SEND_SIZE
+from kaajal.connection import CommandResult
+from kaajal.connection import ConnectionPool
+from kaajal.connection import OutputCallback
+from kaajal.connection import SSHConnection
+from kaajal.connection import StdinData
+from kaajal.connection import UploadCallback
+
+logger = logging.getLogger(__name__)
+
+AGENT_SOCKET_NAME = "agent.sock"
+
+# Seconds without calls before the agent exits
+AGENT_MAX_IDLE = 1800.0
+
+# Seconds to wait for the socket of a new agent
+AGENT_START_TIMEOUT = 5.0
+
+# Methods of SSHConnection run by the agent
+AGENT_METHODS = [
+    "exec",
+    "host_key_fingerprint",
+    "stat",
+    "read_file",
+    "write_file",
+    "makedirs",
+    "upload",
+]
+
+# Methods of the SFTP client run by the agent
+AGENT_SFTP_METHODS = [
+    "chmod",
+    "chown",
+    "get",
+    "listdir",
+    "mkdir",
+    "posix_rename",
+    "put",
+    "remove",
+    "rename",
+    "rmdir",
+    "symlink",
+]
+
+# Position of the local path in the arguments of the SFTP methods, the
+# agent does not run in the current directory of the client
+AGENT_SFTP_LOCAL_PATHS = {"get": 1, "put": 0}
+
+
+def get_socket_path() -> str:
+    """Get the path of the socket of the agent, empty if there is not any"""
+
+    if app_config.user_config_dir:
+        return os.path.join(app_config.user_config_dir, AGENT_SOCKET_NAME)
+
+    return ""
+
+
+def _send_frame(sock_file: BinaryIO, message: dict, data: bytes = b"") -> None:
+    """Send a message and its data"""
+
+    if data:
+        message["size"] = len(data)
+
+    sock_file.write(json.dumps(message).encode("utf-8") + b"\n" + data)
+    sock_file.flush()
+
+
+def _read_frame(sock_file: BinaryIO) -> Tuple[dict, bytes]:
+    """Read a message and its data"""
+
+    line = sock_file.readline()
+    if not line:
+        raise EOFError("agent connection closed")
+
+    message = json.loads(line.decode("utf-8"))
+    size = message.get("size", 0)
+    data = sock_file.read(size) if size else b""
+
+    if len(data) < size:
+        raise EOFError("agent connection closed")
+
+    return message, data
+
+
+class _StdinReader:
+    """Binary file that reads the stdin messages of a call"""
+
+    def __init__(self, sock_file: BinaryIO) -> None:
+        """Class constructor of stdin reader"""
+
+        self.sock_file = sock_file
+        self.buffer = b""
+        self.ended = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.ended and (size < 0 or len(self.buffer) < size):
+            data = _read_frame(self.sock_file)[1]
+            if not data:
+                self.ended = True
+            self.buffer += data
+
+        if size < 0:
+            size = len(self.buffer)
+
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class Agent:
+    """Agent that runs the calls of the kaajal commands"""
+
+    def __init__(self, socket_path: str = "", max_idle: float = AGENT_MAX_IDLE) -> None:
+        """Class constructor of Agent
+
+        If socket_path is not given, the socket is in the user config dir.
+        """
+
+        self.socket_path = socket_path or get_socket_path()
+        self.max_idle = max_idle
+        self.pool = ConnectionPool(max_idle)
+        self.last_call = time.monotonic()
+        # calls running now
+        self.active = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def serve(self) -> str:
+        """Run the calls until the agent is stopped or idle
+
+        Returns an error message.
+        """
+
+        if not self.socket_path:
+            return "No path for the agent socket"
+
+        if is_agent_running(self.socket_path):
+            return_message = "Agent already running on " + self.socket_path
+            logger.warning(return_message)
+            return return_message
+
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o750, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # only the user can connect to the socket
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        except OSError as e:
+            return_message = f"Can not create {self.socket_path}: {str(e)}"
+            logger.warning(return_message)
+            return return_message
+        finally:
+            os.umask(old_umask)
+
+        server.listen()
+        server.settimeout(1.0)
+        logger.info("Agent listening on %s", self.socket_path)
+
+        try:
+            while not self._stop.is_set():
+                idle = time.monotonic() - self.last_call
+                if self.active == 0 and idle > self.max_idle:
+                    logger.info("Agent idle for %d seconds", self.max_idle)
+                    break
+
+                try:
+                    client_sock, _ = server.accept()
+                except socket.timeout:
+                    self.pool.evict_idle()
+                    continue
+
+                self.last_call = time.monotonic()
+                threading.Thread(
+                    target=self._handle,
+                    args=(client_sock,),
+                    name="kaajal-agent",
+                    daemon=True,
+                ).start()
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+            self.pool.close_all()
+            logger.info("Agent stopped")
+
+        return ""
+
+    def _handle(self, client_sock: socket.socket) -> None:
+        """Run one call"""
+
+        client_sock.settimeout(None)
+
+        with self._lock:
+            self.active += 1
+
+        try:
+            with client_sock, client_sock.makefile("rwb") as sock_file:
+                message = _read_frame(cast(BinaryIO, sock_file))[0]
+                reply = self._call(message, cast(BinaryIO, sock_file))
+                _send_frame(cast(BinaryIO, sock_file), reply)
+        except (EOFError, OSError, ValueError) as e:
+            logger.debug("Agent call failed: %s", str(e))
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.last_call = time.monotonic()
+
+    def _call(self, message: dict, sock_file: BinaryIO) -> Dict[str, Any]:
+        """Run the method of a call and get the reply"""
+
+        method = message.get("method", "")
+
+        if method == "ping":
+            return {"type": "result", "value": os.getpid()}
+
+        if method == "stop":
+            self._stop.set()
+            return {"type": "result", "value": None}
+
+        ssh_conn = SSHConnection(self.pool)
+        error_msg = ssh_conn._connect(**message.get("conn", {}))
+
+        if error_msg:
+            return {"type": "result", "error": error_msg}
+
+        args = message.get("args", [])
+        kwargs = message.get("kwargs", {})
+
+        def send_output(stream: str, line: str) -> None:
+            _send_frame(sock_file, {"type": "output", "stream": stream, "line": line})
+
+        def send_progress(done: int, total: int) -> None:
+            _send_frame(sock_file, {"type": "progress", "done": done, "total": total})
+
+        try:
+            if method == "exec":
+                if message.get("output"):
+                    kwargs["on_output"] = send_output
+                if message.get("stdin"):
+                    kwargs["stdin"] = _StdinReader(sock_file)
+                value: Any = vars(ssh_conn.exec(*args, **kwargs))
+            elif method == "get_home":
+                value = ssh_conn.get_home()
+            elif method in AGENT_METHODS:
+                if method == "upload" and message.get("progress"):
+                    kwargs["on_progress"] = send_progress
+                value = getattr(ssh_conn, method)(*args, **kwargs)
+            elif method.startswith("sftp.") and method[5:] in AGENT_SFTP_METHODS:
+                if ssh_conn.sftp is None:
+                    return {"type": "result", "error": "No SFTP connection"}
+                value = getattr(ssh_conn.sftp, method[5:])(*args, **kwargs)
+                if isinstance(value, paramiko.SFTPAttributes):
+                    value = None
+            else:
+                return {"type": "result", "error": "Unknown agent method: " + method}
+        except (OSError, paramiko.SSHException) as e:
+            return {"type": "result", "error": str(e), "os_error": True}
+        finally:
+            ssh_conn.close()
+
+        return {"type": "result", "value": value}
+
+    def stop(self) -> None:
+        """Stop the agent after the current calls"""
+
+        self._stop.set()
+
+
+def call_agent(
+    socket_path: str,
+    method: str,
+    conn_args: Optional[dict] = None,
+    *args,
+    stdin: Optional[StdinData] = None,
+    on_output: Optional[OutputCallback] = None,
+    on_progress: Optional[UploadCallback] = None,
+    **kwargs,
+) -> Tuple[Any, str]:
+    """Run a method in the agent
+
+    Returns the value returned by the method and an error message.
+    """
+
+    message = {
+        "type": "call",
+        "method": method,
+        "conn": conn_args or {},
+        "args": list(args),
+        "kwargs": kwargs,
+        "stdin": stdin is not None,
+        "output": on_output is not None,
+        "progress": on_progress is not None,
+    }
+
+    try:
+        agent_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        agent_sock.connect(socket_path)
+    except OSError as e:
+        return None, f"Can not connect to the agent: {str(e)}"
+
+    with agent_sock, agent_sock.makefile("rwb") as agent_file:
+        sock_file = cast(BinaryIO, agent_file)
+        writer: Optional[threading.Thread] = None
+
+        try:
+            _send_frame(sock_file, message)
+
+            if stdin is not None:
+                # the output is read while the input is sent
+                writer = threading.Thread(
+                    target=_send_stdin,
+                    args=(sock_file, stdin),
+                    name="kaajal-agent-stdin",
+                    daemon=True,
+                )
+                writer.start()
+
+            while True:
+                reply = _read_frame(sock_file)[0]
+                if reply["type"] == "output" and on_output is not None:
+                    on_output(reply["stream"], reply["line"])
+                elif reply["type"] == "progress" and on_progress is not None:
+                    on_progress(reply["done"], reply["total"])
+                elif reply["type"] == "result":
+                    break
+        except (EOFError, OSError, ValueError) as e:
+            return None, f"Agent call failed: {str(e)}"
+
+        if writer is not None:
+            writer.join()
+
+    if reply.get("os_error"):
+        raise OSError(reply["error"])
+
+    return reply.get("value"), reply.get("error", "")
+
+
+def _send_stdin(sock_file: BinaryIO, stdin: StdinData) -> None:
+    """Send the input of a command to the agent"""
+
+    try:
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+        if isinstance(stdin, bytes):
+            for offset in range(0, len(stdin), SEND_SIZE):
+                _send_frame(
+                    sock_file, {"type": "stdin"}, stdin[offset : offset + SEND_SIZE]
+                )
+        else:
+            for data in iter(lambda: stdin.read(SEND_SIZE), b""):
+                _send_frame(sock_file, {"type": "stdin"}, data)
+        _send_frame(sock_file, {"type": "stdin"})
+    except OSError as e:
+        # the command ended before reading all
+        logger.debug("Input not sent to the agent: %s", str(e))
+
+
+def is_agent_running(socket_path: str = "") -> bool:
+    """True if an agent answers on the socket"""
+
+    socket_path = socket_path or get_socket_path()
+
+    if not socket_path or not os.path.exists(socket_path):
+        return False
+
+    return not call_agent(socket_path, "ping")[1]
+
+
+def start_agent(max_idle: float = AGENT_MAX_IDLE) -> str:
+    """Start an agent in the background
+
+    Returns an error message.
+    """
+
+    if is_agent_running():
+        return ""
+
+    try:
+        subprocess.Popen(  # nosec B603
+            [sys.executable, "-m", "kaajal", "agent", "--foreground"]
+            + ["--max-idle", str(max_idle)],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+    except OSError as e:
+        return_message = "Can not start the agent: " + str(e)
+        logger.warning(return_message)
+        return return_message
+
+    deadline = time.monotonic() + AGENT_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if is_agent_running():
+            return ""
+        time.sleep(0.1)
+
+    return "The agent did not start"
+
+
+def stop_agent() -> str:
+    """Stop the agent
+
+    Returns an error message.
+    """
+
+    if not is_agent_running():
+        return "No agent running"
+
+    return call_agent(get_socket_path(), "stop")[1]
+
+
+class _AgentSFTP:
+    """SFTP client whose methods run in the agent"""
+
+    def __init__(self, ssh_conn: "AgentConnection") -> None:
+        """Class constructor of agent SFTP"""
+
+        self.ssh_conn = ssh_conn
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in AGENT_SFTP_METHODS:
+            raise AttributeError(name + " is not available through the agent")
+
+        def call(*args, **kwargs) -> Any:
+            call_args = list(args)
+            if name in AGENT_SFTP_LOCAL_PATHS:
+                index = AGENT_SFTP_LOCAL_PATHS[name]
+                if "localpath" in kwargs:
+                    kwargs["localpath"] = os.path.abspath(kwargs["localpath"])
+                elif len(call_args) > index:
+                    call_args[index] = os.path.abspath(call_args[index])
+            value, error_msg = self.ssh_conn._call("sftp." + name, *call_args, **kwargs)
+            if error_msg:
+                raise paramiko.SSHException(error_msg)
+            return value
+
+        return call
+
+
+class AgentConnection(SSHConnection):
+    """SSH connection whose transport is kept by the agent"""
+
+    def __init__(self, socket_path: str = "") -> None:
+        """Class constructor of Agent Connection"""
+
+        super().__init__()
+        self.socket_path = socket_path or get_socket_path()
+        self._conn_args: dict = {}
+
+    def _call(self, method: str, *args, **kwargs) -> Tuple[Any, str]:
+        """Run a method of the connection in the agent"""
+
+        return call_agent(self.socket_path, method, self._conn_args, *args, **kwargs)
+
+    def close(self) -> None:
+        """Close SSH connection, the agent keeps the transport"""
+
+        if self.is_connected:
+            self.sftp = None
+            self.is_connected = False
+            self.username = ""
+            self.hostname = ""
+            self.home = ""
+            logger.info("Closing agent connection")
+
+    def _connect(self, **conn_args) -> str:
+        """SSH Connect using parameters, through the agent"""
+
+        if self.is_connected:
+            return "You are already connected."
+
+        self._conn_args = conn_args
+        home, return_message = self._call("get_home")
+
+        if return_message:
+            logger.warning(return_message)
+            return return_message
+
+        self.is_connected = True
+        self.home = home
+        self.sftp = cast(paramiko.SFTPClient, _AgentSFTP(self))
+        self.username = conn_args["username"]
+        self.hostname = conn_args["hostname"]
+        self.port = conn_args.get("port", 22)
+        logger.info("SSH connected to %s through the agent", self.hostname)
+
+        return ""
+
+    def host_key_fingerprint(self) -> str:
+        """Get the SHA256 fingerprint of the host key of the server"""
+
+        return self._call("host_key_fingerprint")[0] or ""
+
+    def exec(
+        self,
+        command,
+        bufsize=-1,
+        timeout=None,
+        get_pty=False,
+        environment=None,
+        on_output: Optional[OutputCallback] = None,
+        stdin: Optional[StdinData] = None,
+    ) -> CommandResult:
+        """Execute a command on the SSH server through the agent"""
+
+        result = CommandResult(command)
+
+        if not self.is_connected:
+            result.error = "Not connected to a SSH server"
+            return result
+
+        value, result.error = self._call(
+            "exec",
+            command,
+            bufsize,
+            timeout,
+            get_pty,
+            environment,
+            stdin=stdin,
+            on_output=on_output,
+        )
+
+        if value is not None:
+            vars(result).update(value)
+
+        return result
+
+    def stat(self, path: str, show_except: bool = False) -> int:
+        """Check if a file exists"""
+
+        return self._call("stat", path, show_except)[0] or 0
+
+    def read_file(self, path: str) -> Tuple[str, str]:
+        """Read a text file of the server with SFTP"""
+
+        value, error_msg = self._call("read_file", path)
+
+        if error_msg:
+            return "", error_msg
+
+        return value[0], value[1]
+
+    def write_file(
+        self,
+        path: str,
+        content: str,
+        mode: int = 0o600,
+        owner: Optional[Tuple[int, int]] = None,
+    ) -> str:
+        """Write a text file of the server with SFTP"""
+
+        value, error_msg = self._call("write_file", path, content, mode, owner)
+
+        return error_msg or value
+
+    def makedirs(
+        self, path: str, mode: int = 0o700, owner: Optional[Tuple[int, int]] = None
+    ) -> str:
+        """Create a directory of the server and its parents with SFTP"""
+
+        value, error_msg = self._call("makedirs", path, mode, owner)
+
+        return error_msg or value
+
+    def upload(self, local_path: str, remote_path: str, *args, **kwargs) -> str:
+        """Upload a file with several SFTP channels of the agent"""
+
+        on_progress = kwargs.pop("on_progress", None)
+        value, error_msg = self._call(
+            "upload",
+            os.path.abspath(local_path),
+            remote_path,
+            *args,
+            on_progress=on_progress,
+            **kwargs,
+        )
+
+        return error_msg or value
+
+
+def connect_agent(config: dict) -> Optional[AgentConnection]:
+    """Connect through the agent if it is running
+
+    Returns None if there is no agent or it can not connect.
+    """
+
+    if not is_agent_running():
+        return None
+
+    ssh_conn = AgentConnection()
+
+    if ssh_conn.connect(config):
+        return None
+
+    return ssh_conn
@@ -0,0 +1,284 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal asyncio functions
+
+The blocking paramiko calls of SSHConnection and Distro are run on a
+bounded thread pool, so one event loop can drive many hosts while the
+number of threads stays fixed.
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+from kaajal.connection import CommandResult
+from kaajal.connection import ConnectionPool
+from kaajal.connection import OutputCallback
+from kaajal.connection import SSHConnection
+from kaajal.distro import Distro
+from kaajal.distro import NewUser
+from kaajal.mirror import MirrorCache
+from kaajal.repos import DEFAULT_CLONE_JOBS
+from kaajal.repos import ProgressCallback
+from kaajal.repos import Repo
+from kaajal.repos import RepoResult
+from kaajal.sync import SYNC_BLOCK_SIZE
+from kaajal.sync import SyncResult
+from kaajal.tarball import Tarball
+from kaajal.tarball import TarballResult
+
+logger = logging.getLogger(__name__)
+
+# Max number of blocking calls running at the same time
+MAX_WORKERS = 32
+
+_T = TypeVar("_T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Get the executor used to run the blocking calls"""
+
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix="kaajal-aio"
+            )
+        return _executor
+
+
+def set_max_workers(max_workers: int) -> None:
+    """Set the max number of blocking calls running at the same time"""
+
+    global _executor
+    global MAX_WORKERS
+
+    with _executor_lock:
+        MAX_WORKERS = max(1, max_workers)
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+async def run_blocking(func: Callable[..., _T], *args: Any, **kwargs: Any) -> _T:
+    """Run a blocking function on the executor and wait for it"""
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+class AsyncSSHConnection:
+    """asyncio front end of SSH Connection"""
+
+    def __init__(
+        self,
+        conn: Optional[SSHConnection] = None,
+        pool: Optional[ConnectionPool] = None,
+    ) -> None:
+        """Class constructor of async SSH Connection"""
+
+        self.conn = conn if conn is not None else SSHConnection(pool)
+
+    @property
+    def is_connected(self) -> bool:
+        return self.conn.is_connected
+
+    @property
+    def username(self) -> str:
+        return self.conn.username
+
+    @property
+    def home(self) -> str:
+        return self.conn.home
+
+    async def connect(self, config: dict) -> str:
+        """Connect to the server"""
+
+        return await run_blocking(self.conn.connect, config)
+
+    async def run(
+        self,
+        command: str,
+        timeout: Optional[float] = None,
+        get_pty: bool = False,
+        environment: Optional[dict] = None,
+        on_output: Optional[OutputCallback] = None,
+        stdin: Optional[str] = None,
+    ) -> CommandResult:
+        """Execute a command on the SSH server
+
+        on_output is called from a worker thread of the executor.
+        """
+
+        return await run_blocking(
+            self.conn.exec,
+            command,
+            timeout=timeout,
+            get_pty=get_pty,
+            environment=environment,
+            on_output=on_output,
+            stdin=stdin,
+        )
+
+    async def run_batch(
+        self, probes: Dict[str, str], timeout: Optional[float] = None
+    ) -> Dict[str, CommandResult]:
+        """Execute several commands in one round trip"""
+
+        return await run_blocking(self.conn.exec_batch, probes, timeout)
+
+    async def stat(self, path: str, show_except: bool = False) -> int:
+        """Check if a file exists, see SSHConnection.stat"""
+
+        return await run_blocking(self.conn.stat, path, show_except)
+
+    async def close(self) -> None:
+        """Close SSH connection"""
+
+        await run_blocking(self.conn.close)
+
+
+class AsyncDistro:
+    """asyncio front end of Linux Distro"""
+
+    def __init__(self, distro: Optional[Distro] = None) -> None:
+        """Class constructor of async Linux distro"""
+
+        self.distro = distro if distro is not None else Distro()
+
+    def __getattr__(self, name: str) -> Any:
+        # id, name, pretty_name, pm, uid and sudo come from the distro
+        return getattr(self.distro, name)
+
+    def set_ssh_conn(self, conn: AsyncSSHConnection) -> None:
+        """Set the SSH connection object"""
+
+        if conn:
+            self.distro.set_ssh_conn(conn.conn)
+
+    async def identify(self) -> str:
+        """Identify the Linux distro"""
+
+        return await run_blocking(self.distro.identify)
+
+    async def update(self, on_output: Optional[OutputCallback] = None) -> str:
+        """Update the Linux distro"""
+
+        return await run_blocking(self.distro.update, on_output)
+
+    async def install(
+        self,
+        str_pkgs_list: str = "",
+        pkg_list_path: str = "",
+        on_output: Optional[OutputCallback] = None,
+    ) -> str:
+        """Install new packages in Linux distro"""
+
+        return await run_blocking(
+            self.distro.install, str_pkgs_list, pkg_list_path, on_output
+        )
+
+    async def clone_repos(
+        self,
+        repos: List[Repo],
+        jobs: int = DEFAULT_CLONE_JOBS,
+        depth: int = 0,
+        filter_spec: str = "",
+        on_progress: Optional[ProgressCallback] = None,
+        mirror_cache: Optional[MirrorCache] = None,
+    ) -> Tuple[List[RepoResult], str]:
+        """Clone git repositories"""
+
+        return await run_blocking(
+            self.distro.clone_repos,
+            repos,
+            jobs,
+            depth,
+            filter_spec,
+            on_progress,
+            mirror_cache,
+        )
+
+    async def install_tarballs(
+        self,
+        tarballs: List[Tarball],
+        on_output: Optional[OutputCallback] = None,
+        use_cache: bool = True,
+    ) -> Tuple[List[TarballResult], str]:
+        """Install tarballs streaming them into tar on the remote host"""
+
+        return await run_blocking(
+            self.distro.install_tarballs, tarballs, on_output, use_cache
+        )
+
+    async def sync_tree(
+        self,
+        local_dir: str,
+        remote_dir: str,
+        block_size: int = SYNC_BLOCK_SIZE,
+        on_output: Optional[OutputCallback] = None,
+    ) -> Tuple[Optional[SyncResult], str]:
+        """Copy a local directory to the remote host sending only the changes"""
+
+        return await run_blocking(
+            self.distro.sync_tree, local_dir, remote_dir, block_size, on_output
+        )
+
+    async def create_new_user(
+        self,
+        user: str = "",
+        password: str = "",
+        ssh_key: str = "",
+        github_token: str = "",
+    ) -> str:  # nosec B107 hardcoded_password_default
+        """Create a new user in Linux distro"""
+
+        return await run_blocking(
+            self.distro.create_new_user, user, password, ssh_key, github_token
+        )
+
+    async def create_users(self, users: List[NewUser]) -> Dict[str, str]:
+        """Create several users in Linux distro with one remote script"""
+
+        return await run_blocking(self.distro.create_users, users)
+
+    async def copy_ssh_key(self, ssh_key_path: str = "", user: str = "current") -> str:
+        """Copy SSH key to authorized_keys"""
+
+        return await run_blocking(self.distro.copy_ssh_key, ssh_key_path, user)
+
+    async def copy_ssh_keys(
+        self, ssh_key_paths: List[str], user: str = "current"
+    ) -> str:
+        """Copy SSH keys to authorized_keys"""
+
+        return await run_blocking(self.distro.copy_ssh_keys, ssh_key_paths, user)
+
+    async def copy_github_token(
+        self, github_token_path: str = "", user: str = "current"
+    ) -> str:  # nosec B107 hardcoded_password_default
+        """Copy GitHub Token"""
+
+        return await run_blocking(
+            self.distro.copy_github_token, github_token_path, user
+        )
@@ -10,13 +10,40 @@
 import logging
 import os
 import sys
+import time
 from platform import system
 
 import click
 from kaajal.__about__ import __appname__
 from kaajal.__about__ import __version__
+from kaajal.agent import AGENT_MAX_IDLE
+from kaajal.agent import Agent
+from kaajal.agent import start_agent
+from kaajal.agent import stop_agent
 from kaajal.cli.main import cli_main
+from kaajal.cli.main import cli_options
+from kaajal.cli.main import cli_plan
+from kaajal.cli.main import cli_repo
+from kaajal.cli.main import cli_sync
+from kaajal.cli.main import cli_tarball
 from kaajal.config import app_config
+from kaajal.distro import METADATA_MAX_AGE
+from kaajal.facts import facts_cache
+from kaajal.fleet import DEFAULT_JOBS
+from kaajal.fleet import SCAN_TIMEOUT
+from kaajal.fleet import load_inventory
+from kaajal.fleet import run_fleet
+from kaajal.fleet import summary
+from kaajal.journal import step_journal
+from kaajal.plan import DEFAULT_PLAN_JOBS
+from kaajal.plan import load_plan
+from kaajal.repos import DEFAULT_CLONE_JOBS
+from kaajal.repos import load_repo_list
+from kaajal.repos import parse_repo_items
+from kaajal.sync import SYNC_BLOCK_SIZE
+from kaajal.tarball import DIR_COMPRESSIONS
+from kaajal.tarball import load_tarball_list
+from kaajal.tarball import parse_tarball_items
 
 logger = logging.getLogger(__name__)
 
@@ -41,6 +68,31 @@ logger = logging.getLogger(__name__)
     help="Log level (notset, debug, info, warning, error, critical)",
 )
 @click.option("--log-file", help="Filename to save logs")
+@click.option(
+    "--refresh-facts",
+    is_flag=True,
+    help="Identify the remote hosts again, ignoring the facts cache",
+)
+@click.option(
+    "--remote-helper",
+    is_flag=True,
+    help="Run the remote operations in a helper on one channel of the connection",
+)
+@click.option(
+    "--local",
+    is_flag=True,
+    help="Provision the machine kaajal runs on, without SSH",
+)
+@click.option(
+    "--rerun-steps",
+    is_flag=True,
+    help="Run again the steps done by a previous run, ignoring the step journal",
+)
+@click.option(
+    "--remote-journal",
+    is_flag=True,
+    help="Keep a copy of the step journal of a plan on the remote host",
+)
 @click.pass_context
 def kaajal(ctx, **kwargs) -> None:
     """Kaajal: setup a remote platform"""
@@ -51,6 +103,18 @@ def kaajal(ctx, **kwargs) -> None:
 
     app_config.load_log_config(kwargs["log_level"], kwargs["log_file"])
 
+    if kwargs["refresh_facts"]:
+        # every cached entry is expired
+        facts_cache.ttl = 0
+
+    if kwargs["rerun_steps"]:
+        # every done step is expired
+        step_journal.ttl = 0
+
+    cli_options["remote_helper"] = kwargs["remote_helper"]
+    cli_options["remote_journal"] = kwargs["remote_journal"]
+    cli_options["local"] = kwargs["local"]
+
     my_system_os = system()
 
     display = "Allow GUI"
@@ -68,10 +132,10 @@ def kaajal(ctx, **kwargs) -> None:
             sys.exit(kaajalw(False))
             return
 
-    app_config.print_conn()
+        app_config.print_conn()
 
-    print("load main")
-    cli_main()
+        print("load main")
+        cli_main()
 
 
 @kaajal.command()
@@ -91,16 +155,270 @@ def package(ctx) -> None:
 
 
 @kaajal.command()
+@click.argument("repos", nargs=-1)
+@click.option("--repo-list", default="", help="Repo's list file")
+@click.option(
+    "-j",
+    "--jobs",
+    default=DEFAULT_CLONE_JOBS,
+    show_default=True,
+    help="Number of repos cloned at the same time",
+)
+@click.option("--depth", default=0, help="Make shallow clones with this depth")
+@click.option(
+    "--filter", "filter_spec", default="", help="Partial clone filter (blob:none)"
+)
+@click.option(
+    "--mirror",
+    is_flag=True,
+    help="Send the repos from the local mirror cache as git bundles",
+)
+@click.pass_context
+def repo(ctx, repos, repo_list, jobs, depth, filter_spec, mirror) -> None:
+    """Clone git repositories
+
+    REPOS are "URL[ path]" items, the path is relative to the remote home.
+    """
+
+    repo_objs = parse_repo_items(list(repos))
+
+    if repo_list:
+        list_repos, error_msg = load_repo_list(repo_list)
+        if error_msg:
+            raise click.ClickException(error_msg)
+        repo_objs += list_repos
+
+    if not repo_objs:
+        raise click.ClickException("No repos provided to clone")
+
+    error_msg = cli_repo(repo_objs, jobs, depth, filter_spec, mirror)
+
+    if error_msg:
+        raise click.ClickException(error_msg)
+
+
+@kaajal.command()
+@click.argument("tarballs", nargs=-1)
+@click.option("--tarball-list", default="", help="Tarball list file")
+@click.option(
+    "--compression",
+    type=click.Choice(DIR_COMPRESSIONS),
+    default="",
+    help="Compression of the archives made of local directories, also of the"
+    " tarball list entries that do not set it",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    help="Do not use the remote artifact cache for local archives",
+)
+@click.pass_context
+def tarball(ctx, tarballs, tarball_list, compression, no_cache) -> None:
+    """Install tarball
+
+    TARBALLS are "source[ path]" items, the source is a local archive, a
+    local directory or a http(s) URL, the path is relative to the remote
+    home.
+    """
+
+    tarball_objs = parse_tarball_items(list(tarballs))
+
+    for tarball_obj in tarball_objs:
+        tarball_obj.compression = compression
+
+    if tarball_list:
+        list_tarballs, error_msg = load_tarball_list(tarball_list)
+        if error_msg:
+            raise click.ClickException(error_msg)
+        for tarball_obj in list_tarballs:
+            tarball_obj.compression = tarball_obj.compression or compression
+        tarball_objs += list_tarballs
+
+    if not tarball_objs:
+        raise click.ClickException("No tarballs provided to install")
+
+    error_msg = cli_tarball(tarball_objs, not no_cache)
+
+    if error_msg:
+        raise click.ClickException(error_msg)
+
+
+@kaajal.command()
+@click.argument("local_dir", type=click.Path(exists=True, file_okay=False))
+@click.argument("remote_dir")
+@click.option(
+    "--block-size",
+    default=SYNC_BLOCK_SIZE,
+    show_default=True,
+    help="Size of the blocks compared between the files",
+)
+@click.pass_context
+def sync(ctx, local_dir, remote_dir, block_size) -> None:
+    """Sync directory
+
+    Copy LOCAL_DIR to REMOTE_DIR sending only the blocks that changed,
+    REMOTE_DIR is relative to the remote home.
+    """
+
+    error_msg = cli_sync(local_dir, remote_dir, block_size)
+
+    if error_msg:
+        raise click.ClickException(error_msg)
+
+
+@kaajal.command()
+@click.argument("plan_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-j",
+    "--jobs",
+    default=DEFAULT_PLAN_JOBS,
+    show_default=True,
+    help="Number of steps run at the same time",
+)
+@click.pass_context
+def plan(ctx, plan_file, jobs) -> None:
+    """Run a plan file
+
+    The steps of PLAN_FILE run when the steps they need ended well, the
+    steps that do not need each other run at the same time.
+    """
+
+    tasks, error_msg = load_plan(plan_file)
+
+    if error_msg:
+        raise click.ClickException(error_msg)
+
+    if not tasks:
+        raise click.ClickException(plan_file + ": no steps found")
+
+    error_msg = cli_plan(tasks, jobs)
+
+    if error_msg:
+        raise click.ClickException(error_msg)
+
+
+@kaajal.command()
+@click.argument("inventory")
+@click.option(
+    "-j",
+    "--jobs",
+    default=DEFAULT_JOBS,
+    show_default=True,
+    help="Number of hosts provisioned at the same time",
+)
+@click.option(
+    "--packages", default="git tmux vim", show_default=True, help="Packages to install"
+)
+@click.option("--pkg-list", default="", help="Packages's list file")
+@click.option(
+    "--metadata-max-age",
+    default=METADATA_MAX_AGE,
+    show_default=True,
+    help="Seconds the package metadata is not refreshed, 0 to always refresh",
+)
+@click.option(
+    "--scan-timeout",
+    default=SCAN_TIMEOUT,
+    show_default=True,
+    help="Seconds to wait for the SSH port of the hosts, 0 to not scan them",
+)
+@click.pass_context
+def fleet(
+    ctx, inventory, jobs, packages, pkg_list, metadata_max_age, scan_timeout
+) -> None:
+    """Provision all the hosts of an inventory file"""
+
+    hosts, error_msg = load_inventory(inventory, app_config.conn_config)
+
+    if error_msg:
+        raise click.ClickException(error_msg)
+
+    if not hosts:
+        raise click.ClickException(inventory + ": no hosts found")
+
+    click.echo(f"Provisioning {len(hosts)} hosts, {jobs} at the same time")
+
+    def echo_result(result) -> None:
+        status = "ok" if result.ok else result.failed_step + " failed"
+        click.echo(f"{result.host}: {status} ({result.duration:.1f} s)")
+
+    start = time.monotonic()
+    results = run_fleet(
+        hosts,
+        packages,
+        pkg_list,
+        jobs,
+        metadata_max_age=metadata_max_age,
+        on_result=echo_result,
+        journal=step_journal,
+        scan_timeout=scan_timeout,
+    )
+
+    click.echo(summary(results, time.monotonic() - start))
+
+    if not all(result.ok for result in results):
+        ctx.exit(1)
+
+
+@kaajal.command()
+@click.option("--clear", is_flag=True, help="Remove the cached facts")
+@click.option("--host-id", default="", help="Only this host (user@host:port)")
+@click.pass_context
+def facts(ctx, clear, host_id) -> None:
+    """Show or clear the cached distro facts of the remote hosts"""
+
+    if clear:
+        removed = facts_cache.invalidate(host_id)
+        click.echo(f"Removed the facts of {removed} hosts")
+        return
+
+    for cached_host_id, age in sorted(facts_cache.hosts().items()):
+        if host_id and host_id != cached_host_id:
+            continue
+        click.echo(f"{cached_host_id}  {age / 3600:.1f} hours old")
+
+
+@kaajal.command()
+@click.option("--clear", is_flag=True, help="Remove the done steps")
+@click.option("--host-id", default="", help="Only this host (user@host:port)")
 @click.pass_context
-def repo(ctx) -> None:
-    """Clone git repositories"""
+def journal(ctx, clear, host_id) -> None:
+    """Show or clear the steps done on the remote hosts"""
+
+    if clear:
+        removed = step_journal.forget(host_id)
+        click.echo(f"Removed {removed} done steps")
+        return
 
-    click.echo("TODO repos")
+    for journal_host_id, count in sorted(step_journal.hosts().items()):
+        if host_id and host_id != journal_host_id:
+            continue
+        click.echo(f"{journal_host_id}  {count} steps done")
 
 
 @kaajal.command()
+@click.option("--stop", is_flag=True, help="Stop the running agent")
+@click.option(
+    "--max-idle",
+    default=AGENT_MAX_IDLE,
+    show_default=True,
+    help="Seconds without calls before the agent exits",
+)
+@click.option("--foreground", is_flag=True, help="Do not run in the background")
 @click.pass_context
-def tarball(ctx) -> None:
-    """Install tarball"""
+def agent(ctx, stop, max_idle, foreground) -> None:
+    """Connection agent
+
+    Keep the SSH connections open in a background process, so the next
+    kaajal commands skip the key exchange and the authentication.
+    """
+
+    if stop:
+        error_msg = stop_agent()
+    elif foreground:
+        error_msg = Agent(max_idle=max_idle).serve()
+    else:
+        error_msg = start_agent(max_idle)
 
-    click.echo("TODO tarball")
+    if error_msg:
+        raise click.ClickException(error_msg)
@@ -8,21 +8,49 @@
 """Kaajal cli functions"""
 
 import logging
+from typing import List
+from typing import Tuple
 
 import click
+from kaajal.agent import connect_agent
 from kaajal.config import app_config
 from kaajal.connection import SSHConnection
+from kaajal.connection import conn_pool
 from kaajal.distro import Distro
+from kaajal.facts import facts_cache
+from kaajal.journal import step_journal
+from kaajal.local import LocalConnection
+from kaajal.mirror import mirror_cache
+from kaajal.plan import PlanCompiler
+from kaajal.plan import PlanExecutor
+from kaajal.plan import PlanTask
+from kaajal.plan import summary as plan_summary
+from kaajal.repos import Repo
+from kaajal.repos import summary
+from kaajal.rpc import HelperConnection
+from kaajal.sync import summary as sync_summary
+from kaajal.tarball import Tarball
+from kaajal.tarball import summary as tarball_summary
 
 logger = logging.getLogger(__name__)
 
+# Run the remote operations in the remote helper, keep a copy of the
+# step journal on the remote host, provision the local machine
+cli_options = {"remote_helper": False, "remote_journal": False, "local": False}
+
 
 def close_all(conn: SSHConnection) -> None:
     conn.close()
+    conn_pool.close_all()
     app_config.save_conn_config()
     app_config.save_log_config()
 
 
+def echo_output(stream: str, line: str) -> None:
+    """Print a line of output of a remote command"""
+    click.echo(line, err=stream == "stderr")
+
+
 def ask_conn_value(prompt: str, key: str, hidden: bool = False) -> None:
     """Ask the config value"""
     value = app_config.conn_config[key]
@@ -61,38 +89,158 @@ def ask_for_parameters() -> None:
         app_config.conn_config["connection_type"] = "SSH host"
 
 
-def cli_main() -> None:
-    """Ensure everething is setup well"""
+def connect_distro() -> Tuple[SSHConnection, Distro, str]:
+    """Connect to the remote host and identify its distro
+
+    Returns the connection, the distro and an error message.
+    """
+
+    agent_conn = None
 
-    if not app_config.get_conn_type():
-        ask_for_parameters()
+    # the local machine needs no connection values
+    if not cli_options["local"]:
+        if not app_config.get_conn_type():
+            ask_for_parameters()
+
+        # the transport kept by the agent skips the key exchange and the auth
+        agent_conn = connect_agent(app_config.conn_config)
+
+    if cli_options["local"]:
+        ssh_conn: SSHConnection = LocalConnection()
+    elif agent_conn is not None:
+        ssh_conn = agent_conn
+    elif cli_options["remote_helper"]:
+        ssh_conn = HelperConnection(conn_pool)
+    else:
+        ssh_conn = SSHConnection(conn_pool)
 
-    ssh_conn = SSHConnection()
     distro = Distro()
     distro.set_ssh_conn(ssh_conn)
+    distro.set_facts_cache(facts_cache)
 
-    error_msg = ssh_conn.connect(app_config.conn_config)
-
-    if error_msg:
-        close_all(ssh_conn)
-        return
+    if agent_conn is None:
+        error_msg = ssh_conn.connect(app_config.conn_config)
+        if error_msg:
+            return ssh_conn, distro, error_msg
 
     error_msg = distro.identify()
 
     if error_msg and not error_msg.startswith("Sorry"):
-        close_all(ssh_conn)
-        return
+        return ssh_conn, distro, error_msg
+
+    return ssh_conn, distro, ""
+
+
+def cli_main() -> None:
+    """Ensure everething is setup well"""
 
-    error_msg = distro.update()
+    ssh_conn, distro, error_msg = connect_distro()
 
     if error_msg:
         close_all(ssh_conn)
         return
 
-    error_msg = distro.install("git tmux vim")
+    # the update and the install run as one remote script
+    plan, error_msg = PlanCompiler(distro).compile("git tmux vim")
 
     if error_msg:
+        logger.warning(error_msg)
         close_all(ssh_conn)
         return
 
+    plan_result = plan.run(ssh_conn, on_output=echo_output, journal=step_journal)
+    click.echo(plan_summary(plan_result))
+
     close_all(ssh_conn)
+
+
+def cli_repo(
+    repos: List[Repo], jobs: int, depth: int, filter_spec: str, mirror: bool = False
+) -> str:
+    """Clone the repos on the remote host
+
+    If mirror is True, the repos are sent from the local mirror cache.
+    """
+
+    def echo_progress(repo: Repo, message: str) -> None:
+        click.echo(f"{repo.get_path()}: {message}")
+
+    ssh_conn, distro, error_msg = connect_distro()
+
+    if not error_msg:
+        results, error_msg = distro.clone_repos(
+            repos,
+            jobs,
+            depth,
+            filter_spec,
+            echo_progress,
+            mirror_cache if mirror else None,
+        )
+        if results:
+            click.echo(summary(results))
+
+    close_all(ssh_conn)
+
+    return error_msg
+
+
+def cli_tarball(tarballs: List[Tarball], use_cache: bool = True) -> str:
+    """Install the tarballs on the remote host"""
+
+    ssh_conn, distro, error_msg = connect_distro()
+
+    if not error_msg:
+        results, error_msg = distro.install_tarballs(tarballs, echo_output, use_cache)
+        if results:
+            click.echo(tarball_summary(results))
+
+    close_all(ssh_conn)
+
+    return error_msg
+
+
+def cli_sync(local_dir: str, remote_dir: str, block_size: int) -> str:
+    """Copy a local directory to the remote host"""
+
+    ssh_conn, distro, error_msg = connect_distro()
+
+    if not error_msg:
+        result, error_msg = distro.sync_tree(
+            local_dir, remote_dir, block_size, echo_output
+        )
+        if result is not None:
+            click.echo(sync_summary(result))
+
+    close_all(ssh_conn)
+
+    return error_msg
+
+
+def cli_plan(tasks: List[PlanTask], jobs: int) -> str:
+    """Run the steps of a plan file on the remote host"""
+
+    ssh_conn, distro, error_msg = connect_distro()
+
+    def echo_step(step_result) -> None:
+        if step_result.skipped:
+            click.echo(f"{step_result.name}: done by a previous run")
+            return
+        status = "done" if step_result.ok else "failed"
+        click.echo(f"{step_result.name}: {status} ({step_result.duration:.1f} s)")
+
+    if not error_msg:
+        executor = PlanExecutor(
+            distro,
+            jobs,
+            echo_output,
+            echo_step,
+            step_journal,
+            cli_options["remote_journal"],
+        )
+        result = executor.run(tasks)
+        click.echo(plan_summary(result))
+        error_msg = result.error
+
+    close_all(ssh_conn)
+
+    return error_msg
@@ -7,8 +7,11 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Kaajal configure functions"""
 
+import json
 import logging
 import os
+import tempfile
+import threading
 from typing import Optional
 
 
@@ -286,3 +289,80 @@ class Config:
 
 
 app_config = Config()
+
+
+class JsonCache:
+    """Dictionary saved as a JSON file, by default in the user config dir
+
+    The file is written to a temporary file of the same directory, which
+    replaces it, so kaajal processes running at the same time never read
+    a file half written.
+    """
+
+    # name of the file in the user config dir
+    file_name = ""
+    # what the file is, used in the messages
+    description = "cache"
+
+    def __init__(self, path: str = "") -> None:
+        """Class constructor of JSON Cache
+
+        If path is not given, the file is saved in the user config dir.
+        """
+
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get_path(self) -> str:
+        """Get the path of the file, empty if there is not any"""
+
+        if self.path:
+            return self.path
+
+        if app_config.user_config_dir and self.file_name:
+            return os.path.join(app_config.user_config_dir, self.file_name)
+
+        return ""
+
+    def _load(self) -> dict:
+        """Read the file"""
+
+        path = self.get_path()
+
+        if not path or not os.path.exists(path):
+            return {}
+
+        try:
+            with open(path, encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logger.warning("%s: can not read %s: %s", path, self.description, str(e))
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+
+        return entries
+
+    def _save(self, entries: dict) -> None:
+        """Write the file"""
+
+        path = self.get_path()
+
+        if not path:
+            return
+
+        tmp_path = ""
+
+        try:
+            os.makedirs(os.path.dirname(path) or ".", mode=0o750, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=os.path.basename(path) + ".", dir=os.path.dirname(path) or "."
+            )
+            with os.fdopen(fd, mode="w", encoding="utf-8") as cache_file:
+                json.dump(entries, cache_file, indent=1)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("%s: can not save %s: %s", path, self.description, str(e))
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
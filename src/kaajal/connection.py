@@ -7,52 +7,382 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Kaajal connection functions"""
 
+import base64
+import functools
+import hashlib
 import logging
 import os
+import re
+import secrets
+import shlex
 import socket
-from typing import Any
+import threading
+import time
+from collections import deque
+from typing import BinaryIO
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterable
+from typing import List
 from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import paramiko
-from paramiko.channel import ChannelFile
-from paramiko.channel import ChannelStderrFile
-from paramiko.channel import ChannelStdinFile
 from paramiko.config import SSHConfig
 
 logger = logging.getLogger(__name__)
 
+# Seconds an unused connection is kept alive in the pool
+POOL_MAX_IDLE = 300.0
+
+# Size of the reads from the channel of a command
+RECV_SIZE = 32768
+
+# Max seconds to sleep while waiting for command output
+POLL_INTERVAL = 0.05
+
+# Lines of output kept in the result of a streamed command
+OUTPUT_TAIL_LINES = 200
+
+# Size of the writes to the stdin of a command
+SEND_SIZE = 262144
+
+# Max data of a SFTP write request
+SFTP_REQUEST_SIZE = paramiko.SFTPFile.MAX_REQUEST_SIZE
+
+# Size of the ranges of a file written by every SFTP channel of an upload
+UPLOAD_CHUNK_SIZE = 8388608
+
+# SFTP channels of an upload
+UPLOAD_STREAMS = 4
+
+# Window and max packet sizes of the SFTP channels of an upload
+UPLOAD_WINDOW_SIZE = 16777216
+UPLOAD_PACKET_SIZE = 32768
+
+# Suffix of a file being uploaded and of the list of its ranges written
+UPLOAD_PART_SUFFIX = ".kaajal-part"
+UPLOAD_DONE_SUFFIX = ".done"
+
+# hostname, username, port, key filename, hash of the password
+PoolKey = Tuple[str, str, int, str, str]
+
+# End of a line of output, progress lines end with a carriage return
+LINE_END_RE = re.compile(b"\r\n|\r|\n")
+
+# Called with the stream name ("stdout" or "stderr") and a line of output
+OutputCallback = Callable[[str, str], None]
+
+# Input of a command: text, bytes or a binary file read until its end
+StdinData = Union[str, bytes, BinaryIO]
+
+# Called with the bytes uploaded and the size of the file
+UploadCallback = Callable[[int, int], None]
+
+
+class CommandResult:
+    """Result of a command executed on the SSH server"""
+
+    def __init__(self, command: str = "") -> None:
+        """Class constructor of Command Result"""
+
+        self.command = command
+        self.stdout = ""
+        self.stderr = ""
+        # -1 if the command was not executed or no exit status was received
+        self.exit_status = -1
+        # Seconds spent executing the command
+        self.duration = 0.0
+        # Error message if the command could not be executed
+        self.error = ""
+
+    @property
+    def ok(self) -> bool:
+        """True if the command was executed and returned zero"""
+
+        return not self.error and self.exit_status == 0
+
+    def __repr__(self) -> str:
+        return (
+            f"CommandResult({self.command!r}, exit_status={self.exit_status}, "
+            f"duration={self.duration:.3f}, error={self.error!r})"
+        )
+
+
+class _OutputSink:
+    """Collect the output of one stream of a command
+
+    Without callback all the output is kept. With a callback every
+    complete line is passed to it and only the last OUTPUT_TAIL_LINES
+    lines are kept, so the memory used does not grow with the output.
+    A carriage return ends a line too, so the progress lines that a
+    command updates in place are passed as soon as they are printed.
+    """
+
+    def __init__(self, stream: str, on_output: Optional[OutputCallback]) -> None:
+        """Class constructor of output sink"""
+
+        self.stream = stream
+        self.on_output = on_output
+        self.chunks: List[bytes] = []
+        self.tail: Deque[str] = deque(maxlen=OUTPUT_TAIL_LINES)
+        self.partial = b""
+
+    def feed(self, data: bytes) -> None:
+        """Add data received from the channel"""
+
+        if self.on_output is None:
+            self.chunks.append(data)
+            return
+
+        data = self.partial + data
+        # a carriage return at the end can be the start of "\r\n"
+        end = len(data) - 1 if data.endswith(b"\r") else len(data)
+        lines = LINE_END_RE.split(data[:end])
+        self.partial = lines.pop() + data[end:]
+
+        # a line without end can not grow for ever
+        if len(self.partial) > RECV_SIZE:
+            lines.append(self.partial)
+            self.partial = b""
+
+        for line in lines:
+            self._emit(line)
+
+    def close(self) -> str:
+        """Flush the pending output and get the collected text"""
+
+        if self.on_output is None:
+            return b"".join(self.chunks).decode("utf-8", "replace")
+
+        if self.partial:
+            self._emit(self.partial)
+            self.partial = b""
+
+        return "".join(line + "\n" for line in self.tail)
+
+    def _emit(self, data: bytes) -> None:
+        """Pass a line to the callback and keep it in the tail"""
+
+        line = data.decode("utf-8", "replace").rstrip("\r")
+        self.tail.append(line)
+
+        if self.on_output is not None:
+            try:
+                self.on_output(self.stream, line)
+            except Exception:
+                logger.exception("Error in output callback")
+
+
+class _PoolEntry:
+    """Authenticated SSH client kept by the connection pool"""
+
+    def __init__(
+        self, client: paramiko.SSHClient, sftp: paramiko.SFTPClient, home: str
+    ) -> None:
+        """Class constructor of pool entry"""
+
+        self.client = client
+        self.sftp = sftp
+        self.home = home
+        # number of SSHConnection objects using this client
+        self.users = 0
+        self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """Pool of live SSH transports keyed by the resolved host config"""
+
+    def __init__(self, max_idle: float = POOL_MAX_IDLE) -> None:
+        """Class constructor of Connection Pool"""
+
+        self.max_idle = max_idle
+        self._entries: Dict[PoolKey, _PoolEntry] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(conn_args: dict) -> PoolKey:
+        """Build the pool key from paramiko connect arguments
+
+        The password and the passphrase of the key are part of the key, so
+        a client is only reused with the credential it was opened with.
+        """
+
+        credential = hashlib.sha256()
+        for name in ("password", "passphrase"):
+            credential.update(str(conn_args.get(name) or "").encode("utf-8") + b"\0")
+
+        return (
+            conn_args.get("hostname", ""),
+            conn_args.get("username", ""),
+            int(conn_args.get("port", 22)),
+            str(conn_args.get("key_filename", "")),
+            credential.hexdigest(),
+        )
+
+    def acquire(self, key: PoolKey) -> Optional[_PoolEntry]:
+        """Get a healthy pooled client, None if there is not any"""
+
+        self.evict_idle()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if not self._is_healthy(entry):
+                del self._entries[key]
+                self._close_entry(entry)
+                logger.debug("Dropped dead pooled connection to %s", key[0])
+                return None
+
+            sftp_channel = entry.sftp.get_channel()
+            if sftp_channel is None or sftp_channel.closed:
+                entry.sftp = entry.client.open_sftp()
+
+            entry.users += 1
+            entry.last_used = time.monotonic()
+
+        return entry
+
+    def add(
+        self,
+        key: PoolKey,
+        client: paramiko.SSHClient,
+        sftp: paramiko.SFTPClient,
+        home: str,
+    ) -> None:
+        """Add a new connected client to the pool"""
+
+        entry = _PoolEntry(client, sftp, home)
+        entry.users = 1
+
+        with self._lock:
+            old_entry = self._entries.get(key)
+            if old_entry is not None and old_entry.users == 0:
+                self._close_entry(old_entry)
+            self._entries[key] = entry
+
+    def release(self, key: PoolKey, client: paramiko.SSHClient, home: str) -> None:
+        """Give back a client to the pool"""
+
+        pooled = False
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.client is client:
+                entry.users = max(entry.users - 1, 0)
+                entry.last_used = time.monotonic()
+                if home:
+                    entry.home = home
+                pooled = True
+
+        # The client was replaced or evicted from the pool while in use
+        if not pooled:
+            client.close()
+
+        self.evict_idle()
+
+    def evict_idle(self) -> int:
+        """Close the connections unused for more than max_idle seconds"""
+
+        now = time.monotonic()
+        evicted = []
+
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry.users == 0 and now - entry.last_used > self.max_idle:
+                    evicted.append(self._entries.pop(key))
+
+        for entry in evicted:
+            self._close_entry(entry)
+
+        if evicted:
+            logger.debug("Evicted %d idle pooled connections", len(evicted))
+
+        return len(evicted)
+
+    def close_all(self) -> None:
+        """Close all the pooled connections"""
+
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+
+        for entry in entries:
+            self._close_entry(entry)
+
+    @staticmethod
+    def _is_healthy(entry: _PoolEntry) -> bool:
+        """Check if the transport of the entry is still alive"""
+
+        transport = entry.client.get_transport()
+
+        if transport is None or not transport.is_active():
+            return False
+
+        try:
+            transport.send_ignore()
+        except (EOFError, OSError, paramiko.SSHException):
+            return False
+
+        return True
+
+    @staticmethod
+    def _close_entry(entry: _PoolEntry) -> None:
+        """Close the SFTP session and client of the entry"""
+
+        try:
+            entry.sftp.close()
+        finally:
+            entry.client.close()
+
 
 class SSHConnection:
     """SSH Connection class"""
 
-    def __init__(self) -> None:
+    def __init__(self, pool: Optional[ConnectionPool] = None) -> None:
         """Class constructor of SSH Connection"""
 
         self.config = SSHConfig()
-        self.client = paramiko.SSHClient()
-
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # nosec B507
+        self.client = self._new_client()
         self.sftp: Optional[paramiko.SFTPClient] = None
 
+        # If set, live transports are reused through the pool
+        self.pool = pool
+        self._pool_key: Optional[PoolKey] = None
+
         self.is_connected = False
-        # stdin = 0, stdout = 1, stderr = 2
-        self.std: Union[
-            tuple[ChannelStdinFile, ChannelFile, ChannelStderrFile],
-            tuple[(Any, Any, Any)],
-        ] = (0, 1, 2)
 
         self.username: str = ""
+        self.hostname: str = ""
+        self.port: int = 22
         self.home: str = ""
 
+    @staticmethod
+    def _new_client() -> paramiko.SSHClient:
+        """Create a new paramiko SSH client"""
+
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())  # nosec B507
+        return client
+
     def close(self) -> None:
         """Close SSH connection"""
         if self.is_connected:
-            if self.sftp is not None:
-                self.sftp.close()
-            self.client.close()
+            if self.pool is not None and self._pool_key is not None:
+                self.pool.release(self._pool_key, self.client, self.home)
+                self._pool_key = None
+            else:
+                if self.sftp is not None:
+                    self.sftp.close()
+                self.client.close()
+            self.sftp = None
             self.is_connected = False
             self.username = ""
+            self.hostname = ""
             self.home = ""
             logger.info("Closing SSH connection")
 
@@ -168,6 +498,26 @@ class SSHConnection:
             return_message = "You are already connected."
             return return_message
 
+        pool_key: Optional[PoolKey] = None
+
+        if self.pool is not None:
+            pool_key = self.pool.make_key(conn_args)
+            entry = self.pool.acquire(pool_key)
+
+            if entry is not None:
+                self.client = entry.client
+                self.sftp = entry.sftp
+                self.home = entry.home
+                self.username = conn_args["username"]
+                self.hostname = conn_args["hostname"]
+                self.port = conn_args.get("port", 22)
+                self.is_connected = True
+                self._pool_key = pool_key
+                logger.info("SSH reused connection to %s", conn_args["hostname"])
+                return return_message
+
+        self.client = self._new_client()
+
         try:
             self.client.connect(**conn_args)
 
@@ -195,35 +545,259 @@ class SSHConnection:
             self.is_connected = True
             self.sftp = self.client.open_sftp()
             self.username = conn_args["username"]
-            self.exec("echo $HOME")
-            self.home = self.std[1].read().decode("utf-8").strip()
+            self.hostname = conn_args["hostname"]
+            self.port = conn_args.get("port", 22)
             logger.info("SSH connected to %s", conn_args["hostname"])
 
+            if self.pool is not None and pool_key is not None:
+                self.pool.add(pool_key, self.client, self.sftp, self.home)
+                self._pool_key = pool_key
+
         return return_message
 
+    def host_id(self) -> str:
+        """Get the identity of the connected host: user@host:port"""
+
+        return f"{self.username}@{self.hostname}:{self.port}"
+
+    def host_key_fingerprint(self) -> str:
+        """Get the SHA256 fingerprint of the host key of the server"""
+
+        transport = self.client.get_transport()
+
+        if not self.is_connected or transport is None:
+            return ""
+
+        digest = hashlib.sha256(transport.get_remote_server_key().asbytes()).digest()
+        return "SHA256:" + base64.b64encode(digest).decode("ascii").rstrip("=")
+
+    def get_home(self) -> str:
+        """Get the home directory of the connected user"""
+
+        if not self.home and self.is_connected:
+            self.home = self.exec("echo $HOME").stdout.strip()
+
+        return self.home
+
     def exec(
-        self, command, bufsize=-1, timeout=None, get_pty=False, environment=None
-    ) -> str:
-        """Execute a command on the SSH server"""
+        self,
+        command,
+        bufsize=-1,
+        timeout=None,
+        get_pty=False,
+        environment=None,
+        on_output: Optional[OutputCallback] = None,
+        stdin: Optional[StdinData] = None,
+    ) -> CommandResult:
+        """Execute a command on the SSH server
 
-        return_message = ""
+        Every call opens its own channel on the transport, so several
+        commands can run at the same time from different threads.
+
+        If on_output is given, it is called with every line of stdout and
+        stderr while the command runs, and the result keeps only the last
+        OUTPUT_TAIL_LINES lines of each stream.
+
+        If stdin is given, it is sent to the command and then its input
+        is closed. A file is sent in chunks, so its size does not matter.
+        """
+
+        result = CommandResult(command)
 
         if not self.is_connected:
-            return "Not connected to a SSH server"
+            result.error = "Not connected to a SSH server"
+            return result
 
         if not command:
-            return "Not command to execute given"
+            result.error = "Not command to execute given"
+            return result
+
+        transport = self.client.get_transport()
+
+        if transport is None or not transport.is_active():
+            result.error = "SSH transport is not active"
+            logger.error(result.error)
+            return result
+
+        start = time.monotonic()
+        channel: Optional[paramiko.Channel] = None
 
         try:
-            self.std = self.client.exec_command(
-                command, bufsize, timeout, get_pty, environment
-            )  # nosec B601
+            channel = transport.open_session(timeout=timeout)
+            if get_pty:
+                channel.get_pty()
+            if environment:
+                channel.update_environment(environment)
+            channel.exec_command(command)  # nosec B601
+
+            stdout = _OutputSink("stdout", on_output)
+            stderr = _OutputSink("stderr", on_output)
+
+            if stdin is not None:
+                self._send_stdin(channel, stdin, stdout, stderr)
+
+            self._drain(channel, stdout, stderr, bufsize, timeout, start)
+
+            result.stdout = stdout.close()
+            result.stderr = stderr.close()
+            result.exit_status = channel.recv_exit_status()
 
         except paramiko.SSHException as e:
-            return_message = "SSHException: " + str(e)
-            logger.exception(return_message)
+            result.error = "SSHException: " + str(e)
+            logger.exception(result.error)
 
-        return return_message
+        except socket.timeout as e:
+            result.error = "Timeout: " + str(e)
+            logger.error(result.error)
+
+        finally:
+            if channel is not None:
+                channel.close()
+
+        result.duration = time.monotonic() - start
+        logger.debug("%r", result)
+
+        return result
+
+    def exec_batch(
+        self, probes: Dict[str, str], timeout: Optional[float] = None
+    ) -> Dict[str, CommandResult]:
+        """Execute several commands on the SSH server in one round trip
+
+        The commands are sent as one remote script. The output of each
+        command is delimited by markers, so every command gets its own
+        CommandResult with its stdout, stderr and exit status. The
+        duration of each result is the duration of the whole batch.
+        """
+
+        results = {name: CommandResult(command) for name, command in probes.items()}
+
+        if not probes:
+            return results
+
+        marker = "__kaajal_" + secrets.token_hex(8)
+        script = ""
+
+        for index, command in enumerate(probes.values()):
+            script += f"printf '%s BEGIN {index}\\n' {marker}\n"
+            script += f"printf '%s BEGIN {index}\\n' {marker} >&2\n"
+            # sub shell, so exit or cd in a command does not affect the rest
+            script += f"( {command}\n) </dev/null\n"
+            script += f"printf '\\n%s END {index} %d\\n' {marker} $?\n"
+            script += f"printf '\\n%s END {index}\\n' {marker} >&2\n"
+
+        batch = self.exec("sh -c " + shlex.quote(script), timeout=timeout)
+
+        stdout = self._split_batch_output(batch.stdout, marker)
+        stderr = self._split_batch_output(batch.stderr, marker)
+
+        for index, result in enumerate(results.values()):
+            result.duration = batch.duration
+
+            if batch.error:
+                result.error = batch.error
+            elif index not in stdout:
+                result.error = "Command of the batch was not executed"
+            else:
+                result.stdout, exit_status = stdout[index]
+                result.stderr = stderr.get(index, ("", ""))[0]
+                result.exit_status = int(exit_status)
+
+        return results
+
+    @staticmethod
+    def _split_batch_output(output: str, marker: str) -> Dict[int, Tuple[str, str]]:
+        """Split the output of a batch into output and exit status per command"""
+
+        sections = {}
+        pattern = re.compile(
+            marker + r" BEGIN (\d+)\n(.*?)\n" + marker + r" END \1 ?(-?\d*)\n",
+            re.DOTALL,
+        )
+
+        for match in pattern.finditer(output):
+            sections[int(match.group(1))] = (match.group(2), match.group(3))
+
+        return sections
+
+    @staticmethod
+    def _send_stdin(
+        channel: paramiko.Channel,
+        stdin: StdinData,
+        stdout: _OutputSink,
+        stderr: _OutputSink,
+    ) -> None:
+        """Send the input of a command and close it
+
+        The output is read between the chunks, so the command can not
+        stall writing its output while it is reading its input.
+        If the command ends before reading all its input, the rest of
+        the input is not sent.
+        """
+
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+
+        chunks: Iterable[bytes]
+
+        if isinstance(stdin, bytes):
+            chunks = [stdin[i : i + SEND_SIZE] for i in range(0, len(stdin), SEND_SIZE)]
+        else:
+            chunks = iter(functools.partial(stdin.read, SEND_SIZE), b"")
+
+        try:
+            for chunk in chunks:
+                while channel.recv_ready():
+                    stdout.feed(channel.recv(RECV_SIZE))
+                while channel.recv_stderr_ready():
+                    stderr.feed(channel.recv_stderr(RECV_SIZE))
+                channel.sendall(chunk)
+
+            channel.shutdown_write()
+
+        except OSError as e:
+            # the exit status and stderr of the command tell why
+            logger.warning("stdin of command not sent: %s", str(e))
+
+    @staticmethod
+    def _drain(
+        channel: paramiko.Channel,
+        stdout: _OutputSink,
+        stderr: _OutputSink,
+        bufsize: int = -1,
+        timeout: Optional[float] = None,
+        start: float = 0.0,
+    ) -> None:
+        """Read stdout and stderr of the channel until the command ends
+
+        Both streams are read while the command runs, so a command with a
+        lot of output can not fill the channel window and stall.
+        """
+
+        if bufsize <= 0:
+            bufsize = RECV_SIZE
+
+        sleep_time = 0.001
+
+        while True:
+            if channel.recv_ready():
+                stdout.feed(channel.recv(bufsize))
+                sleep_time = 0.001
+                continue
+
+            if channel.recv_stderr_ready():
+                stderr.feed(channel.recv_stderr(bufsize))
+                sleep_time = 0.001
+                continue
+
+            if channel.closed or (channel.exit_status_ready() and channel.eof_received):
+                break
+
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise socket.timeout(f"command did not end in {timeout} seconds")
+
+            time.sleep(sleep_time)
+            sleep_time = min(sleep_time * 2, POLL_INTERVAL)
 
     def stat(self, path: str, show_except: bool = False) -> int:
         """Check if a file exists
@@ -255,3 +829,350 @@ class SSHConnection:
                 ret = 2
 
         return ret
+
+    def read_file(self, path: str) -> Tuple[str, str]:
+        """Read a text file of the server with SFTP
+
+        A missing file is read as empty.
+        Returns the content of the file and an error message.
+        """
+
+        if self.sftp is None:
+            return "", "No SFTP connection"
+
+        try:
+            with self.sftp.open(path, "r") as remote_file:
+                return remote_file.read().decode("utf-8"), ""
+        except FileNotFoundError:
+            return "", ""
+        except (OSError, paramiko.SSHException) as e:
+            return_message = f"Can not read {path}: {str(e)}"
+            logger.warning(return_message)
+            return "", return_message
+
+    def write_file(
+        self,
+        path: str,
+        content: str,
+        mode: int = 0o600,
+        owner: Optional[Tuple[int, int]] = None,
+    ) -> str:
+        """Write a text file of the server with SFTP
+
+        The content is written to a temporary file, which then replaces
+        the file, so the file is never seen half written.
+        owner is the uid and gid to give to the file.
+        """
+
+        if self.sftp is None:
+            return "No SFTP connection"
+
+        tmp_path = path + ".kaajal-tmp"
+
+        try:
+            with self.sftp.open(tmp_path, "w") as remote_file:
+                remote_file.write(content.encode("utf-8"))
+            self.sftp.chmod(tmp_path, mode)
+            if owner is not None:
+                self.sftp.chown(tmp_path, owner[0], owner[1])
+            self.sftp.posix_rename(tmp_path, path)
+        except (OSError, paramiko.SSHException) as e:
+            return_message = f"Can not write {path}: {str(e)}"
+            logger.warning(return_message)
+            try:
+                self.sftp.remove(tmp_path)
+            except (OSError, paramiko.SSHException):
+                pass
+            return return_message
+
+        return ""
+
+    def makedirs(
+        self, path: str, mode: int = 0o700, owner: Optional[Tuple[int, int]] = None
+    ) -> str:
+        """Create a directory of the server and its parents with SFTP
+
+        mode and owner are only set on the directories created.
+        """
+
+        if self.sftp is None:
+            return "No SFTP connection"
+
+        current = "/" if path.startswith("/") else ""
+
+        for part in path.strip("/").split("/"):
+            current = current.rstrip("/") + "/" + part if current else part
+
+            if self.stat(current):
+                continue
+
+            try:
+                self.sftp.mkdir(current, mode)
+                self.sftp.chmod(current, mode)
+                if owner is not None:
+                    self.sftp.chown(current, owner[0], owner[1])
+            except (OSError, paramiko.SSHException) as e:
+                return_message = f"Can not create {current}: {str(e)}"
+                logger.warning(return_message)
+                return return_message
+
+        return ""
+
+    def query_packages(self, command: str) -> Tuple[str, str]:
+        """Run the query of the installed packages of a package manager
+
+        Returns the output of the query and an error message.
+        """
+
+        result = self.exec(command)
+
+        if not result.ok:
+            return_message = result.error or (
+                f"{command} failed with exit status {result.exit_status}"
+            )
+            logger.warning(return_message)
+            return "", return_message
+
+        return result.stdout, ""
+
+    def upload(
+        self,
+        local_path: str,
+        remote_path: str,
+        streams: int = UPLOAD_STREAMS,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        window_size: int = UPLOAD_WINDOW_SIZE,
+        packet_size: int = UPLOAD_PACKET_SIZE,
+        on_progress: Optional[UploadCallback] = None,
+    ) -> str:
+        """Upload a file splitting it in ranges written on several SFTP channels
+
+        The file is written to a part file, which replaces remote_path at
+        the end. The ranges written are listed in a file next to it, so an
+        upload stopped by a dropped connection is resumed by calling upload
+        again with the same arguments.
+        on_progress is called from the upload threads.
+        Returns an error message.
+        """
+
+        if self.sftp is None:
+            return "No SFTP connection"
+
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return "No SSH connection"
+
+        part_path = remote_path + UPLOAD_PART_SUFFIX
+        done_path = part_path + UPLOAD_DONE_SUFFIX
+
+        try:
+            local_stat = os.stat(local_path)
+        except OSError as e:
+            return_message = f"Can not upload {local_path}: {str(e)}"
+            logger.warning(return_message)
+            return return_message
+
+        size = local_stat.st_size
+        chunk_size = max(chunk_size, SFTP_REQUEST_SIZE)
+        header = f"{size} {chunk_size} {local_stat.st_mtime_ns}"
+
+        done, error_msg = self._upload_done_chunks(part_path, done_path, header, size)
+        if error_msg:
+            return error_msg
+
+        chunks: Deque[int] = deque(
+            index for index in range(-(-size // chunk_size)) if index not in done
+        )
+        if done:
+            logger.info("%s: resuming upload, %d ranges left", remote_path, len(chunks))
+
+        uploaded = [sum(min(chunk_size, size - index * chunk_size) for index in done)]
+        errors: List[str] = []
+        lock = threading.Lock()
+        main_sftp = self.sftp
+
+        def send_chunks() -> None:
+            try:
+                sftp = paramiko.SFTPClient.from_transport(
+                    transport, window_size=window_size, max_packet_size=packet_size
+                )
+                if sftp is None:
+                    raise paramiko.SSHException("Can not open SFTP channel")
+
+                with sftp, open(local_path, "rb") as local_file:
+                    while True:
+                        with lock:
+                            if errors or not chunks:
+                                return
+                            index = chunks.popleft()
+
+                        self._upload_chunk(
+                            sftp, local_file, part_path, index * chunk_size, chunk_size
+                        )
+
+                        with lock:
+                            with main_sftp.open(done_path, "a") as done_file:
+                                done_file.write(f"{index}\n".encode("utf-8"))
+                            uploaded[0] += min(chunk_size, size - index * chunk_size)
+                            if on_progress is not None:
+                                on_progress(uploaded[0], size)
+
+            except (OSError, paramiko.SSHException) as e:
+                with lock:
+                    errors.append(f"Can not upload {remote_path}: {str(e)}")
+
+        threads = [
+            threading.Thread(target=send_chunks, name="kaajal-upload", daemon=True)
+            for _ in range(min(max(1, streams), len(chunks)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            logger.warning(errors[0])
+            return errors[0]
+
+        error_msg = self._upload_check(local_path, part_path, done_path, size)
+        if error_msg:
+            return error_msg
+
+        try:
+            self.sftp.posix_rename(part_path, remote_path)
+            self.sftp.remove(done_path)
+        except (OSError, paramiko.SSHException) as e:
+            return_message = f"Can not upload {remote_path}: {str(e)}"
+            logger.warning(return_message)
+            return return_message
+
+        return ""
+
+    def _upload_done_chunks(
+        self, part_path: str, done_path: str, header: str, size: int
+    ) -> Tuple[List[int], str]:
+        """Get the ranges written by an upload of the same file
+
+        If there is not any, an empty part file is created.
+        Returns the index of the ranges and an error message.
+        """
+
+        content, error_msg = self.read_file(done_path)
+        if error_msg:
+            return [], error_msg
+
+        lines = content.split("\n")
+
+        # the last line can be cut by a dropped connection
+        if lines[0] == header and self.sftp is not None and self.stat(part_path):
+            if self.sftp.stat(part_path).st_size == size:
+                return [int(line) for line in lines[1:-1] if line.isdigit()], ""
+
+        if self.sftp is None:
+            return [], "No SFTP connection"
+
+        try:
+            with self.sftp.open(part_path, "w") as part_file:
+                part_file.truncate(size)
+            with self.sftp.open(done_path, "w") as done_file:
+                done_file.write((header + "\n").encode("utf-8"))
+        except (OSError, paramiko.SSHException) as e:
+            return_message = f"Can not create {part_path}: {str(e)}"
+            logger.warning(return_message)
+            return [], return_message
+
+        return [], ""
+
+    def _upload_check(
+        self, local_path: str, part_path: str, done_path: str, size: int
+    ) -> str:
+        """Check the part file of an upload is a copy of the local file
+
+        paramiko does not report the errors of the pipelined writes, so the
+        size and the sha256 of the part file are compared, the sha256 only
+        if the server has sha256sum. If they differ, the ranges written are
+        forgotten, so the next upload writes the whole file again.
+        Returns an error message.
+        """
+
+        if self.sftp is None:
+            return "No SFTP connection"
+
+        return_message = ""
+
+        try:
+            part_size = self.sftp.stat(part_path).st_size
+            local_digest = _file_digest(local_path)
+        except (OSError, paramiko.SSHException) as e:
+            return_message = f"Can not check {part_path}: {str(e)}"
+            logger.warning(return_message)
+            return return_message
+
+        if part_size != size:
+            return_message = f"{part_path}: size is {part_size}, not {size}"
+        else:
+            result = self.exec("sha256sum " + shlex.quote(part_path))
+            fields = result.stdout.split()
+
+            if result.error:
+                return_message = result.error
+            elif result.exit_status == 127:
+                logger.info("No sha256sum, %s is checked by its size", part_path)
+            elif not result.ok or not fields:
+                return_message = f"Can not check {part_path}: {result.stderr.strip()}"
+            elif fields[0] != local_digest:
+                return_message = f"{part_path}: content differs from {local_path}"
+
+        if return_message:
+            logger.warning(return_message)
+            try:
+                self.sftp.remove(done_path)
+            except (OSError, paramiko.SSHException):
+                pass
+
+        return return_message
+
+    @staticmethod
+    def _upload_chunk(
+        sftp: paramiko.SFTPClient,
+        local_file: BinaryIO,
+        part_path: str,
+        offset: int,
+        chunk_size: int,
+    ) -> None:
+        """Write a range of a file with pipelined SFTP requests
+
+        The server answers the requests in order, so when the close of the
+        file returns, all the writes of the range were done.
+        """
+
+        local_file.seek(offset)
+
+        with sftp.open(part_path, "r+") as remote_file:
+            remote_file.set_pipelined(True)
+            remote_file.seek(offset)
+
+            left = chunk_size
+            while left > 0:
+                data = local_file.read(min(left, SFTP_REQUEST_SIZE))
+                if not data:
+                    break
+                remote_file.write(data)
+                left -= len(data)
+
+            remote_file.flush()
+
+
+def _file_digest(path: str) -> str:
+    """Get the sha256 of a local file"""
+
+    sha256 = hashlib.sha256()
+
+    with open(path, "rb") as hashed_file:
+        for chunk in iter(functools.partial(hashed_file.read, SEND_SIZE), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+conn_pool = ConnectionPool()
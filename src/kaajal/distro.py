@@ -7,16 +7,117 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 """Kaajal Linux distro functions"""
 
+import hashlib
 import logging
 import os
+import re
+import secrets
+import shlex
+from typing import Callable
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 
 import yaml
 
+from kaajal.connection import OutputCallback
 from kaajal.connection import SSHConnection
+from kaajal.facts import FactsCache
+from kaajal.mirror import BundleCloner
+from kaajal.mirror import MirrorCache
+from kaajal.pkgmgr import find_backend
+from kaajal.pkgmgr import get_backend
+from kaajal.pkgmgr import PackageManager
+from kaajal.repos import DEFAULT_CLONE_JOBS
+from kaajal.repos import ProgressCallback
+from kaajal.repos import Repo
+from kaajal.repos import RepoCloner
+from kaajal.repos import RepoResult
+from kaajal.sync import SYNC_BLOCK_SIZE
+from kaajal.sync import SyncResult
+from kaajal.sync import TreeSync
+from kaajal.tarball import Tarball
+from kaajal.tarball import TarballInstaller
+from kaajal.tarball import TarballResult
 
 logger = logging.getLogger(__name__)
 
+# Seconds the package metadata is considered fresh, 0 to always refresh it
+METADATA_MAX_AGE = 3600.0
+
+# Valid names for new users
+USER_NAME_RE = re.compile(r"^[a-z_][a-z0-9_.-]{0,30}\$?$")
+
+
+# Start of the key type field of an authorized_keys line
+SSH_KEY_TYPE_RE = re.compile(r"^(ssh-|ecdsa-|sk-)")
+
+
+def _content_hash(content: str) -> str:
+    """Get the hash used to know if a file changed"""
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _ssh_key_id(line: str) -> str:
+    """Get the key type and key of an authorized_keys line
+
+    Options and comments are not part of the id, so the same key is
+    found with other comment.
+    """
+
+    fields = line.split()
+
+    for index, field in enumerate(fields[:-1]):
+        if SSH_KEY_TYPE_RE.match(field):
+            return field + " " + fields[index + 1]
+
+    return line
+
+
+def merge_authorized_keys(content: str, ssh_pub_keys: List[str]) -> str:
+    """Add the keys to the content of authorized_keys without duplicates"""
+
+    lines: List[str] = []
+    seen: Set[str] = set()
+
+    for line in content.split("\n") + ssh_pub_keys:
+        line = line.strip()
+        if not line:
+            continue
+
+        key_id = _ssh_key_id(line)
+        if key_id in seen:
+            continue
+
+        seen.add(key_id)
+        lines.append(line)
+
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+class NewUser:
+    """User to create with Distro.create_users()"""
+
+    def __init__(
+        self,
+        user: str,
+        password: str = "",
+        ssh_key: str = "",
+        github_token: str = "",
+    ) -> None:  # nosec B107 hardcoded_password_default
+        """Class constructor of New User
+
+        ssh_key and github_token are paths of local files.
+        """
+
+        self.user = user
+        self.password = password
+        self.ssh_key = ssh_key
+        self.github_token = github_token
+
 
 class Distro:
     """Linux Distro class"""
@@ -32,6 +133,14 @@ class Distro:
         self.uid = ""
         self.sudo = ""
         self.ssh_conn: Optional[SSHConnection] = None
+        self.facts_cache: Optional[FactsCache] = None
+        # use the fast profile of the package manager
+        self.fast = True
+        self.metadata_max_age = METADATA_MAX_AGE
+        # True if the last update did not refresh the package metadata
+        self.refresh_skipped = False
+        # snapshot of the installed package names
+        self._installed: Optional[Set[str]] = None
 
     def set_ssh_conn(self, conn: SSHConnection) -> None:
         """Set the SSH connection object"""
@@ -39,8 +148,17 @@ class Distro:
         if conn:
             self.ssh_conn = conn
 
-    def identify(self) -> str:
-        """Identify the Linux distro"""
+    def set_facts_cache(self, cache: FactsCache) -> None:
+        """Set the cache used to skip the identification of known hosts"""
+
+        self.facts_cache = cache
+
+    def identify(self, use_cache: bool = True) -> str:
+        """Identify the Linux distro
+
+        If a facts cache is set and use_cache is True, the facts saved for
+        the host are used instead of asking the host.
+        """
 
         return_message = ""
 
@@ -54,16 +172,51 @@ class Distro:
             logger.warning(return_message)
             return return_message
 
-        # Get OS info
-        self.ssh_conn.exec("cat /etc/os-release")
+        if use_cache and self._load_facts():
+            logger.info("Linux %s (cached)", self.pretty_name)
+        else:
+            return_message = self._discover_facts()
+            if return_message:
+                return return_message
+            self._save_facts()
+            logger.info("Linux %s", self.pretty_name)
+
+        if self.uid != "0" and not self.sudo:
+            return_message = "User can NOT run sudo without password"
+            logger.warning(return_message)
+
+        logger.debug('sudo = "%s"', self.sudo)
+
+        return return_message
+
+    def _discover_facts(self) -> str:
+        """Ask the host for the distro and user facts"""
+
+        return_message = ""
+
+        if not self.ssh_conn:
+            return "No connection configured"
+
+        # Get OS info, user info and home in one round trip
+        results = self.ssh_conn.exec_batch(
+            {
+                "os_release": "cat /etc/os-release",
+                "uid": "id -u",
+                "sudo": "sudo -l | grep -q NOPASSWD",
+                "home": "echo $HOME",
+            }
+        )
+
+        result = results["os_release"]
 
         # if command returned non-zero exit status
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = self.ssh_conn.std[2].read().decode("utf-8").strip()
+        if not result.ok:
+            return_message = result.error or result.stderr.strip()
             logger.warning(return_message)
             return return_message
 
-        output = self.ssh_conn.std[1].read().decode("utf-8").split("\n")
+        output = result.stdout.split("\n")
+        id_like: List[str] = []
 
         for line in output:
             line = line.strip()
@@ -78,34 +231,77 @@ class Distro:
             if values[0] == "PRETTY_NAME":
                 self.pretty_name = values[1].replace('"', "")
 
-        if self.id in ("centos", "fedora"):
-            # package manager
-            self.pm = "dnf"
-        elif self.id in ("debian", "ubuntu"):
-            # package manager
-            self.pm = "apt-get"
+            if values[0] == "ID_LIKE":
+                id_like = values[1].replace('"', "").split()
+
+        # package manager
+        backend = find_backend(self.id, id_like)
+        self.pm = backend.name if backend is not None else ""
 
         # Get User info
-        self.ssh_conn.exec("id -u")
-        self.uid = self.ssh_conn.std[1].read().decode("utf-8").strip()
-
-        if self.uid != "0":
-            self.ssh_conn.exec("sudo -l | grep -q NOPASSWD")
-            # wait for exit status
-            if self.ssh_conn.std[1].channel.recv_exit_status():
-                return_message = "User can NOT run sudo without password"
-                self.sudo = ""
-                logger.warning(return_message)
-            else:
-                self.sudo = "sudo"
+        self.uid = results["uid"].stdout.strip()
 
-        logger.info("Linux %s", self.pretty_name)
-        logger.debug('sudo = "%s"', self.sudo)
+        if results["home"].ok:
+            self.ssh_conn.home = results["home"].stdout.strip()
+
+        self.sudo = ""
+        if self.uid != "0" and results["sudo"].ok:
+            self.sudo = "sudo"
 
         return return_message
 
-    def update(self) -> str:
-        """Update the Linux distro"""
+    def _load_facts(self) -> bool:
+        """Load the facts of the host from the facts cache"""
+
+        if self.facts_cache is None or self.ssh_conn is None:
+            return False
+
+        facts = self.facts_cache.get(
+            self.ssh_conn.host_id(), self.ssh_conn.host_key_fingerprint()
+        )
+
+        if not facts:
+            return False
+
+        self.id = facts["id"]
+        self.name = facts["name"]
+        self.pretty_name = facts["pretty_name"]
+        self.pm = facts["pm"]
+        self.uid = facts["uid"]
+        self.sudo = facts["sudo"]
+
+        if facts["home"]:
+            self.ssh_conn.home = facts["home"]
+
+        return True
+
+    def _save_facts(self) -> None:
+        """Save the facts of the host in the facts cache"""
+
+        if self.facts_cache is None or self.ssh_conn is None:
+            return
+
+        facts = {
+            "id": self.id,
+            "name": self.name,
+            "pretty_name": self.pretty_name,
+            "pm": self.pm,
+            "uid": self.uid,
+            "sudo": self.sudo,
+            "home": self.ssh_conn.home,
+        }
+
+        self.facts_cache.put(
+            self.ssh_conn.host_id(), self.ssh_conn.host_key_fingerprint(), facts
+        )
+
+    def update(self, on_output: Optional[OutputCallback] = None) -> str:
+        """Update the Linux distro
+
+        The package metadata is not refreshed if it is younger than
+        metadata_max_age seconds, refresh_skipped tells if it was skipped.
+        on_output is called with every line printed by the package manager.
+        """
 
         return_message = ""
 
@@ -124,35 +320,77 @@ class Distro:
             logger.warning(return_message)
             return return_message
 
-        self._setup_proxy(self.pm)
+        backend = self.get_pkg_manager()
 
-        logger.info("%s -y update", self.pm)
-        return_message = self.ssh_conn.exec(self.sudo + " " + self.pm + " -y update")
+        if backend is None:
+            return_message = f"No package manager known for {self.id}"
+            logger.warning(return_message)
+            return return_message
 
-        # wait for exit status
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            logger.warning("Non zero return on %s -y update", self.pm)
+        self._setup_proxy(self.pm)
 
-        if return_message:
-            logger.warning(return_message)
+        self.refresh_skipped = False
 
-        if self.id in ("debian", "ubuntu"):
-            logger.info("%s -y upgrade", self.pm)
-            return_message = self.ssh_conn.exec(
-                self.sudo + " " + self.pm + " -y upgrade"
-            )
+        if self.metadata_max_age > 0:
+            age = self.metadata_age()
+            if age is not None and age < self.metadata_max_age:
+                logger.info("Package metadata is %d s old, not refreshed", age)
+                self.refresh_skipped = True
 
-            # wait for exit status
-            if self.ssh_conn.std[1].channel.recv_exit_status():
-                logger.warning("Non zero return on %s -y upgrade", self.pm)
+        for cmd in backend.update_cmds(self.fast, not self.refresh_skipped):
+            logger.info(cmd)
+            result = self.ssh_conn.exec(self.sudo + " " + cmd, on_output=on_output)
+            return_message = result.error
+
+            if not return_message and result.exit_status:
+                return_message = f"{cmd} failed with exit status {result.exit_status}"
 
             if return_message:
                 logger.warning(return_message)
+                break
 
         return return_message
 
-    def install(self, str_pkgs_list: str = "", pkg_list_path: str = "") -> str:
-        """Install new packages in Linux distro"""
+    def get_pkg_manager(self) -> Optional[PackageManager]:
+        """Get the backend of the package manager of the distro"""
+
+        return get_backend(self.pm)
+
+    def metadata_age(self) -> Optional[float]:
+        """Get the seconds since the package metadata was refreshed
+
+        Returns None if it is not known.
+        """
+
+        backend = self.get_pkg_manager()
+
+        if not self.ssh_conn or backend is None or not backend.metadata_files:
+            return None
+
+        cmd = "echo $(date +%s) $(stat -c %Y " + backend.metadata_files
+        cmd += " 2>/dev/null | sort -n | tail -n 1)"
+
+        values = self.ssh_conn.exec(cmd).stdout.split()
+
+        # no metadata file found
+        if len(values) != 2:
+            return None
+
+        try:
+            return max(float(values[0]) - float(values[1]), 0.0)
+        except ValueError:
+            return None
+
+    def install(
+        self,
+        str_pkgs_list: str = "",
+        pkg_list_path: str = "",
+        on_output: Optional[OutputCallback] = None,
+    ) -> str:
+        """Install new packages in Linux distro
+
+        on_output is called with every line printed by the package manager.
+        """
 
         return_message = ""
 
@@ -171,6 +409,13 @@ class Distro:
             logger.warning(return_message)
             return return_message
 
+        backend = self.get_pkg_manager()
+
+        if backend is None:
+            return_message = f"No package manager known for {self.id}"
+            logger.warning(return_message)
+            return return_message
+
         if pkg_list_path:
             if os.path.exists(pkg_list_path):
                 yaml_data = {}
@@ -216,14 +461,31 @@ class Distro:
             logger.warning(return_message)
             return return_message
 
-        logger.info("%s -y install %s", self.pm, str_pkgs_list)
-        return_message = self.ssh_conn.exec(
-            self.sudo + " " + self.pm + " -y install " + str_pkgs_list
+        installed = self.installed_packages()
+
+        if installed is not None:
+            missing = [pkg for pkg in str_pkgs_list.split() if pkg not in installed]
+
+            if not missing:
+                logger.info("Packages already installed: %s", str_pkgs_list)
+                return return_message
+
+            str_pkgs_list = " ".join(missing)
+
+        install_cmd = backend.install_cmd(str_pkgs_list, self.fast)
+        logger.info(install_cmd)
+        result = self.ssh_conn.exec(
+            self.sudo + " " + install_cmd,
+            on_output=on_output,
         )
-        # wait for exit status
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            logger.warning(
-                "Non zero return on %s -y install %s", self.pm, str_pkgs_list
+        return_message = result.error
+
+        # the installed packages changed
+        self._installed = None
+
+        if not return_message and result.exit_status:
+            return_message = (
+                f"{install_cmd} failed with exit status {result.exit_status}"
             )
 
         if return_message:
@@ -231,190 +493,475 @@ class Distro:
 
         return return_message
 
-    def create_new_user(
+    def installed_packages(self, refresh: bool = False) -> Optional[Set[str]]:
+        """Get the names of the installed packages
+
+        The list is taken with one query and kept until the next install.
+        Returns None if the installed packages can not be listed.
+        """
+
+        if self._installed is not None and not refresh:
+            return self._installed
+
+        if not self.ssh_conn or not self.ssh_conn.is_connected:
+            return None
+
+        backend = self.get_pkg_manager()
+
+        if backend is None or not backend.installed_cmd():
+            return None
+
+        output, error_msg = self.ssh_conn.query_packages(backend.installed_cmd())
+
+        if error_msg:
+            logger.warning("Can not list the installed packages")
+            return None
+
+        installed = backend.parse_installed(output)
+
+        logger.debug("%d packages installed", len(installed))
+        self._installed = installed
+
+        return self._installed
+
+    def clone_repos(
         self,
-        user: str = "",
-        password: str = "",
-        ssh_key: str = "",
-        github_token: str = "",
-    ) -> str:  # nosec B107 hardcoded_password_default
-        """Create a new user in Linux distro"""
+        repos: List[Repo],
+        jobs: int = DEFAULT_CLONE_JOBS,
+        depth: int = 0,
+        filter_spec: str = "",
+        on_progress: Optional[ProgressCallback] = None,
+        mirror_cache: Optional[MirrorCache] = None,
+    ) -> Tuple[List[RepoResult], str]:
+        """Clone git repositories, at most jobs repos at the same time
+
+        git is installed if it is not found. If mirror_cache is given, the
+        repos are sent from the local mirrors as git bundles.
+        Returns the result of every repo and an error message.
+        """
 
         return_message = ""
 
         if not self.ssh_conn:
             return_message = "No connection configured"
             logger.warning(return_message)
-            return return_message
+            return [], return_message
 
         if not self.ssh_conn.is_connected:
             return_message = "No SSH connection"
             logger.warning(return_message)
-            return return_message
+            return [], return_message
 
-        if self.uid != "0" and not self.sudo:
-            return_message = "User is not allowed to update the system"
+        if not repos:
+            return_message = "No repos provided to clone"
             logger.warning(return_message)
-            return return_message
+            return [], return_message
 
-        if not user:
-            return_message = "create_new_user: NO Username given"
+        if not self.ssh_conn.exec("command -v git").ok:
+            logger.info("git not found, installing it")
+            return_message = self.install("git")
+            if return_message:
+                return [], return_message
+
+        cloner: RepoCloner
+
+        if mirror_cache is not None:
+            cloner = BundleCloner(self.ssh_conn, mirror_cache, jobs, on_progress)
+        else:
+            cloner = RepoCloner(self.ssh_conn, jobs, depth, filter_spec, on_progress)
+
+        results = cloner.clone_all(repos)
+
+        failed = [result for result in results if not result.ok]
+        if failed:
+            return_message = f"{len(failed)} of {len(results)} repos not cloned"
             logger.warning(return_message)
-            return return_message
 
-        if not password and not ssh_key:
-            return_message = "create_new_user: NO password or SSH key given"
+        return results, return_message
+
+    def install_tarballs(
+        self,
+        tarballs: List[Tarball],
+        on_output: Optional[OutputCallback] = None,
+        use_cache: bool = True,
+    ) -> Tuple[List[TarballResult], str]:
+        """Install tarballs streaming them into tar on the remote host
+
+        sudo is used to extract the tarballs outside the home of the user.
+        If use_cache is True, the local archives are kept in the remote
+        artifact cache and are not sent or extracted twice.
+        Returns the result of every tarball and an error message.
+        """
+
+        return_message = ""
+
+        if not self.ssh_conn:
+            return_message = "No connection configured"
             logger.warning(return_message)
-            return return_message
+            return [], return_message
 
-        if ssh_key and not os.path.exists(ssh_key):
-            return_message = f"create_new_user: {ssh_key} not found"
+        if not self.ssh_conn.is_connected:
+            return_message = "No SSH connection"
             logger.warning(return_message)
-            return return_message
+            return [], return_message
 
-        if github_token and not os.path.exists(github_token):
-            return_message = f"create_new_user: {github_token} not found"
+        if not tarballs:
+            return_message = "No tarballs provided to install"
             logger.warning(return_message)
-            return return_message
+            return [], return_message
 
-        return_message = self.ssh_conn.exec(f"id {user}")
+        installer = TarballInstaller(self.ssh_conn, self.sudo, on_output, use_cache)
+        results = installer.install_all(tarballs)
 
-        if return_message:
+        failed = [result for result in results if not result.ok]
+        if failed:
+            return_message = f"{len(failed)} of {len(results)} tarballs not installed"
             logger.warning(return_message)
-            return return_message
 
-        if 0 == self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = f"create_new_user: {user} already exists"
-            logger.warning(return_message)
-            return return_message
+        return results, return_message
 
-        cmd = self.sudo + " useradd --shell /usr/bin/bash --create-home "
-        cmd += "--home-dir /home/" + user + ' --comment "made by kaajal" '
-        cmd += user
+    def sync_tree(
+        self,
+        local_dir: str,
+        remote_dir: str,
+        block_size: int = SYNC_BLOCK_SIZE,
+        on_output: Optional[OutputCallback] = None,
+    ) -> Tuple[Optional[SyncResult], str]:
+        """Copy a local directory to the remote host sending only the changes
 
-        return_message = self.ssh_conn.exec(cmd)
+        Returns the sync result and an error message.
+        """
 
-        if return_message:
-            logger.warning(return_message)
-            return return_message
+        return_message = ""
 
-        # if command returned non-zero exit status
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = self.ssh_conn.std[2].read().decode("utf-8").strip()
+        if not self.ssh_conn:
+            return_message = "No connection configured"
             logger.warning(return_message)
-            return return_message
+            return None, return_message
 
-        log_info = 'User "' + user + '" created '
+        if not self.ssh_conn.is_connected:
+            return_message = "No SSH connection"
+            logger.warning(return_message)
+            return None, return_message
 
-        if password:
-            cmd = f'echo "{user}:{password}" | '
-            cmd += self.sudo + " chpasswd"
+        result = TreeSync(self.ssh_conn, block_size, on_output).sync(
+            local_dir, remote_dir
+        )
 
-            return_message = self.ssh_conn.exec(cmd)
+        return result, result.error
 
-            if return_message:
-                logger.warning(return_message)
-                return return_message
+    def create_new_user(
+        self,
+        user: str = "",
+        password: str = "",
+        ssh_key: str = "",
+        github_token: str = "",
+    ) -> str:  # nosec B107 hardcoded_password_default
+        """Create a new user in Linux distro"""
 
-            # if command returned non-zero exit status
-            if self.ssh_conn.std[1].channel.recv_exit_status():
-                return_message = self.ssh_conn.std[2].read().decode("utf-8").strip()
-                logger.warning(return_message)
-                return return_message
+        return_message = ""
 
-            log_info += "with password "
+        if not user:
+            return_message = "create_new_user: NO Username given"
+            logger.warning(return_message)
+            return return_message
 
-        if ssh_key:
-            return_message = self.copy_ssh_key(ssh_key, user)
-            if return_message:
-                return return_message
-            log_info += "and SSH key "
+        results = self.create_users([NewUser(user, password, ssh_key, github_token)])
 
-        if github_token:
-            return_message = self.copy_github_token(github_token, user)
-            if return_message:
-                return return_message
-            log_info += "and GitHub Token"
+        return results[user]
 
-        logger.info(log_info)
-        return return_message
+    def create_users(self, users: List[NewUser]) -> Dict[str, str]:
+        """Create several users in Linux distro with one remote script
 
-    def copy_ssh_key(self, ssh_key_path: str = "", user: str = "current") -> str:
-        """Copy SSH key to authorized_keys"""
+        The passwords of all the users are given to one chpasswd call.
+        The users that already exist are not changed, so the users can be
+        created again.
+        Returns the error message of every user, empty if it was created
+        or if it exists.
+        """
 
+        results: Dict[str, str] = {}
         return_message = ""
 
         if not self.ssh_conn:
             return_message = "No connection configured"
             logger.warning(return_message)
-            return return_message
+            return {new_user.user: return_message for new_user in users}
 
         if not self.ssh_conn.is_connected:
             return_message = "No SSH connection"
             logger.warning(return_message)
-            return return_message
+            return {new_user.user: return_message for new_user in users}
 
-        if not ssh_key_path:
-            return_message = "No SSH key given"
+        if self.uid != "0" and not self.sudo:
+            return_message = "User is not allowed to update the system"
             logger.warning(return_message)
-            return return_message
+            return {new_user.user: return_message for new_user in users}
 
-        if ssh_key_path and not os.path.exists(ssh_key_path):
-            return_message = f"copy_ssh_key: {ssh_key_path} not found"
-            logger.warning(return_message)
-            return return_message
+        valid_users: List[Tuple[NewUser, str, str]] = []
 
-        user_home = ""
-        use_sudo = ""
+        for new_user in users:
+            error_msg, ssh_pub_key, str_github_token = self._read_new_user(
+                new_user, results
+            )
+            results[new_user.user] = error_msg
 
-        if user != "current":
-            if self.uid != "0" and not self.sudo:
-                return_message = "User is not allowed to update the system"
-                logger.warning(return_message)
-                return return_message
+            if error_msg:
+                logger.warning(error_msg)
+            else:
+                valid_users.append((new_user, ssh_pub_key, str_github_token))
 
-            use_sudo = self.sudo
+        if not valid_users:
+            return results
 
-            cmd = "getent passwd " + user + " | cut -d : -f 6"
-            self.ssh_conn.exec(cmd)
+        marker = "__kaajal_" + secrets.token_hex(8)
+        script, steps = self._users_script(valid_users, marker)
 
-            user_home = self.ssh_conn.std[1].read().decode("utf-8").strip()
+        result = self.ssh_conn.exec(self.sudo + " sh -s", stdin=script)
 
-            if not user_home:
-                return_message = f"copy_ssh_key: User {user} not found in the system"
-                logger.warning(return_message)
-                return return_message
+        if result.error:
+            logger.warning(result.error)
+            for new_user, _, _ in valid_users:
+                results[new_user.user] = result.error
+            return results
+
+        sections = SSHConnection._split_batch_output(result.stdout, marker)
+        created: List[str] = []
+        existing: List[str] = []
+
+        for index, (user, step) in enumerate(steps):
+            if step == "password" or results[user]:
+                continue
+
+            if index not in sections:
+                results[user] = f"create_new_user: {user}: {step} was not done"
+                continue
+
+            output, exit_status = sections[index]
+
+            if step == "useradd" and exit_status == "9":
+                existing.append(user)
+            elif exit_status != "0":
+                results[user] = f"create_new_user: {user}: {step} failed"
+                if output.strip():
+                    results[user] += ": " + output.strip()
+            elif step == "useradd":
+                created.append(user)
+
+        if "password" in [step for _, step in steps]:
+            self._check_chpasswd(valid_users, created, steps, sections, results)
+
+        for new_user, _, _ in valid_users:
+            if results[new_user.user]:
+                logger.warning(results[new_user.user])
+            elif new_user.user in existing:
+                logger.info('User "%s" already exists, not changed', new_user.user)
+            else:
+                logger.info('User "%s" created', new_user.user)
+
+        return results
+
+    def _read_new_user(
+        self, new_user: NewUser, results: Dict[str, str]
+    ) -> Tuple[str, str, str]:
+        """Check a new user and read its SSH key and GitHub token
+
+        Returns the error message, the SSH key and the GitHub token.
+        """
+
+        ssh_pub_key = ""
+        str_github_token = ""
+
+        if not USER_NAME_RE.match(new_user.user):
+            return f'create_new_user: "{new_user.user}" is not a valid user', "", ""
+
+        if new_user.user in results:
+            return f"create_new_user: {new_user.user} given twice", "", ""
+
+        if not new_user.password and not new_user.ssh_key:
+            return "create_new_user: NO password or SSH key given", "", ""
+
+        if "\n" in new_user.password:
+            return "create_new_user: password can not have new lines", "", ""
+
+        if new_user.ssh_key:
+            if not os.path.exists(new_user.ssh_key):
+                return f"create_new_user: {new_user.ssh_key} not found", "", ""
+
+            with open(new_user.ssh_key, encoding="utf-8") as ssh_key_file:
+                ssh_pub_key = ssh_key_file.read().strip()
+
+        if new_user.github_token:
+            if not os.path.exists(new_user.github_token):
+                return f"create_new_user: {new_user.github_token} not found", "", ""
+
+            with open(new_user.github_token, encoding="utf-8") as github_token_file:
+                str_github_token = github_token_file.read().strip()
+
+        return "", ssh_pub_key, str_github_token
+
+    @staticmethod
+    def _users_script(
+        valid_users: List[Tuple[NewUser, str, str]], marker: str
+    ) -> Tuple[str, List[Tuple[str, str]]]:
+        """Get the script that creates the users
+
+        Every step is delimited by markers like the ones of exec_batch.
+        The useradd step of a user that exists ends with exit status 9 and
+        its other steps are not run.
+        The script is read by sh from its stdin, so the commands must not
+        read from it. Returns the script and the user and name of every
+        step.
+        """
+
+        steps: List[Tuple[str, str]] = []
+        script = 'created=" "\n'
+
+        def begin(user: str, step: str) -> str:
+            steps.append((user, step))
+            return f"printf '%s BEGIN {len(steps) - 1}\\n' {marker}\n"
+
+        def end(exit_status: str) -> str:
+            return f"printf '\\n%s END {len(steps) - 1} %d\\n' {marker} {exit_status}\n"
+
+        for new_user, ssh_pub_key, str_github_token in valid_users:
+            user = new_user.user
+            user_home = "/home/" + user
+
+            script += begin(user, "useradd")
+            script += f"if id -u {user} >/dev/null 2>&1; then rc=9; else\n"
+            script += "useradd --shell /usr/bin/bash --create-home "
+            script += f'--home-dir {user_home} --comment "made by kaajal" '
+            script += f"{user} </dev/null 2>&1; rc=$?\nfi\n"
+            script += end("$rc")
+            script += f'if [ $rc -eq 0 ]; then created="${{created}}{user} "; fi\n'
+
+            if ssh_pub_key:
+                script += f'case "$created" in *" {user} "*)\n'
+                script += begin(user, "ssh_key")
+                script += f"mkdir -m 700 -p {user_home}/.ssh 2>&1 &&\n"
+                script += f"cat >> {user_home}/.ssh/authorized_keys <<'{marker}' &&\n"
+                script += ssh_pub_key + "\n" + marker + "\n"
+                script += f"chown -R {user}:{user} {user_home}/.ssh 2>&1\n"
+                script += end("$?")
+                script += ";;\nesac\n"
+
+            if str_github_token:
+                script += f'case "$created" in *" {user} "*)\n'
+                script += begin(user, "github_token")
+                script += f"mkdir -m 700 -p {user_home}/.config/github 2>&1 &&\n"
+                script += f"cat > {user_home}/.config/github/token <<'{marker}' &&\n"
+                script += str_github_token + "\n" + marker + "\n"
+                script += f"chown -R {user}:{user} {user_home}/.config 2>&1\n"
+                script += end("$?")
+                script += ";;\nesac\n"
+
+        passwords = [
+            new_user.user + ":" + new_user.password
+            for new_user, _, _ in valid_users
+            if new_user.password
+        ]
+
+        if passwords:
+            # only the users created by this script get a password
+            script += begin("", "password")
+            script += "while IFS= read -r line; do\n"
+            script += 'case "$created" in *" ${line%%:*} "*) '
+            script += "printf '%s\\n' \"$line\" ;; esac\n"
+            script += f"done <<'{marker}' | chpasswd 2>&1\n"
+            script += "\n".join(passwords) + "\n" + marker + "\n"
+            script += end("$?")
+
+        return script, steps
+
+    @staticmethod
+    def _check_chpasswd(
+        valid_users: List[Tuple[NewUser, str, str]],
+        created: List[str],
+        steps: List[Tuple[str, str]],
+        sections: Dict[int, Tuple[str, str]],
+        results: Dict[str, str],
+    ) -> None:
+        """Set the error of the users whose password was not set"""
+
+        index = [step for _, step in steps].index("password")
+        # chpasswd got the passwords of the created users, in this order
+        password_users = [
+            new_user.user
+            for new_user, _, _ in valid_users
+            if new_user.password and new_user.user in created
+        ]
+
+        if index not in sections:
+            output, exit_status = "chpasswd was not done", "-1"
         else:
-            # if user is "current"
-            user_home = self.ssh_conn.home
+            output, exit_status = sections[index]
 
-        cmd = use_sudo + " mkdir -m 700 -p " + user_home + "/.ssh"
-        self.ssh_conn.exec(cmd)
+        if exit_status == "0":
+            return
+
+        # chpasswd reports the failed input lines as "line N"
+        failed = [
+            password_users[int(line) - 1]
+            for line in re.findall(r"line (\d+)", output)
+            if 0 < int(line) <= len(password_users)
+        ]
+
+        for user in failed or password_users:
+            if not results[user]:
+                results[user] = f"create_new_user: {user}: password failed"
+                if output.strip():
+                    results[user] += ": " + output.strip()
 
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = "copy_ssh_key: error at create .ssh directory"
+    def copy_ssh_key(self, ssh_key_path: str = "", user: str = "current") -> str:
+        """Copy SSH key to authorized_keys"""
+
+        return_message = ""
+
+        if not ssh_key_path:
+            return_message = "No SSH key given"
             logger.warning(return_message)
             return return_message
 
-        with open(ssh_key_path, encoding="utf-8") as ssh_key_file:
-            ssh_pub_key = ssh_key_file.read().strip()
+        return self.copy_ssh_keys([ssh_key_path], user)
 
-        cmd = "echo " + ssh_pub_key
-        cmd += " | " + use_sudo + " tee -a "
-        cmd += user_home + "/.ssh/authorized_keys"
-        self.ssh_conn.exec(cmd)
+    def copy_ssh_keys(self, ssh_key_paths: List[str], user: str = "current") -> str:
+        """Copy SSH keys to authorized_keys
 
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = "copy_ssh_key: error at add key to authoriezed_keys"
+        The keys already in authorized_keys are not added again, and the
+        file is only written if it changed.
+        """
+
+        return_message = ""
+
+        if not ssh_key_paths:
+            return_message = "No SSH key given"
             logger.warning(return_message)
             return return_message
 
-        if user != "current":
-            cmd = use_sudo + " chown -R " + user + ":" + user + " "
-            cmd += user_home + "/.ssh"
-            self.ssh_conn.exec(cmd)
+        ssh_pub_keys: List[str] = []
+
+        for ssh_key_path in ssh_key_paths:
+            if not os.path.exists(ssh_key_path):
+                return_message = f"copy_ssh_key: {ssh_key_path} not found"
+                logger.warning(return_message)
+                return return_message
+
+            with open(ssh_key_path, encoding="utf-8") as ssh_key_file:
+                for line in ssh_key_file:
+                    if line.strip() and not line.strip().startswith("#"):
+                        ssh_pub_keys.append(line.strip())
+
+        return_message = self._update_user_file(
+            user,
+            ".ssh",
+            "authorized_keys",
+            lambda content: merge_authorized_keys(content, ssh_pub_keys),
+        )
+
+        if not return_message:
+            logger.info("Copied SSH key to authorized_keys")
 
-        logger.info("Copied SSH key to authorized_keys")
         return return_message
 
     def copy_github_token(
@@ -424,28 +971,50 @@ class Distro:
 
         return_message = ""
 
-        if not self.ssh_conn:
-            return_message = "No connection configured"
+        if not github_token_path:
+            return_message = "No GitHub Token given"
             logger.warning(return_message)
             return return_message
 
-        if not self.ssh_conn.is_connected:
-            return_message = "No SSH connection"
+        if github_token_path and not os.path.exists(github_token_path):
+            return_message = f"copy_github_token: {github_token_path} not found"
             logger.warning(return_message)
             return return_message
 
-        if not github_token_path:
-            return_message = "No GitHub Token given"
+        with open(github_token_path, encoding="utf-8") as github_token_file:
+            str_github_token = github_token_file.read().strip()
+
+        return_message = self._update_user_file(
+            user, ".config/github", "token", lambda content: str_github_token + "\n"
+        )
+
+        if not return_message:
+            logger.info("Copied GitHub Token")
+
+        return return_message
+
+    def _update_user_file(
+        self, user: str, rel_dir: str, name: str, merge: Callable[[str], str]
+    ) -> str:
+        """Update a private file in the home of a user
+
+        The file is read once, merge gets its content and returns the new
+        content, and the file is written only if the content changed.
+        """
+
+        return_message = ""
+
+        if not self.ssh_conn:
+            return_message = "No connection configured"
             logger.warning(return_message)
             return return_message
 
-        if github_token_path and not os.path.exists(github_token_path):
-            return_message = f"copy_github_token: {github_token_path} not found"
+        if not self.ssh_conn.is_connected:
+            return_message = "No SSH connection"
             logger.warning(return_message)
             return return_message
 
-        user_home = ""
-        use_sudo = ""
+        owner: Optional[Tuple[int, int]] = None
 
         if user != "current":
             if self.uid != "0" and not self.sudo:
@@ -453,52 +1022,102 @@ class Distro:
                 logger.warning(return_message)
                 return return_message
 
-            use_sudo = self.sudo
-
-            cmd = "getent passwd " + user + " | cut -d : -f 6"
-            self.ssh_conn.exec(cmd)
-
-            user_home = self.ssh_conn.std[1].read().decode("utf-8").strip()
+            # name:password:uid:gid:comment:home:shell
+            result = self.ssh_conn.exec("getent passwd " + shlex.quote(user))
+            fields = result.stdout.strip().split(":")
 
-            if not user_home:
-                return_message = (
-                    f"copy_github_token: User {user} not found in the system"
-                )
+            if len(fields) < 7:
+                return_message = f"{name}: User {user} not found in the system"
                 logger.warning(return_message)
                 return return_message
+
+            user_home = fields[5]
+            owner = (int(fields[2]), int(fields[3]))
         else:
             # if user is "current"
-            user_home = self.ssh_conn.home
+            user_home = self.ssh_conn.get_home()
 
-        cmd = use_sudo + " mkdir -m 700 -p " + user_home + "/.config/github"
-        self.ssh_conn.exec(cmd)
+        dir_path = user_home + "/" + rel_dir
+        path = dir_path + "/" + name
 
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = (
-                "copy_github_token: error at create .config/github directory"
-            )
-            logger.warning(return_message)
+        if owner is not None and self.uid != "0":
+            # SFTP can not write the files of other users without root
+            return self._update_user_file_sudo(user_home, rel_dir, path, owner, merge)
+
+        content, return_message = self.ssh_conn.read_file(path)
+
+        if return_message:
             return return_message
 
-        with open(github_token_path, encoding="utf-8") as github_token_file:
-            str_github_token = github_token_file.read().strip()
+        new_content = merge(content)
+
+        if _content_hash(new_content) == _content_hash(content):
+            logger.info("%s is up to date", path)
+            return return_message
+
+        return_message = self.ssh_conn.makedirs(dir_path, 0o700, owner)
+
+        if not return_message:
+            return_message = self.ssh_conn.write_file(path, new_content, 0o600, owner)
+
+        return return_message
+
+    def _update_user_file_sudo(
+        self,
+        user_home: str,
+        rel_dir: str,
+        path: str,
+        owner: Tuple[int, int],
+        merge: Callable[[str], str],
+    ) -> str:
+        """Update a private file of other user using sudo
+
+        The directories of rel_dir missing in the home of the user are
+        created one by one, so all of them are owned by the user.
+        """
+
+        return_message = ""
 
-        cmd = "echo " + str_github_token
-        cmd += " | " + use_sudo + " tee "
-        cmd += user_home + "/.config/github/token"
-        self.ssh_conn.exec(cmd)
+        if not self.ssh_conn:
+            return "No connection configured"
+
+        quoted_path = shlex.quote(path)
+        cmd = f"[ ! -e {quoted_path} ] || cat {quoted_path}"
+        result = self.ssh_conn.exec(self.sudo + " sh -c " + shlex.quote(cmd))
 
-        if self.ssh_conn.std[1].channel.recv_exit_status():
-            return_message = "copy_github_token: error when adding token"
+        if not result.ok:
+            return_message = result.error or f"Can not read {path}"
             logger.warning(return_message)
             return return_message
 
-        if user != "current":
-            cmd = use_sudo + " chown -R " + user + ":" + user + " "
-            cmd += user_home + "/.config"
-            self.ssh_conn.exec(cmd)
+        new_content = merge(result.stdout)
+
+        if _content_hash(new_content) == _content_hash(result.stdout):
+            logger.info("%s is up to date", path)
+            return return_message
+
+        tmp_path = shlex.quote(path + ".kaajal-tmp")
+        str_owner = f"{owner[0]}:{owner[1]}"
+        cmd = "true"
+        current = user_home
+        for part in rel_dir.strip("/").split("/"):
+            current += "/" + part
+            quoted_dir = shlex.quote(current)
+            cmd += f" && {{ [ -d {quoted_dir} ] || {{ mkdir -m 700 {quoted_dir}"
+            cmd += f" && chown {str_owner} {quoted_dir}; }}; }}"
+        cmd += f" && cat > {tmp_path} && chmod 600 {tmp_path}"
+        cmd += f" && chown {str_owner} {tmp_path}"
+        cmd += f" && mv -f {tmp_path} {quoted_path}"
+
+        result = self.ssh_conn.exec(
+            self.sudo + " sh -c " + shlex.quote(cmd), stdin=new_content
+        )
+
+        if not result.ok:
+            return_message = result.error or result.stderr.strip()
+            return_message = return_message or f"Can not write {path}"
+            logger.warning(return_message)
 
-        logger.info("Copied GitHub Token")
         return return_message
 
     def _setup_proxy(self, target: str = "") -> None:
@@ -510,6 +1129,20 @@ class Distro:
         if not self.ssh_conn:
             return
 
+        script = self.proxy_script(target)
+
+        if script:
+            # the proxy URL can have a password, it is not given as argument
+            self.ssh_conn.exec(self.sudo + " sh -s", stdin=script)
+            logger.debug("Set http_proxy to %s", target)
+
+    @staticmethod
+    def proxy_script(target: str) -> str:
+        """Get the script that sets the proxy of the environment variables
+
+        The script runs as root, it is empty if there is nothing to set.
+        """
+
         http_proxy = os.environ.get("http_proxy")
         if not http_proxy:
             http_proxy = os.environ.get("HTTP_PROXY")
@@ -529,21 +1162,23 @@ class Distro:
         if no_proxy:
             logger.debug('no_proxy = "%s"', no_proxy)
 
+        if not http_proxy:
+            return ""
+
         if target == "dnf":
-            if http_proxy:
-                self.ssh_conn.exec("grep -q proxy /etc/dnf/dnf.conf")
-                if self.ssh_conn.std[1].channel.recv_exit_status():
-                    # if the word proxy was not found in dnf.conf
-                    cmd = "echo proxy=" + http_proxy
-                    cmd += " | " + self.sudo + " tee -a /etc/dnf/dnf.conf"
-                    self.ssh_conn.exec(cmd)
-                    logger.debug("Set http_proxy to dnf.conf")
-        elif target == "apt-get":
-            if http_proxy:
-                file_exist = self.ssh_conn.stat("/etc/apt/apt.conf.d/proxy.conf")
-                if 1 != file_exist:
-                    # if proxy.conf does not exist or has 0 size
-                    cmd = 'echo Acquire::http::Proxy \\"' + http_proxy + '\\"\\; | '
-                    cmd += self.sudo + " tee /etc/apt/apt.conf.d/proxy.conf"
-                    self.ssh_conn.exec(cmd)
-                    logger.debug("Set http_proxy to proxy.conf")
+            # if the word proxy was not found in dnf.conf
+            return (
+                "grep -q proxy /etc/dnf/dnf.conf || echo "
+                + shlex.quote("proxy=" + http_proxy)
+                + " >> /etc/dnf/dnf.conf"
+            )
+
+        if target == "apt-get":
+            # if proxy.conf does not exist or has 0 size
+            return (
+                "[ -s /etc/apt/apt.conf.d/proxy.conf ] || echo "
+                + shlex.quote(f'Acquire::http::Proxy "{http_proxy}";')
+                + " > /etc/apt/apt.conf.d/proxy.conf"
+            )
+
+        return ""
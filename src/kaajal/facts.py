@@ -0,0 +1,113 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal distro facts cache functions"""
+
+import logging
+import time
+from typing import Dict
+from typing import Optional
+
+from kaajal.config import JsonCache
+
+logger = logging.getLogger(__name__)
+
+FACTS_CACHE_NAME = "facts.json"
+
+# Seconds the facts of a host are valid
+FACTS_TTL = 7 * 24 * 3600
+
+# Distro attributes saved in the cache
+FACT_KEYS = ("id", "name", "pretty_name", "pm", "uid", "sudo", "home")
+
+
+class FactsCache(JsonCache):
+    """On disk cache of the facts found by Distro.identify()
+
+    The facts are keyed by host identity (user@host:port) and saved with
+    the host key fingerprint, so a reinstalled host is identified again.
+    """
+
+    file_name = FACTS_CACHE_NAME
+    description = "facts cache"
+
+    def __init__(self, path: str = "", ttl: float = FACTS_TTL) -> None:
+        """Class constructor of Facts Cache
+
+        If path is not given, the file is saved in the user config dir.
+        """
+
+        super().__init__(path)
+        self.ttl = ttl
+
+    def get(self, host_id: str, fingerprint: str = "") -> Optional[dict]:
+        """Get the facts of a host, None if missing, expired or host changed"""
+
+        with self._lock:
+            entries = self._load()
+
+        entry = entries.get(host_id)
+
+        if entry is None:
+            return None
+
+        if time.time() - entry.get("time", 0) > self.ttl:
+            logger.debug("%s: facts expired", host_id)
+            return None
+
+        if fingerprint and entry.get("fingerprint") != fingerprint:
+            logger.warning("%s: host key changed, facts invalidated", host_id)
+            self.invalidate(host_id)
+            return None
+
+        return entry.get("facts")
+
+    def put(self, host_id: str, fingerprint: str, facts: dict) -> None:
+        """Save the facts of a host"""
+
+        with self._lock:
+            entries = self._load()
+            entries[host_id] = {
+                "time": time.time(),
+                "fingerprint": fingerprint,
+                "facts": {key: facts.get(key, "") for key in FACT_KEYS},
+            }
+            self._save(entries)
+
+    def invalidate(self, host_id: str = "") -> int:
+        """Remove the facts of a host, or of all hosts if not given
+
+        Returns the number of hosts removed.
+        """
+
+        with self._lock:
+            entries = self._load()
+
+            if host_id:
+                removed = 1 if entries.pop(host_id, None) is not None else 0
+            else:
+                removed = len(entries)
+                entries = {}
+
+            if removed:
+                self._save(entries)
+
+        return removed
+
+    def hosts(self) -> Dict[str, float]:
+        """Get the cached hosts and the age in seconds of their facts"""
+
+        with self._lock:
+            entries = self._load()
+
+        now = time.time()
+        return {
+            host_id: now - entry.get("time", 0) for host_id, entry in entries.items()
+        }
+
+
+facts_cache = FactsCache()
@@ -0,0 +1,487 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal fleet functions
+
+Run the connect, identify, update and install pipeline on many hosts
+at the same time.
+
+The inventory is a YAML file with optional defaults and a list of hosts,
+every host uses the same keys as the connection config::
+
+    defaults:
+      user: admin
+      ssh_key: ~/.ssh/id_ed25519
+    hosts:
+      - host: 10.0.0.1
+      - host: 10.0.0.2
+        user: root
+
+or a text file with one "[user@]host" per line.
+
+Before the hosts are provisioned, the SSH port of all of them is probed
+at the same time with a short timeout, so the unreachable hosts do not
+wait for the connect timeout in a worker slot.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import yaml
+from paramiko.config import SSHConfig
+
+from kaajal.config import Config
+from kaajal.connection import SSHConnection
+from kaajal.distro import Distro
+from kaajal.distro import METADATA_MAX_AGE
+from kaajal.facts import facts_cache
+from kaajal.journal import StepJournal
+from kaajal.journal import step_hash
+from kaajal.tarball import digest_cache
+
+logger = logging.getLogger(__name__)
+
+# Hosts provisioned at the same time
+DEFAULT_JOBS = 10
+
+# Seconds to open the SSH port of a host and read its banner
+SCAN_TIMEOUT = 3.0
+
+# Hosts probed at the same time, to not run out of file descriptors
+SCAN_CONCURRENCY = 256
+
+# Lines a server can send before its SSH banner
+SCAN_MAX_LINES = 10
+
+
+class HostResult:
+    """Result of the provisioning of one host"""
+
+    def __init__(self, host: str) -> None:
+        """Class constructor of Host Result"""
+
+        self.host = host
+        self.pretty_name = ""
+        # True if the package metadata was fresh and not refreshed
+        self.refresh_skipped = False
+        # Error message of the step that failed
+        self.error = ""
+        self.failed_step = ""
+        # Seconds spent on each step
+        self.timings: Dict[str, float] = {}
+        # Steps done by a previous run
+        self.skipped: List[str] = []
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if all the steps were done"""
+
+        return not self.error
+
+
+def host_label(conn_config: dict) -> str:
+    """Get the name used to show a host of the inventory"""
+
+    if conn_config.get("connection_type") == "SSH host":
+        return conn_config.get("ssh_config_host", "")
+
+    if conn_config.get("user"):
+        return conn_config["user"] + "@" + conn_config.get("host", "")
+
+    return conn_config.get("host", "")
+
+
+def host_address(conn_config: dict) -> Tuple[str, int]:
+    """Get the address and port of the SSH server of a host
+
+    The address is empty if it is not known.
+    """
+
+    if conn_config.get("connection_type") != "SSH host":
+        return conn_config.get("host", ""), 22
+
+    ssh_config_path = conn_config.get("ssh_config", "")
+
+    if not ssh_config_path or not os.path.exists(ssh_config_path):
+        return "", 22
+
+    try:
+        host_config = SSHConfig.from_path(ssh_config_path).lookup(
+            conn_config.get("ssh_config_host", "")
+        )
+        return host_config.get("hostname", ""), int(host_config.get("port", 22))
+    except (OSError, ValueError) as e:
+        logger.warning("%s: %s", ssh_config_path, str(e))
+        return "", 22
+
+
+async def probe_host(address: str, port: int, timeout: float = SCAN_TIMEOUT) -> str:
+    """Open the SSH port of a host and read its banner
+
+    Returns an error message, empty if a SSH server answered.
+    """
+
+    writer: Optional[asyncio.StreamWriter] = None
+
+    async def read_banner() -> str:
+        nonlocal writer
+        reader, writer = await asyncio.open_connection(address, port)
+        for _ in range(SCAN_MAX_LINES):
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b"SSH-"):
+                logger.debug(
+                    "%s:%d: %s", address, port, line.decode("ascii", "replace")
+                )
+                return ""
+        return f"{address}:{port}: no SSH banner"
+
+    try:
+        return await asyncio.wait_for(read_banner(), timeout)
+    except asyncio.TimeoutError:
+        return f"{address}:{port}: no answer in {timeout} s"
+    except OSError as e:
+        return f"{address}:{port}: {e.strerror or str(e)}"
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def scan_hosts_async(
+    hosts: list, timeout: float = SCAN_TIMEOUT
+) -> Dict[int, str]:
+    """Probe the SSH port of all the hosts at the same time
+
+    Returns the error message of every unreachable host by its index.
+    The hosts whose address is not known are not probed.
+    """
+
+    semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+
+    async def probe(address: str, port: int) -> str:
+        async with semaphore:
+            return await probe_host(address, port, timeout)
+
+    addresses = {i: host_address(conn_config) for i, conn_config in enumerate(hosts)}
+    indexes = [i for i, (address, _) in addresses.items() if address]
+    errors = await asyncio.gather(*(probe(*addresses[i]) for i in indexes))
+
+    return {i: error for i, error in zip(indexes, errors) if error}
+
+
+def scan_hosts(hosts: list, timeout: float = SCAN_TIMEOUT) -> Dict[int, str]:
+    """Probe the SSH port of all the hosts, see scan_hosts_async()"""
+
+    start = time.monotonic()
+    unreachable = asyncio.run(scan_hosts_async(hosts, timeout))
+
+    logger.info(
+        "%d of %d hosts reachable, scanned in %.1f s",
+        len(hosts) - len(unreachable),
+        len(hosts),
+        time.monotonic() - start,
+    )
+
+    return unreachable
+
+
+def load_inventory(path: str, defaults: Optional[dict] = None) -> Tuple[list, str]:
+    """Load the list of host connection configs from the inventory file
+
+    Values not set in the inventory are taken from defaults.
+    Returns the list of configs and an error message.
+    """
+
+    hosts: List[dict] = []
+    inventory_defaults = dict(defaults or {})
+    entries: list = []
+
+    if not os.path.exists(path):
+        return_message = path + ": not found"
+        logger.warning(return_message)
+        return hosts, return_message
+
+    try:
+        with open(path, encoding="utf-8") as inventory_file:
+            if path.endswith(".yaml") or path.endswith(".yml"):
+                yaml_data = yaml.safe_load(inventory_file) or {}
+                if isinstance(yaml_data, list):
+                    entries = yaml_data
+                else:
+                    inventory_defaults.update(yaml_data.get("defaults") or {})
+                    entries = yaml_data.get("hosts") or []
+            else:
+                for line in inventory_file:
+                    if not line or not line.strip():
+                        continue
+                    if line.strip()[0] == "#":
+                        continue
+
+                    user, _, host = line.strip().rpartition("@")
+                    entry = {"host": host}
+                    if user:
+                        entry["user"] = user
+                    entries.append(entry)
+
+    except yaml.YAMLError as e:
+        return_message = "YAML Error: " + str(e)
+        logger.exception(return_message)
+        return hosts, return_message
+    except OSError as e:
+        return_message = "OS Error: " + str(e)
+        logger.exception(return_message)
+        return hosts, return_message
+
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"host": entry}
+
+        host_config = Config()
+        host_config.set_conn_config(inventory_defaults)
+        # connection type is guessed again for every host
+        host_config.conn_config["connection_type"] = ""
+        host_config.set_conn_config(entry)
+
+        for key in ("ssh_key", "ssh_config"):
+            if host_config.conn_config[key]:
+                host_config.conn_config[key] = os.path.expanduser(
+                    host_config.conn_config[key]
+                )
+
+        if not host_config.get_conn_type():
+            logger.warning("%s: not enough connection values", entry)
+
+        hosts.append(host_config.conn_config)
+
+    return hosts, ""
+
+
+def provision_host(
+    conn_config: dict,
+    str_pkgs_list: str = "",
+    pkg_list_path: str = "",
+    metadata_max_age: float = METADATA_MAX_AGE,
+    journal: Optional[StepJournal] = None,
+) -> HostResult:
+    """Connect, identify, update and install packages on one host
+
+    If journal is given, the update and the install done by a previous
+    run with the same input are skipped, the update only while the
+    package metadata is not older than metadata_max_age.
+    """
+
+    result = HostResult(host_label(conn_config))
+    start = time.monotonic()
+
+    ssh_conn = SSHConnection()
+    distro = Distro()
+    distro.set_ssh_conn(ssh_conn)
+    distro.set_facts_cache(facts_cache)
+    distro.metadata_max_age = metadata_max_age
+
+    def log_output(stream: str, line: str) -> None:
+        logger.debug("%s %s: %s", result.host, stream, line)
+
+    steps: List[Tuple[str, Callable[[], str]]] = [
+        ("connect", lambda: ssh_conn.connect(conn_config)),
+        ("identify", distro.identify),
+        ("update", lambda: distro.update(log_output)),
+    ]
+
+    if str_pkgs_list or pkg_list_path:
+        steps.append(
+            (
+                "install",
+                lambda: distro.install(str_pkgs_list, pkg_list_path, log_output),
+            )
+        )
+
+    def step_input(step: str) -> str:
+        if step == "update":
+            return step_hash(distro.pm, step)
+        pkg_list_digest = ""
+        if pkg_list_path and os.path.isfile(pkg_list_path):
+            pkg_list_digest = digest_cache.digest(pkg_list_path)
+        return step_hash(distro.pm, step, str_pkgs_list, pkg_list_digest)
+
+    step = ""
+    fingerprint = ""
+
+    try:
+        for step, func in steps:
+            if journal is not None and step in ("update", "install"):
+                if not fingerprint:
+                    fingerprint = ssh_conn.host_key_fingerprint()
+                max_age = metadata_max_age if step == "update" else 0.0
+                if (step != "update" or metadata_max_age > 0) and journal.is_done(
+                    ssh_conn.host_id(), fingerprint, step, step_input(step), max_age
+                ):
+                    result.skipped.append(step)
+                    logger.info("%s: %s done by a previous run", result.host, step)
+                    continue
+
+            step_start = time.monotonic()
+            error_msg = func()
+            result.timings[step] = time.monotonic() - step_start
+
+            if step == "identify":
+                result.pretty_name = distro.pretty_name
+            elif step == "update":
+                result.refresh_skipped = distro.refresh_skipped
+
+            if error_msg and not error_msg.startswith("Sorry"):
+                result.error = error_msg
+                result.failed_step = step
+                if journal is not None:
+                    journal.forget(ssh_conn.host_id(), step)
+                break
+
+            if journal is not None and step in ("update", "install"):
+                journal.record(
+                    ssh_conn.host_id(),
+                    fingerprint,
+                    step,
+                    step_input(step),
+                    result.timings[step],
+                )
+
+    # A broken host must not stop the rest of the fleet
+    except Exception as e:
+        result.error = "Error: " + str(e)
+        result.failed_step = step
+        logger.exception("%s: %s", result.host, result.error)
+
+    finally:
+        ssh_conn.close()
+
+    result.duration = time.monotonic() - start
+
+    if result.error:
+        logger.warning("%s: %s failed: %s", result.host, step, result.error)
+    else:
+        logger.info("%s: provisioned in %.1f s", result.host, result.duration)
+
+    return result
+
+
+def run_fleet(
+    hosts: list,
+    str_pkgs_list: str = "",
+    pkg_list_path: str = "",
+    jobs: int = DEFAULT_JOBS,
+    metadata_max_age: float = METADATA_MAX_AGE,
+    on_result: Optional[Callable[[HostResult], None]] = None,
+    journal: Optional[StepJournal] = None,
+    scan_timeout: float = SCAN_TIMEOUT,
+) -> List[HostResult]:
+    """Provision all the hosts, at most jobs hosts at the same time
+
+    on_result is called with the result of every host when it ends.
+    journal keeps the steps done on every host.
+    If scan_timeout is not 0, the hosts whose SSH port does not answer
+    in scan_timeout seconds are not provisioned, they fail in the scan
+    step.
+    The results are returned in the order of the hosts.
+    """
+
+    results: Dict[int, HostResult] = {}
+    unreachable: Dict[int, str] = {}
+
+    if scan_timeout > 0:
+        unreachable = scan_hosts(hosts, scan_timeout)
+
+    for i, error_msg in unreachable.items():
+        result = HostResult(host_label(hosts[i]))
+        result.error = error_msg
+        result.failed_step = "scan"
+        logger.warning("%s: unreachable: %s", result.host, error_msg)
+        results[i] = result
+        if on_result is not None:
+            on_result(result)
+
+    with ThreadPoolExecutor(
+        max_workers=max(1, jobs), thread_name_prefix="kaajal-fleet"
+    ) as executor:
+        futures = {
+            executor.submit(
+                provision_host,
+                conn_config,
+                str_pkgs_list,
+                pkg_list_path,
+                metadata_max_age,
+                journal,
+            ): i
+            for i, conn_config in enumerate(hosts)
+            if i not in unreachable
+        }
+
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            if on_result is not None:
+                on_result(result)
+
+    return [results[i] for i in sorted(results)]
+
+
+def summary(results: List[HostResult], wall_time: float = 0.0) -> str:
+    """Get a text summary of the fleet results"""
+
+    failed = [result for result in results if not result.ok]
+    steps = ("connect", "identify", "update", "install")
+
+    width = max([len(result.host) for result in results] + [4])
+    lines = [
+        f"{'Host':<{width}}  "
+        + "  ".join(f"{step:>8}" for step in steps)
+        + f"  {'total':>8}  {'refresh':>7}  status"
+    ]
+
+    for result in results:
+        line = f"{result.host:<{width}}  "
+        line += "  ".join(
+            (
+                f"{result.timings[step]:8.1f}"
+                if step in result.timings
+                else f"{'previous' if step in result.skipped else '-':>8}"
+            )
+            for step in steps
+        )
+        line += f"  {result.duration:8.1f}  "
+        if "update" not in result.timings:
+            line += f"{'-':>7}  "
+        elif result.refresh_skipped:
+            line += f"{'skipped':>7}  "
+        else:
+            line += f"{'done':>7}  "
+        if result.ok:
+            line += "ok " + result.pretty_name
+        else:
+            line += result.failed_step + " failed: " + result.error
+        lines.append(line)
+
+    lines.append(
+        f"{len(results) - len(failed)} of {len(results)} hosts provisioned"
+        + (f" in {wall_time:.1f} s" if wall_time else "")
+    )
+
+    skipped = [result.host for result in results if result.refresh_skipped]
+    if skipped:
+        lines.append("Package metadata refresh skipped on: " + ", ".join(skipped))
+
+    return "\n".join(lines)
@@ -16,13 +16,25 @@ from tkinter import filedialog
 from tkinter import messagebox
 from tkinter import ttk
 from tkinter.ttk import Widget
+from typing import List
 from typing import Optional
 
 from kaajal.__about__ import __appname__
 from kaajal.__about__ import __version__
 from kaajal.config import app_config
 from kaajal.connection import SSHConnection
+from kaajal.connection import conn_pool
 from kaajal.distro import Distro
+from kaajal.facts import facts_cache
+from kaajal.repos import load_repo_list
+from kaajal.repos import parse_repo_items
+from kaajal.repos import Repo
+from kaajal.repos import RepoResult
+from kaajal.repos import summary
+from kaajal.tarball import load_tarball_list
+from kaajal.tarball import Tarball
+from kaajal.tarball import TarballResult
+from kaajal.tarball import summary as tarball_summary
 
 logger = logging.getLogger(__name__)
 
@@ -106,9 +118,10 @@ class MainWindow(tk.Tk):
         notebook.add(tb_frame, text="Tarballs")
         mainframe.pack(padx=7, pady=7)
 
-        self.ssh_conn = SSHConnection()
+        self.ssh_conn = SSHConnection(conn_pool)
         self.distro = Distro()
         self.distro.set_ssh_conn(self.ssh_conn)
+        self.distro.set_facts_cache(facts_cache)
         self.str_status_bar.set("Not connected to Linux distro")
 
         try:
@@ -448,6 +461,7 @@ class MainWindow(tk.Tk):
     def _exit_app(self) -> None:
         """Exit from the app"""
         self.ssh_conn.close()
+        conn_pool.close_all()
         self.quit()
 
     def _open_file(self, strVar: tk.StringVar, relative_path=None) -> None:
@@ -554,11 +568,42 @@ class MainWindow(tk.Tk):
         if pkg:
             str_pkg_list += pkg
 
-        error_msg = self.distro.install(str_pkg_list, self.sv_pkgs_file.get())
-
-        if error_msg:
+        if self._working_thread is None:
+            self.str_status_bar.set("Installing packages ... please wait")
+            self.update()
+            self._working_thread = threading.Thread(
+                target=self._th_start_install_pkgs,
+                args=(str_pkg_list, self.sv_pkgs_file.get()),
+            )
+            self._working_thread.start()
+        else:
+            error_msg = "Please wait for the background process finish"
             messagebox.showwarning("Linux install warning", error_msg)
-            return
+
+    def _th_start_install_pkgs(self, str_pkg_list: str, pkg_list_path: str) -> None:
+        """Function called by the thread"""
+
+        error_msg = self.distro.install(
+            str_pkg_list, pkg_list_path, self._th_show_output
+        )
+        self.after(0, self._th_end_install_pkgs, error_msg)
+
+    def _th_end_install_pkgs(self, str_msg: str) -> None:
+        """Function executed at end of thread"""
+
+        if str_msg:
+            messagebox.showwarning("Linux install warning", str_msg)
+            self.str_status_bar.set("Error when installing packages")
+        else:
+            self.str_status_bar.set("Packages installed")
+
+        self._working_thread = None
+
+    def _th_show_output(self, stream: str, line: str) -> None:
+        """Show in the status bar the output of a remote command"""
+
+        if line.strip():
+            self.after(0, self.str_status_bar.set, line.strip())
 
     def _add_to_repo_list(self) -> None:
         """Add URL and Path to the list"""
@@ -571,19 +616,113 @@ class MainWindow(tk.Tk):
 
     def _clone_repo(self) -> None:
         """Clone repositories from list"""
+
+        repos: List[Repo] = []
+
         if self.r_lbox is not None:
-            items = self.r_lbox.get(0, tk.END)
-            print(items)
+            repos = parse_repo_items(list(self.r_lbox.get(0, tk.END)))
+
+        repo_list_path = self.l_repo[2].get()
+
+        if repo_list_path:
+            list_repos, error_msg = load_repo_list(repo_list_path)
+            if error_msg:
+                messagebox.showwarning("Clone repos warning", error_msg)
+                return
+            repos += list_repos
+
+        if self._working_thread is None:
+            self.str_status_bar.set("Cloning repos ... please wait")
+            self.update()
+            self._working_thread = threading.Thread(
+                target=self._th_start_clone_repos, args=(repos,)
+            )
+            self._working_thread.start()
+        else:
+            error_msg = "Please wait for the background process finish"
+            messagebox.showwarning("Clone repos warning", error_msg)
+
+    def _th_start_clone_repos(self, repos: List[Repo]) -> None:
+        """Function called by the thread"""
+
+        results, error_msg = self.distro.clone_repos(
+            repos, on_progress=self._th_show_repo_progress
+        )
+        self.after(0, self._th_end_clone_repos, results, error_msg)
+
+    def _th_show_repo_progress(self, repo: Repo, message: str) -> None:
+        """Show in the status bar the progress of a repo"""
+
+        self.after(0, self.str_status_bar.set, repo.get_path() + ": " + message)
+
+    def _th_end_clone_repos(self, results: List[RepoResult], str_msg: str) -> None:
+        """Function executed at end of thread"""
+
+        if str_msg:
+            if results:
+                str_msg += "\n\n" + summary(results)
+            messagebox.showwarning("Clone repos warning", str_msg)
+            self.str_status_bar.set("Error when cloning repos")
+        else:
+            self.str_status_bar.set(f"{len(results)} repos cloned")
+
+        self._working_thread = None
 
     def _install_tarball(self) -> None:
         """Install tarball"""
 
-        print("Install tarball")
+        tarballs: List[Tarball] = []
+
+        if self.l_tb[0].get():
+            tarballs.append(Tarball(self.l_tb[0].get(), self.l_tb[1].get()))
+
+        tarball_list_path = self.l_tb[2].get()
+
+        if tarball_list_path:
+            list_tarballs, error_msg = load_tarball_list(tarball_list_path)
+            if error_msg:
+                messagebox.showwarning("Install tarball warning", error_msg)
+                return
+            tarballs += list_tarballs
+
+        if self._working_thread is None:
+            self.str_status_bar.set("Installing tarballs ... please wait")
+            self.update()
+            self._working_thread = threading.Thread(
+                target=self._th_start_install_tarballs, args=(tarballs,)
+            )
+            self._working_thread.start()
+        else:
+            error_msg = "Please wait for the background process finish"
+            messagebox.showwarning("Install tarball warning", error_msg)
+
+    def _th_start_install_tarballs(self, tarballs: List[Tarball]) -> None:
+        """Function called by the thread"""
+
+        results, error_msg = self.distro.install_tarballs(
+            tarballs, self._th_show_output
+        )
+        self.after(0, self._th_end_install_tarballs, results, error_msg)
+
+    def _th_end_install_tarballs(
+        self, results: List[TarballResult], str_msg: str
+    ) -> None:
+        """Function executed at end of thread"""
+
+        if str_msg:
+            if results:
+                str_msg += "\n\n" + tarball_summary(results)
+            messagebox.showwarning("Install tarball warning", str_msg)
+            self.str_status_bar.set("Error when installing tarballs")
+        else:
+            self.str_status_bar.set(f"{len(results)} tarballs installed")
+
+        self._working_thread = None
 
     def _th_start_distro_update(self) -> None:
         """Function called by the thread"""
 
-        error_msg = self.distro.update()
+        error_msg = self.distro.update(self._th_show_output)
         self.after(0, self._th_end_distro_update, error_msg)
 
     def _th_end_distro_update(self, str_msg: str) -> None:
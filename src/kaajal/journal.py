@@ -0,0 +1,214 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal step journal functions
+
+The journal records the steps done on every host with the hash of their
+input, so a run after a failed one skips the steps done with the same
+input and starts again at the first failed or changed step.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict
+
+from kaajal.config import JsonCache
+from kaajal.connection import SSHConnection
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = "journal.json"
+
+# Copy of the journal of a host on the host, relative to the remote home
+REMOTE_JOURNAL = ".cache/kaajal/journal.json"
+
+# Seconds a done step is valid
+JOURNAL_TTL = 7 * 24 * 3600
+
+
+def step_hash(*values: str) -> str:
+    """Get the hash of the input of a step"""
+
+    sha256 = hashlib.sha256()
+
+    for value in values:
+        sha256.update(value.encode("utf-8") + b"\0")
+
+    return sha256.hexdigest()
+
+
+class StepJournal(JsonCache):
+    """On disk journal of the steps done on every host
+
+    The steps are keyed by host identity (user@host:port) and saved with
+    the host key fingerprint, so the steps of a reinstalled host are run
+    again.
+    """
+
+    file_name = JOURNAL_NAME
+    description = "journal"
+
+    def __init__(self, path: str = "", ttl: float = JOURNAL_TTL) -> None:
+        """Class constructor of Step Journal
+
+        If path is not given, the file is saved in the user config dir.
+        """
+
+        super().__init__(path)
+        self.ttl = ttl
+
+    def steps(self, host_id: str, fingerprint: str = "") -> Dict[str, dict]:
+        """Get the steps done on a host, empty if the host changed"""
+
+        with self._lock:
+            entry = self._load().get(host_id)
+
+        if entry is None:
+            return {}
+
+        if fingerprint and entry.get("fingerprint") != fingerprint:
+            logger.warning("%s: host key changed, journal ignored", host_id)
+            return {}
+
+        return entry.get("steps", {})
+
+    def is_done(
+        self,
+        host_id: str,
+        fingerprint: str,
+        step: str,
+        input_hash: str,
+        max_age: float = 0.0,
+    ) -> bool:
+        """True if the step was done with the same input
+
+        max_age are the seconds the step is valid, at most the ttl of the
+        journal.
+        """
+
+        step_entry = self.steps(host_id, fingerprint).get(step)
+
+        if step_entry is None or step_entry.get("hash") != input_hash:
+            return False
+
+        ttl = min(max_age, self.ttl) if max_age > 0 else self.ttl
+
+        return time.time() - step_entry.get("time", 0) < ttl
+
+    def record(
+        self,
+        host_id: str,
+        fingerprint: str,
+        step: str,
+        input_hash: str,
+        duration: float = 0.0,
+    ) -> None:
+        """Save a step done on a host"""
+
+        self.merge(
+            host_id,
+            fingerprint,
+            {step: {"hash": input_hash, "time": time.time(), "duration": duration}},
+        )
+
+    def merge(self, host_id: str, fingerprint: str, steps: Dict[str, dict]) -> None:
+        """Save steps done on a host, the newest entry of a step is kept"""
+
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(host_id)
+
+            if entry is None or entry.get("fingerprint") != fingerprint:
+                entry = {"fingerprint": fingerprint, "steps": {}}
+
+            for step, step_entry in steps.items():
+                old_entry = entry["steps"].get(step, {})
+                if step_entry.get("time", 0) >= old_entry.get("time", 0):
+                    entry["steps"][step] = step_entry
+
+            entries[host_id] = entry
+            self._save(entries)
+
+    def forget(self, host_id: str = "", step: str = "") -> int:
+        """Remove a step of a host, all its steps, or the steps of all hosts
+
+        Returns the number of steps removed.
+        """
+
+        removed = 0
+
+        with self._lock:
+            entries = self._load()
+
+            if not host_id:
+                removed = sum(len(entry["steps"]) for entry in entries.values())
+                entries = {}
+            elif host_id in entries and step:
+                removed = int(entries[host_id]["steps"].pop(step, None) is not None)
+            elif host_id in entries:
+                removed = len(entries.pop(host_id)["steps"])
+
+            if removed:
+                self._save(entries)
+
+        return removed
+
+    def load_remote(self, ssh_conn: SSHConnection) -> str:
+        """Merge the copy of the journal kept on the connected host
+
+        Returns an error message.
+        """
+
+        host_id = ssh_conn.host_id()
+        fingerprint = ssh_conn.host_key_fingerprint()
+        content, error_msg = ssh_conn.read_file(REMOTE_JOURNAL)
+
+        if error_msg or not content:
+            return error_msg
+
+        try:
+            remote_entry = json.loads(content)
+            if remote_entry.get("fingerprint") != fingerprint:
+                return ""
+            self.merge(host_id, fingerprint, dict(remote_entry["steps"]))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return_message = f"{REMOTE_JOURNAL}: wrong remote journal: {str(e)}"
+            logger.warning(return_message)
+            return return_message
+
+        return ""
+
+    def save_remote(self, ssh_conn: SSHConnection) -> str:
+        """Keep a copy of the journal of the connected host on the host
+
+        Returns an error message.
+        """
+
+        fingerprint = ssh_conn.host_key_fingerprint()
+        steps = self.steps(ssh_conn.host_id(), fingerprint)
+
+        error_msg = ssh_conn.makedirs(os.path.dirname(REMOTE_JOURNAL))
+        if error_msg:
+            return error_msg
+
+        content = json.dumps({"fingerprint": fingerprint, "steps": steps}, indent=1)
+
+        return ssh_conn.write_file(REMOTE_JOURNAL, content)
+
+    def hosts(self) -> Dict[str, int]:
+        """Get the hosts of the journal and the number of their steps"""
+
+        with self._lock:
+            entries = self._load()
+
+        return {host_id: len(entry["steps"]) for host_id, entry in entries.items()}
+
+
+step_journal = StepJournal()
@@ -0,0 +1,330 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal local connection functions
+
+Provision the machine kaajal runs on without SSH: the commands run as
+local processes and the files are read and written directly, with no
+key exchange, encryption or sshd.
+"""
+
+import functools
+import getpass
+import logging
+import os
+import shutil
+import signal
+import subprocess  # nosec B404
+import threading
+import time
+from typing import BinaryIO
+from typing import Optional
+from typing import cast
+
+import paramiko
+
+from kaajal.connection import CommandResult
+from kaajal.connection import OutputCallback
+from kaajal.connection import RECV_SIZE
+from kaajal.connection import SEND_SIZE
+from kaajal.connection import SSHConnection
+from kaajal.connection import StdinData
+from kaajal.connection import UPLOAD_PART_SUFFIX
+from kaajal.connection import UploadCallback
+from kaajal.connection import _OutputSink
+
+logger = logging.getLogger(__name__)
+
+# Identity of the machine, used as the host key fingerprint
+MACHINE_ID_PATH = "/etc/machine-id"
+
+
+class _LocalSFTP:
+    """SFTP client whose methods work on the local files
+
+    Like on a SFTP server, the relative paths are relative to the home
+    of the user.
+    """
+
+    def __init__(self, home: str) -> None:
+        """Class constructor of local SFTP"""
+
+        self.home = home
+
+    def _path(self, path: str) -> str:
+        """Get the local path of a SFTP path"""
+
+        return os.path.join(self.home, path)
+
+    def stat(self, path: str) -> os.stat_result:
+        return os.stat(self._path(path))
+
+    def lstat(self, path: str) -> os.stat_result:
+        return os.lstat(self._path(path))
+
+    def open(self, path: str, mode: str = "r", bufsize: int = -1) -> BinaryIO:
+        # the files of SFTP are always binary
+        return cast(BinaryIO, open(self._path(path), mode.replace("b", "") + "b"))
+
+    def listdir(self, path: str = ".") -> list:
+        return os.listdir(self._path(path))
+
+    def mkdir(self, path: str, mode: int = 0o777) -> None:
+        os.mkdir(self._path(path), mode)
+
+    def rmdir(self, path: str) -> None:
+        os.rmdir(self._path(path))
+
+    def remove(self, path: str) -> None:
+        os.remove(self._path(path))
+
+    def rename(self, old_path: str, new_path: str) -> None:
+        os.rename(self._path(old_path), self._path(new_path))
+
+    def posix_rename(self, old_path: str, new_path: str) -> None:
+        os.replace(self._path(old_path), self._path(new_path))
+
+    def symlink(self, source: str, dest: str) -> None:
+        os.symlink(source, self._path(dest))
+
+    def readlink(self, path: str) -> str:
+        return os.readlink(self._path(path))
+
+    def chmod(self, path: str, mode: int) -> None:
+        os.chmod(self._path(path), mode)
+
+    def chown(self, path: str, uid: int, gid: int) -> None:
+        os.chown(self._path(path), uid, gid)
+
+    def put(self, local_path: str, remote_path: str) -> os.stat_result:
+        shutil.copyfile(local_path, self._path(remote_path))
+        return os.stat(self._path(remote_path))
+
+    def get(self, remote_path: str, local_path: str) -> None:
+        shutil.copyfile(self._path(remote_path), local_path)
+
+    def close(self) -> None:
+        pass
+
+
+class LocalConnection(SSHConnection):
+    """Connection to the machine kaajal runs on, without SSH"""
+
+    def __init__(self) -> None:
+        """Class constructor of Local Connection"""
+
+        super().__init__()
+        self.port = 0
+
+    def close(self) -> None:
+        """Close local connection"""
+
+        if self.is_connected:
+            self.sftp = None
+            self.is_connected = False
+            self.username = ""
+            self.hostname = ""
+            self.home = ""
+            logger.info("Closing local connection")
+
+    def connect(self, config=None) -> str:
+        """Connect to the local machine, the config is not used"""
+
+        return self._connect()
+
+    def _connect(self, **conn_args) -> str:
+        """Connect to the local machine as the current user"""
+
+        if self.is_connected:
+            return "You are already connected."
+
+        self.is_connected = True
+        self.username = getpass.getuser()
+        self.hostname = "localhost"
+        self.home = os.path.expanduser("~")
+        self.sftp = cast(paramiko.SFTPClient, _LocalSFTP(self.home))
+        logger.info("Connected to the local machine as %s", self.username)
+
+        return ""
+
+    def host_key_fingerprint(self) -> str:
+        """Get the machine id, empty if it is not found"""
+
+        try:
+            with open(MACHINE_ID_PATH, encoding="utf-8") as machine_id_file:
+                return "machine-id:" + machine_id_file.read().strip()
+        except OSError:
+            return ""
+
+    def exec(
+        self,
+        command,
+        bufsize=-1,
+        timeout=None,
+        get_pty=False,
+        environment=None,
+        on_output: Optional[OutputCallback] = None,
+        stdin: Optional[StdinData] = None,
+    ) -> CommandResult:
+        """Execute a command as a local process
+
+        The command runs in the home of the user with /bin/sh, like a
+        command of the SSH server. There is no terminal, so get_pty is
+        not used.
+        """
+
+        result = CommandResult(command)
+
+        if not self.is_connected:
+            result.error = "Not connected to the local machine"
+            return result
+
+        if not command:
+            result.error = "Not command to execute given"
+            return result
+
+        env = dict(os.environ)
+        if environment:
+            env.update(environment)
+
+        start = time.monotonic()
+
+        try:
+            # the command is a shell command, like the ones sent to sshd
+            process = subprocess.Popen(  # nosec B602
+                command,
+                shell=True,
+                cwd=self.home or None,
+                env=env,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+        except OSError as e:
+            result.error = "OSError: " + str(e)
+            logger.exception(result.error)
+            return result
+
+        stdout = _OutputSink("stdout", on_output)
+        stderr = _OutputSink("stderr", on_output)
+        readers = [
+            threading.Thread(
+                target=_read_stream, args=(process.stdout, stdout, bufsize), daemon=True
+            ),
+            threading.Thread(
+                target=_read_stream, args=(process.stderr, stderr, bufsize), daemon=True
+            ),
+        ]
+
+        for reader in readers:
+            reader.start()
+
+        if stdin is not None:
+            self._write_stdin(process, stdin)
+
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired as e:
+            # the whole session, so the children of the shell end too
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+            result.error = "Timeout: " + str(e)
+            logger.error(result.error)
+
+        for reader in readers:
+            reader.join()
+
+        result.stdout = stdout.close()
+        result.stderr = stderr.close()
+        if not result.error:
+            result.exit_status = process.returncode
+            # a command killed by a signal gets the exit status of the shells
+            if process.returncode < 0:
+                result.exit_status = 128 - process.returncode
+
+        result.duration = time.monotonic() - start
+        logger.debug("%r", result)
+
+        return result
+
+    @staticmethod
+    def _write_stdin(process: subprocess.Popen, stdin: StdinData) -> None:
+        """Send the input of a command and close it
+
+        If the command ends before reading all its input, the rest of
+        the input is not sent.
+        """
+
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+
+        if process.stdin is None:
+            return
+
+        try:
+            if isinstance(stdin, bytes):
+                process.stdin.write(stdin)
+            else:
+                for chunk in iter(functools.partial(stdin.read, SEND_SIZE), b""):
+                    process.stdin.write(chunk)
+            process.stdin.close()
+
+        except OSError as e:
+            # the exit status and stderr of the command tell why
+            logger.warning("stdin of command not sent: %s", str(e))
+
+    def upload(
+        self,
+        local_path: str,
+        remote_path: str,
+        streams: int = 1,
+        chunk_size: int = SEND_SIZE,
+        window_size: int = 0,
+        packet_size: int = 0,
+        on_progress: Optional[UploadCallback] = None,
+    ) -> str:
+        """Copy a file, the streams, window and packet sizes are not used
+
+        The file is written to a part file, which replaces remote_path at
+        the end. Returns an error message.
+        """
+
+        if not self.is_connected:
+            return "Not connected to the local machine"
+
+        path = os.path.join(self.home, remote_path)
+        part_path = path + UPLOAD_PART_SUFFIX
+
+        try:
+            size = os.path.getsize(local_path)
+            copied = 0
+            with open(local_path, "rb") as local_file, open(part_path, "wb") as part:
+                for chunk in iter(functools.partial(local_file.read, chunk_size), b""):
+                    part.write(chunk)
+                    copied += len(chunk)
+                    if on_progress is not None:
+                        on_progress(copied, size)
+            os.replace(part_path, path)
+        except OSError as e:
+            return_message = f"Can not upload {local_path}: {str(e)}"
+            logger.warning(return_message)
+            return return_message
+
+        return ""
+
+
+def _read_stream(stream, sink: _OutputSink, bufsize: int = -1) -> None:
+    """Read a stream of a process until it ends"""
+
+    if bufsize <= 0:
+        bufsize = RECV_SIZE
+
+    for data in iter(functools.partial(stream.read1, bufsize), b""):
+        sink.feed(data)
+
+    stream.close()
@@ -0,0 +1,392 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal git mirror cache functions
+
+The repos are fetched once into local bare mirrors and sent to the
+remote hosts as git bundles over SFTP, so the hosts do not need access
+to the git servers.
+
+Every remote host keeps a bare repo per mirror, updated from the
+bundles. Only the commits the remote bare repo does not have are put
+in the bundle, and the clones of the host are made from it.
+"""
+
+import hashlib
+import logging
+import os
+import secrets
+import shlex
+import subprocess  # nosec B404
+import threading
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from kaajal.config import app_config
+from kaajal.connection import SSHConnection
+from kaajal.repos import DEFAULT_CLONE_JOBS
+from kaajal.repos import EXISTS_MARKER
+from kaajal.repos import ProgressCallback
+from kaajal.repos import Repo
+from kaajal.repos import RepoCloner
+from kaajal.repos import RepoResult
+
+logger = logging.getLogger(__name__)
+
+MIRROR_CACHE_NAME = "mirrors"
+
+# Seconds a mirror is not fetched again
+MIRROR_MAX_AGE = 300.0
+
+# Dir of the bare repos on the remote hosts, relative to the home
+REMOTE_MIRROR_DIR = ".cache/kaajal/mirrors"
+
+# Refs sent in the bundles
+BUNDLE_REFS = ["HEAD", "--branches", "--tags"]
+
+
+class MirrorCache:
+    """Local cache of bare mirrors of git repos"""
+
+    def __init__(self, path: str = "", max_age: float = MIRROR_MAX_AGE) -> None:
+        """Class constructor of Mirror Cache
+
+        If path is not given, the mirrors are saved in the user config dir.
+        """
+
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._mirror_locks: Dict[str, threading.Lock] = {}
+        # time of the last fetch of every mirror
+        self._fetched: Dict[str, float] = {}
+
+    def get_path(self) -> str:
+        """Get the dir of the mirrors, empty if there is not any"""
+
+        if self.path:
+            return self.path
+
+        if app_config.user_config_dir:
+            return os.path.join(app_config.user_config_dir, MIRROR_CACHE_NAME)
+
+        return ""
+
+    @staticmethod
+    def mirror_name(url: str) -> str:
+        """Get the name of the mirror of a URL"""
+
+        name = url.rstrip("/").rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+        if name.endswith(".git"):
+            name = name[:-4]
+
+        url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()[:12]
+
+        return f"{name}-{url_hash}.git"
+
+    def mirror_path(self, url: str) -> str:
+        """Get the path of the mirror of a URL"""
+
+        return os.path.join(self.get_path(), self.mirror_name(url))
+
+    def update(self, url: str) -> str:
+        """Create or fetch the mirror of a URL
+
+        A mirror fetched less than max_age seconds ago is not fetched.
+        Returns an error message.
+        """
+
+        if not self.get_path():
+            return "No dir for the git mirrors"
+
+        path = self.mirror_path(url)
+
+        with self._lock:
+            mirror_lock = self._mirror_locks.setdefault(path, threading.Lock())
+
+        # the hosts that want the same repo wait for one fetch
+        with mirror_lock:
+            if time.monotonic() - self._fetched.get(path, -self.max_age) < self.max_age:
+                return ""
+
+            if os.path.isdir(path):
+                logger.info("Fetching mirror of %s", url)
+                error_msg = run_git(["-C", path, "remote", "update", "--prune"])[1]
+            else:
+                logger.info("Creating mirror of %s", url)
+                os.makedirs(self.get_path(), mode=0o750, exist_ok=True)
+                error_msg = run_git(["clone", "--mirror", "--", url, path])[1]
+
+            if not error_msg:
+                self._fetched[path] = time.monotonic()
+
+        return error_msg
+
+    def head(self, url: str) -> str:
+        """Get the default branch of a mirror"""
+
+        return run_git(["-C", self.mirror_path(url), "symbolic-ref", "HEAD"])[0]
+
+    def refs(self, url: str) -> Dict[str, str]:
+        """Get the object name of the branches and tags of a mirror"""
+
+        output = run_git(
+            [
+                "-C",
+                self.mirror_path(url),
+                "for-each-ref",
+                "--format=%(refname) %(objectname)",
+                "refs/heads",
+                "refs/tags",
+            ]
+        )[0]
+
+        return dict(line.split() for line in output.split("\n") if line)
+
+    def create_bundle(self, url: str, remote_refs: List[str]) -> Tuple[str, str]:
+        """Create a bundle of a mirror without the commits of remote_refs
+
+        Returns the path of the bundle, empty if there is nothing new, and
+        an error message. The caller removes the bundle.
+        """
+
+        path = self.mirror_path(url)
+
+        # the remote can have commits that are not in the mirror anymore
+        known = run_git(
+            ["-C", path, "cat-file", "--batch-check=%(objectname) %(objecttype)"],
+            "\n".join(remote_refs) + "\n",
+        )[0]
+        prerequisites = [
+            "^" + line.split()[0]
+            for line in known.split("\n")
+            if line.endswith(" commit")
+        ]
+
+        bundle_path = os.path.join(self.get_path(), f".{secrets.token_hex(8)}.bundle")
+        error_msg = run_git(
+            ["-C", path, "bundle", "create", bundle_path, *BUNDLE_REFS] + prerequisites
+        )[1]
+
+        if error_msg:
+            if os.path.exists(bundle_path):
+                os.remove(bundle_path)
+            if "empty bundle" in error_msg:
+                return "", ""
+            return "", error_msg
+
+        return bundle_path, ""
+
+
+def run_git(args: List[str], stdin: Optional[str] = None) -> Tuple[str, str]:
+    """Run a local git command
+
+    Returns the stdout and an error message.
+    """
+
+    try:
+        process = subprocess.run(  # nosec B603 B607
+            ["git", *args],
+            input=stdin,
+            capture_output=True,
+            text=True,
+            check=False,
+            env=dict(os.environ, GIT_TERMINAL_PROMPT="0"),
+        )
+    except OSError as e:
+        return_message = "Can not run git: " + str(e)
+        logger.warning(return_message)
+        return "", return_message
+
+    if process.returncode:
+        lines = process.stderr.strip().split("\n")
+        fatal = [line for line in lines if line.startswith(("fatal:", "error:"))]
+        return_message = fatal[0] if fatal else lines[-1]
+        return process.stdout.strip(), return_message or "git failed"
+
+    return process.stdout.strip(), ""
+
+
+class BundleCloner(RepoCloner):
+    """Clone git repositories from bundles of the local mirror cache"""
+
+    def __init__(
+        self,
+        ssh_conn: SSHConnection,
+        mirror_cache: MirrorCache,
+        jobs: int = DEFAULT_CLONE_JOBS,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        """Class constructor of Bundle Cloner"""
+
+        # bundles have the full history, depth and filter are not used
+        super().__init__(ssh_conn, jobs, on_progress=on_progress)
+        self.mirror_cache = mirror_cache
+        self._send_locks: Dict[str, threading.Lock] = {}
+
+    def clone(self, repo: Repo) -> RepoResult:
+        """Clone one repo from a bundle"""
+
+        start = time.monotonic()
+
+        self._progress(repo, "updating mirror")
+        error_msg = self.mirror_cache.update(repo.url)
+
+        if not error_msg:
+            with self._lock:
+                send_lock = self._send_locks.setdefault(repo.url, threading.Lock())
+            # two paths of the same repo update the remote bare repo once
+            with send_lock:
+                error_msg = self.send_bundle(repo.url)
+
+        if error_msg:
+            result = RepoResult(repo)
+            result.status = "failed"
+            result.error = error_msg
+        else:
+            self._progress(repo, "cloning from bundle")
+            result = self._run_clone(repo, self.clone_cmd(repo))
+
+        result.duration = time.monotonic() - start
+        self._end_clone(result)
+
+        return result
+
+    def remote_mirror_dir(self) -> str:
+        """Get the dir of the bare repos on the remote host"""
+
+        return self.ssh_conn.get_home() + "/" + REMOTE_MIRROR_DIR
+
+    def remote_mirror_path(self, url: str) -> str:
+        """Get the path of the bare repo of a URL on the remote host"""
+
+        return self.remote_mirror_dir() + "/" + self.mirror_cache.mirror_name(url)
+
+    def send_bundle(self, url: str) -> str:
+        """Update the remote bare repo of a URL with a bundle
+
+        Only the commits that the remote bare repo does not have are sent.
+        Returns an error message.
+        """
+
+        remote_path = self.remote_mirror_path(url)
+        quoted_path = shlex.quote(remote_path)
+
+        result = self.ssh_conn.exec(
+            f"git -C {quoted_path} for-each-ref --format='%(refname) %(objectname)' "
+            "2>/dev/null || true"
+        )
+        if result.error:
+            return result.error
+
+        remote_refs = dict(line.split() for line in result.stdout.split("\n") if line)
+        bundle_path, error_msg = self.mirror_cache.create_bundle(
+            url, list(remote_refs.values())
+        )
+
+        if error_msg:
+            return error_msg
+
+        # the remote has all the commits, but the refs can point to others
+        if not bundle_path:
+            return self._update_refs(url, remote_refs)
+
+        remote_bundle = remote_path + "." + os.path.basename(bundle_path)[1:]
+
+        try:
+            error_msg = self.ssh_conn.makedirs(self.remote_mirror_dir())
+            if not error_msg:
+                error_msg = self._put(bundle_path, remote_bundle, url)
+        finally:
+            os.remove(bundle_path)
+
+        if error_msg:
+            return error_msg
+
+        quoted_bundle = shlex.quote(remote_bundle)
+        head = self.mirror_cache.head(url)
+        cmd = f"git init -q --bare {quoted_path}"
+        cmd += f" && git -C {quoted_path} fetch -q {quoted_bundle}"
+        cmd += " '+refs/heads/*:refs/heads/*' '+refs/tags/*:refs/tags/*'"
+        if head:
+            cmd += f" && git -C {quoted_path} symbolic-ref HEAD {shlex.quote(head)}"
+        cmd += f"; rc=$?; rm -f {quoted_bundle}; exit $rc"
+
+        result = self.ssh_conn.exec(cmd)
+
+        if not result.ok:
+            return result.error or result.stderr.strip() or "git fetch failed"
+
+        return ""
+
+    def _update_refs(self, url: str, remote_refs: Dict[str, str]) -> str:
+        """Move the refs of the remote bare repo to the refs of the mirror
+
+        The remote bare repo must have the commits of the refs.
+        Returns an error message.
+        """
+
+        moved = {
+            ref: name
+            for ref, name in self.mirror_cache.refs(url).items()
+            if remote_refs.get(ref) != name
+        }
+
+        if not moved:
+            logger.info("%s: remote mirror is up to date", url)
+            return ""
+
+        logger.info("%s: moving %d refs of the remote mirror", url, len(moved))
+
+        quoted_path = shlex.quote(self.remote_mirror_path(url))
+        head = self.mirror_cache.head(url)
+        cmd = f"git -C {quoted_path} update-ref --stdin"
+        if head:
+            cmd += f" && git -C {quoted_path} symbolic-ref HEAD {shlex.quote(head)}"
+
+        result = self.ssh_conn.exec(
+            cmd,
+            stdin="".join(f"update {ref} {name}\n" for ref, name in moved.items()),
+        )
+
+        if not result.ok:
+            return result.error or result.stderr.strip() or "git update-ref failed"
+
+        return ""
+
+    def clone_cmd(self, repo: Repo) -> str:
+        """Get the command that clones the repo from the remote bare repo"""
+
+        path = shlex.quote(repo.get_path())
+        remote_path = shlex.quote(self.remote_mirror_path(repo.url))
+
+        cmd = "git clone --progress"
+        if repo.branch:
+            cmd += " --branch " + shlex.quote(repo.branch)
+        cmd += f" -- {remote_path} {path}"
+        # the clone fetches from the real repo when it has access
+        cmd += f" && git -C {path} remote set-url origin {shlex.quote(repo.url)}"
+
+        return f"if [ -d {path}/.git ]; then echo {EXISTS_MARKER}; else {cmd}; fi"
+
+    def _put(self, local_path: str, remote_path: str, url: str) -> str:
+        """Copy a bundle to the remote host with SFTP"""
+
+        size = os.path.getsize(local_path)
+        logger.info("%s: sending bundle of %d bytes", url, size)
+
+        error_msg = self.ssh_conn.upload(local_path, remote_path)
+        if error_msg:
+            return f"Can not send bundle of {url}: {error_msg}"
+
+        return ""
+
+
+mirror_cache = MirrorCache()
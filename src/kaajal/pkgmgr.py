@@ -0,0 +1,244 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal package manager backends
+
+Every backend knows the commands of one package manager. The "fast"
+profile adds the options that make the downloads and installs quicker
+while keeping them safe.
+"""
+
+import logging
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class PackageManager:
+    """Base class of the package manager backends"""
+
+    # binary name, it is the value of Distro.pm
+    name = ""
+    # values of ID in /etc/os-release using this package manager
+    distro_ids: Tuple[str, ...] = ()
+    # files updated when the package metadata is refreshed
+    metadata_files = ""
+    # options added by the fast profile
+    fast_options = ""
+    fast_install_options = ""
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        """Get the commands to update the system
+
+        If refresh is False, the package metadata is not refreshed.
+        """
+
+        return []
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        """Get the command to install the packages"""
+
+        return ""
+
+    def installed_cmd(self) -> str:
+        """Get the command to list the installed package names"""
+
+        return ""
+
+    def parse_installed(self, output: str) -> Set[str]:
+        """Get the package names from the output of installed_cmd"""
+
+        return {line.strip() for line in output.split("\n") if line.strip()}
+
+    def _options(self, fast: bool, install: bool = False) -> str:
+        """Get the options of the profile with a trailing space"""
+
+        if not fast:
+            return ""
+
+        options = self.fast_options
+        if install and self.fast_install_options:
+            options = (options + " " + self.fast_install_options).strip()
+
+        return options + " " if options else ""
+
+
+class Dnf(PackageManager):
+    """dnf package manager"""
+
+    name = "dnf"
+    distro_ids = ("fedora", "centos", "rhel", "rocky", "almalinux", "ol")
+    metadata_files = (
+        "/var/cache/dnf/last_makecache /var/cache/dnf/*/repodata/repomd.xml"
+        " /var/cache/libdnf5/*/repodata/repomd.xml"
+    )
+    fast_options = "--setopt=max_parallel_downloads=10"
+    fast_install_options = "--setopt=install_weak_deps=False"
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        cmd = "dnf -y " + self._options(fast)
+        if not refresh:
+            # use the metadata in cache even if dnf thinks it is expired
+            cmd += "--setopt=metadata_expire=never "
+        return [cmd + "update"]
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        return "dnf -y " + self._options(fast, True) + "install " + str_pkgs_list
+
+    def installed_cmd(self) -> str:
+        return "rpm -qa --qf '%{NAME}\\n'"
+
+
+class Apt(PackageManager):
+    """apt-get package manager"""
+
+    name = "apt-get"
+    distro_ids = ("debian", "ubuntu", "linuxmint", "pop", "raspbian")
+    # files written only by a successful update, an install rewrites
+    # pkgcache.bin too; the lists can keep the date of the server, which
+    # makes them look older, never fresher
+    metadata_files = (
+        "/var/lib/apt/lists/*_InRelease /var/lib/apt/lists/*_Release"
+        " /var/lib/apt/periodic/update-success-stamp"
+    )
+    # one download queue per host (the default of apt, kept explicit), so
+    # the hosts of the sources are fetched in parallel
+    fast_options = "-o Acquire::Queue-Mode=host -o Acquire::Retries=3"
+    fast_install_options = "--no-install-recommends"
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        cmds = []
+        # apt-get update only refreshes the metadata
+        if refresh:
+            cmds.append("apt-get -y " + self._options(fast) + "update")
+        cmds.append("apt-get -y " + self._options(fast) + "upgrade")
+        return cmds
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        return "apt-get -y " + self._options(fast, True) + "install " + str_pkgs_list
+
+    def installed_cmd(self) -> str:
+        return "dpkg-query -W -f='${db:Status-Abbrev} ${Package}\\n'"
+
+    def parse_installed(self, output: str) -> Set[str]:
+        installed = set()
+        for line in output.split("\n"):
+            values = line.split()
+            # only packages in status "ii": install ok installed
+            if len(values) == 2 and values[0] == "ii":
+                installed.add(values[1])
+        return installed
+
+
+class Zypper(PackageManager):
+    """zypper package manager"""
+
+    name = "zypper"
+    distro_ids = (
+        "opensuse",
+        "opensuse-leap",
+        "opensuse-tumbleweed",
+        "sles",
+        "sled",
+    )
+    metadata_files = "/var/cache/zypp/raw/*/repodata/repomd.xml"
+    fast_install_options = "--no-recommends"
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        if refresh:
+            return [
+                "zypper --non-interactive refresh",
+                "zypper --non-interactive update",
+            ]
+        return ["zypper --non-interactive --no-refresh update"]
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        cmd = "zypper --non-interactive install " + self._options(fast, True)
+        return cmd + str_pkgs_list
+
+    def installed_cmd(self) -> str:
+        return "rpm -qa --qf '%{NAME}\\n'"
+
+
+class Pacman(PackageManager):
+    """pacman package manager"""
+
+    name = "pacman"
+    distro_ids = ("arch", "archarm", "manjaro", "endeavouros")
+    metadata_files = "/var/lib/pacman/sync/*.db"
+    fast_install_options = "--needed"
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        if refresh:
+            return ["pacman -Syu --noconfirm"]
+        return ["pacman -Su --noconfirm"]
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        return "pacman -S --noconfirm " + self._options(fast, True) + str_pkgs_list
+
+    def installed_cmd(self) -> str:
+        return "pacman -Qq"
+
+
+class Apk(PackageManager):
+    """apk package manager"""
+
+    name = "apk"
+    distro_ids = ("alpine", "postmarketos")
+    metadata_files = "/var/cache/apk/APKINDEX.*.tar.gz"
+    fast_options = "--no-progress"
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        cmds = []
+        if refresh:
+            cmds.append("apk " + self._options(fast) + "update")
+        cmds.append("apk " + self._options(fast) + "upgrade")
+        return cmds
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        return "apk " + self._options(fast, True) + "add " + str_pkgs_list
+
+    def installed_cmd(self) -> str:
+        return "apk info"
+
+
+_backends: Dict[str, PackageManager] = {}
+
+
+def register_backend(backend: PackageManager) -> None:
+    """Add a package manager backend to the registry"""
+
+    _backends[backend.name] = backend
+    logger.debug("Registered package manager %s", backend.name)
+
+
+def get_backend(name: str) -> Optional[PackageManager]:
+    """Get the backend of a package manager by its name"""
+
+    return _backends.get(name)
+
+
+def find_backend(
+    distro_id: str, id_like: Iterable[str] = ()
+) -> Optional[PackageManager]:
+    """Find the backend of a distro by its ID, or by its ID_LIKE values"""
+
+    for wanted_id in [distro_id, *id_like]:
+        for backend in _backends.values():
+            if wanted_id in backend.distro_ids:
+                return backend
+
+    return None
+
+
+for _backend in (Dnf(), Apt(), Zypper(), Pacman(), Apk()):
+    register_backend(_backend)
@@ -0,0 +1,1020 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal provisioning plan functions
+
+The provisioning steps of a host are compiled into one remote shell
+script, which runs with one command. Every step prints markers with its
+index and exit status, the markers are read while the output streams,
+so every step gets its own exit status and duration. The script stops
+at the first step that fails. The steps done by a previous run with the
+same input are left out of the script if a step journal is given.
+
+A plan file is a YAML file with the steps of a host and the steps each
+one needs. The steps that do not depend on each other run at the same
+time::
+
+    steps:
+      - type: update
+      - type: packages
+        packages: [git, tmux, vim]
+        needs: [update]
+      - type: repos
+        repos:
+          - https://github.com/miguelinux/kaajal.git src/kaajal
+        needs: [packages]
+      - name: tools
+        type: tarballs
+        tarballs:
+          - source: https://example.com/tools.tar.gz
+            path: /opt/tools
+
+The name of a step is its type if it is not given. The types are proxy,
+update, packages, users, ssh_keys, repos and tarballs. The input of a
+step includes the inputs of the steps it needs, so a step whose input
+changed is run again with all the steps after it.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import secrets
+import shlex
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import yaml
+
+from kaajal.connection import OutputCallback
+from kaajal.connection import SSHConnection
+from kaajal.distro import Distro
+from kaajal.distro import NewUser
+from kaajal.distro import _ssh_key_id
+from kaajal.journal import StepJournal
+from kaajal.journal import step_hash
+from kaajal.repos import DEFAULT_CLONE_JOBS
+from kaajal.repos import Repo
+from kaajal.repos import RepoCloner
+from kaajal.repos import repo_from_entry
+from kaajal.tarball import Tarball
+from kaajal.tarball import TarballInstaller
+from kaajal.tarball import detect_compression
+from kaajal.tarball import digest_cache
+from kaajal.tarball import tarball_from_entry
+
+logger = logging.getLogger(__name__)
+
+# Lines of output kept in the result of every step
+STEP_TAIL_LINES = 20
+
+# Steps of a plan file run at the same time
+DEFAULT_PLAN_JOBS = 4
+
+# Types of the steps of a plan file
+STEP_TYPES = ("proxy", "update", "packages", "users", "ssh_keys", "repos", "tarballs")
+
+# Steps that run the package manager, only one runs at a time
+PKG_MANAGER_STEPS = ("update", "packages")
+
+# Called with the result of a step when it ends
+StepCallback = Callable[["StepResult"], None]
+
+
+class PlanStep:
+    """Step of a provisioning plan"""
+
+    def __init__(
+        self, name: str, script: str, sudo: str = "", max_age: float = 0.0
+    ) -> None:
+        """Class constructor of Plan Step
+
+        script is a shell script, run with the sudo prefix if it is given.
+        max_age are the seconds the step is not run again with the same
+        script, -1 to run it always.
+        """
+
+        self.name = name
+        self.script = script
+        self.sudo = sudo
+        self.max_age = max_age
+
+    def command(self, marker: str) -> str:
+        """Get the command that runs the step
+
+        The script of a sudo step is given to sh in a here document, so
+        the passwords and tokens it has are never in the arguments of a
+        command, which anyone can read in ps.
+        """
+
+        if self.sudo:
+            delimiter = marker + "_STEP"
+            return f"{self.sudo} sh -s <<'{delimiter}'\n{self.script}\n{delimiter}"
+
+        return self.script
+
+
+class StepResult:
+    """Result of a step of a provisioning plan"""
+
+    def __init__(self, name: str) -> None:
+        """Class constructor of Step Result"""
+
+        self.name = name
+        # -1 if the step was not run
+        self.exit_status = -1
+        self.duration = 0.0
+        # last lines of the output
+        self.output: List[str] = []
+        # Error message if the step failed
+        self.error = ""
+        # True if the step was done by a previous run
+        self.skipped = False
+
+    @property
+    def ok(self) -> bool:
+        """True if the step ended well"""
+
+        return self.exit_status == 0
+
+
+class PlanResult:
+    """Result of a provisioning plan"""
+
+    def __init__(self) -> None:
+        """Class constructor of Plan Result"""
+
+        self.steps: List[StepResult] = []
+        self.error = ""
+        self.failed_step = ""
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if all the steps ended well"""
+
+        return not self.error
+
+
+class Plan:
+    """Provisioning steps run as one remote script"""
+
+    def __init__(self) -> None:
+        """Class constructor of Plan"""
+
+        self.steps: List[PlanStep] = []
+
+    def add(self, name: str, script: str, sudo: str = "", max_age: float = 0.0) -> None:
+        """Add a step at the end of the plan"""
+
+        self.steps.append(PlanStep(name, script, sudo, max_age))
+
+    def compile(self, marker: str, skip: Optional[List[str]] = None) -> str:
+        """Get the script that runs all the steps, but the ones to skip
+
+        The script is read by sh from its stdin, so the steps do not read
+        from it.
+        """
+
+        script = ""
+
+        for index, step in enumerate(self.steps):
+            if skip and step.name in skip:
+                continue
+            script += f"printf '%s BEGIN {index}\\n' {marker}\n"
+            # sub shell, so exit or cd in a step does not affect the rest
+            script += f"( {step.command(marker)}\n) </dev/null 2>&1\n"
+            script += "rc=$?\n"
+            script += f"printf '\\n%s END {index} %d\\n' {marker} $rc\n"
+            script += "[ $rc -eq 0 ] || exit $rc\n"
+
+        return script
+
+    def run(
+        self,
+        ssh_conn: SSHConnection,
+        on_output: Optional[OutputCallback] = None,
+        on_step: Optional[StepCallback] = None,
+        journal: Optional[StepJournal] = None,
+    ) -> PlanResult:
+        """Run the plan with one remote command
+
+        If journal is given, the steps done with the same script by a
+        previous run are skipped, until the first one that is not.
+        """
+
+        result = PlanResult()
+        result.steps = [StepResult(step.name) for step in self.steps]
+        start = time.monotonic()
+        host_id = ssh_conn.host_id()
+        fingerprint = ssh_conn.host_key_fingerprint() if journal else ""
+        skip: List[str] = []
+
+        for step, step_result in zip(self.steps, result.steps):
+            if journal is None or step.max_age < 0:
+                break
+            step_input = step_hash(step.sudo, step.script)
+            if not journal.is_done(
+                host_id, fingerprint, step.name, step_input, step.max_age
+            ):
+                break
+            skip.append(step.name)
+            step_result.exit_status = 0
+            step_result.skipped = True
+            logger.info("%s: done by a previous run", step.name)
+
+        if len(skip) == len(self.steps):
+            return result
+
+        marker = "__kaajal_" + secrets.token_hex(8)
+        current: List[Optional[StepResult]] = [None]
+        step_start = [0.0]
+        # the empty line printed before every END marker
+        held: List[str] = []
+
+        def read_output(stream: str, line: str) -> None:
+            values = line.split()
+
+            if line.startswith(marker + " ") and len(values) >= 3:
+                step_result = result.steps[int(values[2])]
+                if values[1] == "BEGIN":
+                    current[0] = step_result
+                    step_start[0] = time.monotonic()
+                    logger.info("Step %s", step_result.name)
+                else:
+                    step_result.exit_status = int(values[3])
+                    step_result.duration = time.monotonic() - step_start[0]
+                    if step_result.exit_status and step_result.output:
+                        step_result.error = step_result.output[-1]
+                    if journal is not None:
+                        _journal_step(
+                            journal, host_id, fingerprint, self.steps, step_result
+                        )
+                    current[0] = None
+                    if on_step is not None:
+                        on_step(step_result)
+                held.clear()
+                return
+
+            if held:
+                _forward(held.pop(), stream, current[0], on_output)
+            if line == "":
+                held.append(line)
+            else:
+                _forward(line, stream, current[0], on_output)
+
+        # on stdin, the script is not in the arguments of the command
+        cmd_result = ssh_conn.exec(
+            "sh -s", on_output=read_output, stdin=self.compile(marker, skip)
+        )
+        result.duration = time.monotonic() - start
+
+        failed = [step for step in result.steps if step.exit_status > 0]
+
+        if cmd_result.error:
+            result.error = cmd_result.error
+        elif failed:
+            result.failed_step = failed[0].name
+            result.error = f"{failed[0].name} failed with exit status "
+            result.error += str(failed[0].exit_status)
+            if failed[0].error:
+                result.error += ": " + failed[0].error
+        elif cmd_result.exit_status:
+            result.error = f"Plan failed with exit status {cmd_result.exit_status}"
+
+        if result.error:
+            logger.warning(result.error)
+        else:
+            logger.info("Plan done in %.1f s", result.duration)
+
+        return result
+
+
+def _journal_step(
+    journal: StepJournal,
+    host_id: str,
+    fingerprint: str,
+    steps: List[PlanStep],
+    step_result: StepResult,
+) -> None:
+    """Record a step done, or forget it if it failed"""
+
+    if not step_result.ok:
+        journal.forget(host_id, step_result.name)
+        return
+
+    for step in steps:
+        if step.name == step_result.name:
+            journal.record(
+                host_id,
+                fingerprint,
+                step.name,
+                step_hash(step.sudo, step.script),
+                step_result.duration,
+            )
+
+
+def _forward(
+    line: str,
+    stream: str,
+    step_result: Optional[StepResult],
+    on_output: Optional[OutputCallback],
+) -> None:
+    """Keep a line of output of a step and give it to the callback"""
+
+    if step_result is not None:
+        step_result.output.append(line)
+        del step_result.output[:-STEP_TAIL_LINES]
+
+    if on_output is not None:
+        on_output(stream, line)
+
+
+class PlanCompiler:
+    """Build the provisioning plan of an identified host"""
+
+    def __init__(self, distro: Distro) -> None:
+        """Class constructor of Plan Compiler"""
+
+        self.distro = distro
+
+    def compile(
+        self,
+        str_pkgs_list: str = "",
+        users: Optional[List[NewUser]] = None,
+        ssh_key_paths: Optional[List[str]] = None,
+        repos: Optional[List[Repo]] = None,
+        tarballs: Optional[List[Tarball]] = None,
+        update: bool = True,
+    ) -> Tuple[Plan, str]:
+        """Get the plan of the host
+
+        Only the packages that are not installed are in the plan. Local
+        tarballs are sent with their own command, only the URLs are in
+        the plan. Returns the plan and an error message.
+        """
+
+        plan = Plan()
+        distro = self.distro
+        backend = distro.get_pkg_manager()
+        needs_root = update or str_pkgs_list or users
+
+        if needs_root and distro.uid != "0" and not distro.sudo:
+            return plan, "User is not allowed to update the system"
+
+        if (update or str_pkgs_list) and backend is None:
+            return plan, f"No package manager known for {distro.id}"
+
+        proxy_script = distro.proxy_script(distro.pm)
+        if proxy_script:
+            plan.add("proxy", proxy_script, distro.sudo)
+
+        if update:
+            # the update is done again when the package metadata is old
+            max_age = distro.metadata_max_age if distro.metadata_max_age > 0 else -1
+            plan.add("update", self.update_script(), distro.sudo, max_age)
+
+        if repos and "git" not in str_pkgs_list.split():
+            str_pkgs_list = (str_pkgs_list + " git").strip()
+
+        installed = distro.installed_packages() if str_pkgs_list else None
+
+        if installed is not None:
+            missing = [pkg for pkg in str_pkgs_list.split() if pkg not in installed]
+            if not missing:
+                logger.info("Packages already installed: %s", str_pkgs_list)
+            str_pkgs_list = " ".join(missing)
+
+        if str_pkgs_list and backend is not None:
+            plan.add(
+                "install", backend.install_cmd(str_pkgs_list, distro.fast), distro.sudo
+            )
+
+        if users:
+            script, error_msg = self.users_script(users)
+            if error_msg:
+                return plan, error_msg
+            plan.add("users", script, distro.sudo, -1)
+
+        if ssh_key_paths:
+            script, error_msg = self.ssh_keys_script(ssh_key_paths)
+            if error_msg:
+                return plan, error_msg
+            plan.add("ssh_keys", script)
+
+        if repos and distro.ssh_conn is not None:
+            cloner = RepoCloner(distro.ssh_conn)
+            for repo in repos:
+                plan.add("repo " + repo.get_path(), cloner.clone_cmd(repo))
+
+        if tarballs and distro.ssh_conn is not None:
+            installer = TarballInstaller(distro.ssh_conn, distro.sudo)
+            for tarball in tarballs:
+                if not tarball.is_url():
+                    return plan, f"{tarball.source}: only URLs can be in a plan"
+                compression = detect_compression(tarball.get_source())
+                plan.add(
+                    "tarball " + tarball.get_path(),
+                    installer.extract_cmd(tarball, compression),
+                )
+
+        return plan, ""
+
+    def update_script(self) -> str:
+        """Get the script that updates the system
+
+        The package metadata is not refreshed if it is younger than the
+        metadata_max_age of the distro.
+        """
+
+        distro = self.distro
+        backend = distro.get_pkg_manager()
+
+        if backend is None:
+            return "false"
+
+        refresh = " && ".join(backend.update_cmds(distro.fast, True))
+        no_refresh = " && ".join(backend.update_cmds(distro.fast, False))
+
+        if distro.metadata_max_age <= 0 or not backend.metadata_files:
+            return refresh
+
+        script = "now=$(date +%s)\n"
+        script += f"last=$(stat -c %Y {backend.metadata_files} 2>/dev/null"
+        script += " | sort -n | tail -n 1)\n"
+        script += 'if [ -n "$last" ] && '
+        script += f"[ $((now - last)) -lt {int(distro.metadata_max_age)} ]; then\n"
+        script += "echo Package metadata is fresh, not refreshed\n"
+        script += no_refresh + "\n"
+        script += "else\n"
+        script += refresh + "\n"
+        script += "fi\n"
+
+        return script
+
+    def users_script(self, users: List[NewUser]) -> Tuple[str, str]:
+        """Get the script that creates the users
+
+        The script fails if a user does not exist at its end.
+        Returns the script and an error message.
+        """
+
+        results: dict = {}
+        valid_users: List[Tuple[NewUser, str, str]] = []
+
+        for new_user in users:
+            error_msg, ssh_pub_key, str_github_token = self.distro._read_new_user(
+                new_user, results
+            )
+            if error_msg:
+                return "", error_msg
+            results[new_user.user] = error_msg
+            valid_users.append((new_user, ssh_pub_key, str_github_token))
+
+        marker = "__kaajal_users_" + secrets.token_hex(8)
+        script = self.distro._users_script(valid_users, marker)[0]
+
+        for new_user in users:
+            script += f"id -u {new_user.user} >/dev/null || exit 1\n"
+
+        return script, ""
+
+    @staticmethod
+    def ssh_keys_script(ssh_key_paths: List[str]) -> Tuple[str, str]:
+        """Get the script that adds SSH keys to the authorized_keys of the user
+
+        The keys already in authorized_keys are not added again.
+        Returns the script and an error message.
+        """
+
+        script = "umask 077 && mkdir -p ~/.ssh && touch ~/.ssh/authorized_keys"
+
+        for ssh_key_path in ssh_key_paths:
+            if not os.path.exists(ssh_key_path):
+                return "", f"copy_ssh_key: {ssh_key_path} not found"
+
+            with open(ssh_key_path, encoding="utf-8") as ssh_key_file:
+                for line in ssh_key_file:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    script += " && { grep -qF " + shlex.quote(_ssh_key_id(line))
+                    script += " ~/.ssh/authorized_keys || echo " + shlex.quote(line)
+                    script += " >> ~/.ssh/authorized_keys; }"
+
+        return script, ""
+
+
+class PlanTask:
+    """Step of a plan file"""
+
+    def __init__(
+        self,
+        name: str,
+        step_type: str,
+        needs: Optional[List[str]] = None,
+        params: Optional[dict] = None,
+    ) -> None:
+        """Class constructor of Plan Task
+
+        needs are the names of the steps that must end well before this
+        one, params are the keys of the step in the plan file.
+        """
+
+        self.name = name
+        self.step_type = step_type
+        self.needs = needs or []
+        self.params = params or {}
+
+    def __repr__(self) -> str:
+        return f"PlanTask({self.name!r}, {self.step_type!r}, {self.needs!r})"
+
+
+def load_plan(path: str) -> Tuple[List[PlanTask], str]:
+    """Load the steps of a plan file
+
+    Returns the list of steps and an error message.
+    """
+
+    tasks: List[PlanTask] = []
+
+    if not os.path.exists(path):
+        return_message = path + ": not found"
+        logger.warning(return_message)
+        return tasks, return_message
+
+    try:
+        with open(path, encoding="utf-8") as plan_file:
+            yaml_data = yaml.safe_load(plan_file) or {}
+
+        for entry in yaml_data.get("steps") or []:
+            params = dict(entry)
+            step_type = params.pop("type")
+            needs = params.pop("needs", [])
+            if isinstance(needs, str):
+                needs = needs.split()
+            tasks.append(
+                PlanTask(str(params.pop("name", step_type)), step_type, needs, params)
+            )
+
+    except yaml.YAMLError as e:
+        return_message = "YAML Error: " + str(e)
+        logger.exception(return_message)
+        return tasks, return_message
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return_message = f"{path}: wrong step entry: {str(e)}"
+        logger.exception(return_message)
+        return tasks, return_message
+    except OSError as e:
+        return_message = "OS Error: " + str(e)
+        logger.exception(return_message)
+        return tasks, return_message
+
+    return_message = check_plan(tasks)
+
+    if return_message:
+        return_message = f"{path}: {return_message}"
+        logger.warning(return_message)
+
+    return tasks, return_message
+
+
+def check_plan(tasks: List[PlanTask]) -> str:
+    """Check the types and the dependencies of the steps
+
+    Returns an error message if a step is wrong or the steps need each
+    other in a cycle.
+    """
+
+    names: Set[str] = set()
+
+    for task in tasks:
+        if task.step_type not in STEP_TYPES:
+            return f"{task.name}: unknown step type {task.step_type}"
+        if task.name in names:
+            return f"{task.name}: step given twice"
+        names.add(task.name)
+
+    for task in tasks:
+        for need in task.needs:
+            if need not in names:
+                return f"{task.name}: needs unknown step {need}"
+
+    # a step is ordered when all the steps it needs are ordered
+    ordered: Set[str] = set()
+    remaining = list(tasks)
+
+    while remaining:
+        ready = [task for task in remaining if set(task.needs) <= ordered]
+        if not ready:
+            cycle = ", ".join(task.name for task in remaining)
+            return f"steps need each other: {cycle}"
+        for task in ready:
+            ordered.add(task.name)
+            remaining.remove(task)
+
+    return ""
+
+
+class PlanExecutor:
+    """Run the steps of a plan file on the host of a distro"""
+
+    def __init__(
+        self,
+        distro: Distro,
+        jobs: int = DEFAULT_PLAN_JOBS,
+        on_output: Optional[OutputCallback] = None,
+        on_step: Optional[StepCallback] = None,
+        journal: Optional[StepJournal] = None,
+        remote_journal: bool = False,
+    ) -> None:
+        """Class constructor of Plan Executor
+
+        At most jobs steps run at the same time. The lines given to
+        on_output start with the name of their step. If journal is given,
+        the steps done with the same input by a previous run are skipped,
+        if remote_journal is True, a copy of the journal of the host is
+        kept on the host.
+        """
+
+        self.distro = distro
+        self.jobs = max(1, jobs)
+        self.on_output = on_output
+        self.on_step = on_step
+        self.journal = journal
+        self.remote_journal = remote_journal
+        self._pkg_lock = threading.Lock()
+
+    def run(self, tasks: List[PlanTask]) -> PlanResult:
+        """Run the steps, each one when all the steps it needs ended well
+
+        The steps that need a failed step are not run.
+        """
+
+        result = PlanResult()
+        start = time.monotonic()
+
+        result.error = check_plan(tasks)
+        if result.error:
+            logger.warning(result.error)
+            return result
+
+        step_results = {task.name: StepResult(task.name) for task in tasks}
+        result.steps = list(step_results.values())
+        pending = list(tasks)
+        done: Set[str] = set()
+        stopped: Set[str] = set()
+        running: Dict[Future, PlanTask] = {}
+        hashes = self.input_hashes(tasks) if self.journal is not None else {}
+        ssh_conn = self.distro.ssh_conn
+        host_id = ssh_conn.host_id() if ssh_conn is not None else ""
+        fingerprint = ""
+
+        if self.journal is not None and ssh_conn is not None:
+            fingerprint = ssh_conn.host_key_fingerprint()
+            if self.remote_journal:
+                self.journal.load_remote(ssh_conn)
+
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="kaajal-plan"
+        ) as executor:
+            while pending or running:
+                for task in list(pending):
+                    if stopped.intersection(task.needs):
+                        pending.remove(task)
+                        stopped.add(task.name)
+                        logger.info("%s: not run", task.name)
+                    elif done.issuperset(task.needs) and self._is_done(
+                        task, hashes, host_id, fingerprint
+                    ):
+                        pending.remove(task)
+                        done.add(task.name)
+                        step_results[task.name].exit_status = 0
+                        step_results[task.name].skipped = True
+                        logger.info("%s: done by a previous run", task.name)
+                        if self.on_step is not None:
+                            self.on_step(step_results[task.name])
+                    elif done.issuperset(task.needs):
+                        pending.remove(task)
+                        future = executor.submit(
+                            self.run_task, task, step_results[task.name]
+                        )
+                        running[future] = task
+
+                if not running:
+                    # the skipped steps may stop or start more pending steps
+                    continue
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    task = running.pop(future)
+                    step_result = step_results[task.name]
+
+                    if step_result.ok:
+                        done.add(task.name)
+                        if self.journal is not None:
+                            self.journal.record(
+                                host_id,
+                                fingerprint,
+                                task.name,
+                                hashes[task.name],
+                                step_result.duration,
+                            )
+                    else:
+                        stopped.add(task.name)
+                        if self.journal is not None:
+                            self.journal.forget(host_id, task.name)
+                        if not result.error:
+                            result.failed_step = task.name
+                            result.error = f"{task.name}: {step_result.error}"
+
+                    if self.on_step is not None:
+                        self.on_step(step_result)
+
+        if self.journal is not None and self.remote_journal and ssh_conn is not None:
+            self.journal.save_remote(ssh_conn)
+
+        result.duration = time.monotonic() - start
+
+        if result.error:
+            logger.warning("Plan failed: %s", result.error)
+        else:
+            logger.info("Plan done in %.1f s", result.duration)
+
+        return result
+
+    def input_hashes(self, tasks: List[PlanTask]) -> Dict[str, str]:
+        """Get the hash of the input of every step
+
+        The input of a step is its type, its keys, the local files it
+        reads and the inputs of the steps it needs.
+        """
+
+        hashes: Dict[str, str] = {}
+        remaining = list(tasks)
+
+        while remaining:
+            for task in list(remaining):
+                if not set(task.needs) <= set(hashes):
+                    continue
+                remaining.remove(task)
+                values = [self.distro.pm, task.step_type]
+                values.append(json.dumps(task.params, sort_keys=True, default=str))
+                for path in _task_files(task):
+                    values += [path, _path_digest(path)]
+                values += [hashes[need] for need in sorted(task.needs)]
+                hashes[task.name] = step_hash(*values)
+
+        return hashes
+
+    def _is_done(
+        self, task: PlanTask, hashes: Dict[str, str], host_id: str, fingerprint: str
+    ) -> bool:
+        """True if the step was done with the same input by a previous run"""
+
+        max_age = 0.0
+
+        if self.journal is None:
+            return False
+
+        if task.step_type == "update":
+            # the update is done again when the package metadata is old
+            if self.distro.metadata_max_age <= 0:
+                return False
+            max_age = self.distro.metadata_max_age
+
+        return self.journal.is_done(
+            host_id, fingerprint, task.name, hashes[task.name], max_age
+        )
+
+    def run_task(self, task: PlanTask, step_result: StepResult) -> None:
+        """Run one step and keep its exit status, 1 if it failed"""
+
+        start = time.monotonic()
+        logger.info("Step %s", task.name)
+
+        try:
+            step_result.error = self._run_step(task)
+
+        # A broken step must not stop the rest of the plan
+        except Exception as e:
+            step_result.error = "Error: " + str(e)
+            logger.exception("%s: %s", task.name, step_result.error)
+
+        step_result.exit_status = 1 if step_result.error else 0
+        step_result.duration = time.monotonic() - start
+
+    def _run_step(self, task: PlanTask) -> str:
+        """Run one step, returns its error message"""
+
+        distro = self.distro
+        params = task.params
+
+        def step_output(stream: str, line: str) -> None:
+            if self.on_output is not None:
+                self.on_output(stream, f"{task.name}: {line}")
+
+        if task.step_type == "proxy":
+            return self._setup_proxy()
+
+        if task.step_type in PKG_MANAGER_STEPS:
+            with self._pkg_lock:
+                if task.step_type == "update":
+                    return distro.update(step_output)
+
+                packages = params.get("packages", "")
+                if isinstance(packages, list):
+                    packages = " ".join(packages)
+                return distro.install(
+                    packages,
+                    os.path.expanduser(params.get("pkg_list", "")),
+                    step_output,
+                )
+
+        if task.step_type == "users":
+            users = [
+                NewUser(
+                    entry["user"],
+                    str(entry.get("password", "")),
+                    os.path.expanduser(entry.get("ssh_key", "")),
+                    os.path.expanduser(entry.get("github_token", "")),
+                )
+                for entry in params.get("users") or []
+            ]
+            return self._create_users(users)
+
+        if task.step_type == "ssh_keys":
+            ssh_key_paths = [
+                os.path.expanduser(ssh_key_path)
+                for ssh_key_path in params.get("ssh_keys") or []
+            ]
+            return distro.copy_ssh_keys(ssh_key_paths, params.get("user", "current"))
+
+        if task.step_type == "repos":
+            return self._clone_repos(params, step_output)
+
+        tarballs = [tarball_from_entry(entry) for entry in params.get("tarballs") or []]
+        return distro.install_tarballs(
+            tarballs, step_output, bool(params.get("cache", True))
+        )[1]
+
+    def _setup_proxy(self) -> str:
+        """Set the proxy of the environment variables on the host"""
+
+        distro = self.distro
+        script = distro.proxy_script(distro.pm)
+
+        if not script or distro.ssh_conn is None:
+            return ""
+
+        # the proxy URL can have a password, it is not given as argument
+        cmd_result = distro.ssh_conn.exec(distro.sudo + " sh -s", stdin=script)
+
+        if cmd_result.error:
+            return cmd_result.error
+        if cmd_result.exit_status:
+            return cmd_result.stderr.strip() or "Can not set the proxy"
+
+        return ""
+
+    def _create_users(self, users: List[NewUser]) -> str:
+        """Create the users with the script of the compiled plans
+
+        The users that exist are not changed, so the step can run again.
+        """
+
+        distro = self.distro
+
+        if distro.ssh_conn is None:
+            return "No connection configured"
+
+        if distro.uid != "0" and not distro.sudo:
+            return "User is not allowed to update the system"
+
+        script, error_msg = PlanCompiler(distro).users_script(users)
+        if error_msg:
+            return error_msg
+
+        # the passwords and tokens are not given as arguments
+        cmd_result = distro.ssh_conn.exec(
+            (distro.sudo + " sh -s").strip(), stdin=script
+        )
+
+        if cmd_result.error:
+            return cmd_result.error
+        if cmd_result.exit_status:
+            return cmd_result.stderr.strip() or "Can not create the users"
+
+        return ""
+
+    def _clone_repos(self, params: dict, on_output: OutputCallback) -> str:
+        """Clone the repos of a step, git is installed if it is not found"""
+
+        distro = self.distro
+        repos = [repo_from_entry(entry) for entry in params.get("repos") or []]
+
+        if distro.ssh_conn is None:
+            return "No connection configured"
+
+        # git is installed here, so it does not run the package manager
+        # at the same time as the update or the packages steps
+        if repos and not distro.ssh_conn.exec("command -v git").ok:
+            with self._pkg_lock:
+                return_message = distro.install("git", on_output=on_output)
+            if return_message:
+                return return_message
+
+        return distro.clone_repos(
+            repos,
+            int(params.get("jobs", DEFAULT_CLONE_JOBS)),
+            int(params.get("depth", 0)),
+            params.get("filter", ""),
+        )[1]
+
+
+def _task_files(task: PlanTask) -> List[str]:
+    """Get the local files read by a step of a plan file"""
+
+    params = task.params
+    paths: List[str] = []
+
+    if task.step_type == "packages" and params.get("pkg_list"):
+        paths.append(params["pkg_list"])
+    elif task.step_type == "users":
+        for entry in params.get("users") or []:
+            paths += [entry.get("ssh_key", ""), entry.get("github_token", "")]
+    elif task.step_type == "ssh_keys":
+        paths += params.get("ssh_keys") or []
+    elif task.step_type == "tarballs":
+        for entry in params.get("tarballs") or []:
+            tarball = tarball_from_entry(entry)
+            if not tarball.is_url():
+                paths.append(tarball.source)
+
+    return [os.path.expanduser(path) for path in paths if path]
+
+
+def _path_digest(path: str) -> str:
+    """Get the hash of a local file or directory, empty if it is missing"""
+
+    if os.path.isfile(path):
+        return digest_cache.digest(path)
+
+    if not os.path.isdir(path):
+        return ""
+
+    # the files of a directory are not read, only their size and time
+    sha256 = hashlib.sha256()
+
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            file_path = os.path.join(dir_path, file_name)
+            file_stat = os.lstat(file_path)
+            stamp = f"{os.path.relpath(file_path, path)} {file_stat.st_size} "
+            stamp += f"{file_stat.st_mtime_ns}\n"
+            sha256.update(stamp.encode("utf-8"))
+
+    return sha256.hexdigest()
+
+
+def summary(result: PlanResult) -> str:
+    """Get a text summary of the plan result"""
+
+    lines = []
+
+    for step_result in result.steps:
+        line = f"{step_result.name}: "
+        if step_result.skipped:
+            line += "done by a previous run"
+        elif step_result.exit_status < 0:
+            line += "not run"
+        elif step_result.ok:
+            line += f"done in {step_result.duration:.1f} s"
+        elif step_result.error:
+            line += "failed: " + step_result.error
+        else:
+            line += f"failed with exit status {step_result.exit_status}"
+        lines.append(line)
+
+    if result.ok:
+        lines.append(f"Plan done in {result.duration:.1f} s")
+    else:
+        lines.append("Plan failed: " + result.error)
+
+    return "\n".join(lines)
@@ -0,0 +1,335 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal git repositories functions
+
+Clone git repositories on the remote host, several at the same time.
+Every clone runs on its own channel of the SSH connection.
+
+The repo list file is a text file with one "URL path" per line, or a
+YAML list where every repo can set its own clone options::
+
+    - url: https://github.com/miguelinux/kaajal.git
+      path: src/kaajal
+      branch: main
+      depth: 1
+      filter: blob:none
+"""
+
+import logging
+import os
+import shlex
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import yaml
+
+from kaajal.connection import SSHConnection
+
+logger = logging.getLogger(__name__)
+
+# Repos cloned at the same time
+DEFAULT_CLONE_JOBS = 4
+
+# Printed by the clone command when the repo is already there
+EXISTS_MARKER = "__kaajal_repo_exists"
+
+# Called with the repo and a progress message
+ProgressCallback = Callable[["Repo", str], None]
+
+
+class Repo:
+    """Git repository to clone"""
+
+    def __init__(
+        self,
+        url: str,
+        path: str = "",
+        branch: str = "",
+        depth: int = 0,
+        filter_spec: str = "",
+    ) -> None:
+        """Class constructor of Repo
+
+        If path is empty, the repo is cloned in the directory named after
+        the URL. A relative path is relative to the home of the user.
+        depth > 0 makes a shallow clone, filter_spec a partial clone.
+        """
+
+        self.url = url
+        self.path = path
+        self.branch = branch
+        self.depth = depth
+        self.filter_spec = filter_spec
+
+    def get_path(self) -> str:
+        """Get the path where the repo is cloned"""
+
+        path = self.path
+
+        if not path:
+            path = self.url.rstrip("/").rsplit("/", 1)[-1].rsplit(":", 1)[-1]
+            if path.endswith(".git"):
+                path = path[:-4]
+
+        # the commands run in the home of the user
+        if path == "~":
+            return "."
+        if path.startswith("~/"):
+            return path[2:]
+
+        return path
+
+    def __repr__(self) -> str:
+        return f"Repo({self.url!r}, {self.get_path()!r})"
+
+
+class RepoResult:
+    """Result of the clone of one repo"""
+
+    def __init__(self, repo: Repo) -> None:
+        """Class constructor of Repo Result"""
+
+        self.repo = repo
+        # cloned, exists or failed
+        self.status = ""
+        self.error = ""
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if the repo is on the host"""
+
+        return not self.error
+
+
+def load_repo_list(path: str) -> Tuple[List[Repo], str]:
+    """Load the repos from a repo list file
+
+    Returns the list of repos and an error message.
+    """
+
+    repos: List[Repo] = []
+
+    if not os.path.exists(path):
+        return_message = path + ": not found"
+        logger.warning(return_message)
+        return repos, return_message
+
+    try:
+        with open(path, encoding="utf-8") as repo_list_file:
+            if path.endswith(".yaml") or path.endswith(".yml"):
+                for entry in yaml.safe_load(repo_list_file) or []:
+                    repos.append(repo_from_entry(entry))
+            else:
+                for line in repo_list_file:
+                    if not line or not line.strip():
+                        continue
+                    if line.strip()[0] == "#":
+                        continue
+
+                    repos.append(_repo_from_line(line))
+
+    except yaml.YAMLError as e:
+        return_message = "YAML Error: " + str(e)
+        logger.exception(return_message)
+        return repos, return_message
+    except (KeyError, TypeError, ValueError) as e:
+        return_message = f"{path}: wrong repo entry: {str(e)}"
+        logger.exception(return_message)
+        return repos, return_message
+    except OSError as e:
+        return_message = "OS Error: " + str(e)
+        logger.exception(return_message)
+        return repos, return_message
+
+    return repos, ""
+
+
+def repo_from_entry(entry) -> Repo:
+    """Get the repo of a YAML entry, a "URL [path]" string or a mapping
+
+    Raises KeyError, TypeError or ValueError if the entry is wrong.
+    """
+
+    if isinstance(entry, str):
+        return _repo_from_line(entry)
+
+    return Repo(
+        entry["url"],
+        entry.get("path", ""),
+        entry.get("branch", ""),
+        int(entry.get("depth", 0)),
+        entry.get("filter", ""),
+    )
+
+
+def parse_repo_items(items: List[str]) -> List[Repo]:
+    """Get the repos from "URL path" items, like the ones of the Repos tab"""
+
+    return [_repo_from_line(item) for item in items if item.strip()]
+
+
+def _repo_from_line(line: str) -> Repo:
+    """Get the repo of a "URL [path]" line"""
+
+    values = line.strip().split(None, 1)
+
+    return Repo(values[0], values[1] if len(values) > 1 else "")
+
+
+class RepoCloner:
+    """Clone git repositories on the host of a SSH connection"""
+
+    def __init__(
+        self,
+        ssh_conn: SSHConnection,
+        jobs: int = DEFAULT_CLONE_JOBS,
+        depth: int = 0,
+        filter_spec: str = "",
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        """Class constructor of Repo Cloner
+
+        depth and filter_spec are used by the repos that do not set them.
+        on_progress is called from the worker threads.
+        """
+
+        self.ssh_conn = ssh_conn
+        self.jobs = max(1, jobs)
+        self.depth = depth
+        self.filter_spec = filter_spec
+        self.on_progress = on_progress
+        self._lock = threading.Lock()
+
+    def clone_cmd(self, repo: Repo) -> str:
+        """Get the command that clones the repo if it is not there"""
+
+        path = shlex.quote(repo.get_path())
+        depth = repo.depth or self.depth
+        filter_spec = repo.filter_spec or self.filter_spec
+
+        # git must fail instead of asking for credentials or host keys
+        cmd = "GIT_TERMINAL_PROMPT=0 GIT_SSH_COMMAND='ssh -o BatchMode=yes' "
+        cmd += "git clone --progress"
+        if depth > 0:
+            cmd += f" --depth {depth}"
+        if filter_spec:
+            cmd += " --filter=" + shlex.quote(filter_spec)
+        if repo.branch:
+            cmd += " --branch " + shlex.quote(repo.branch)
+            if depth > 0:
+                cmd += " --single-branch"
+        cmd += " -- " + shlex.quote(repo.url) + " " + path
+
+        return f"if [ -d {path}/.git ]; then echo {EXISTS_MARKER}; else {cmd}; fi"
+
+    def clone(self, repo: Repo) -> RepoResult:
+        """Clone one repo"""
+
+        self._progress(repo, "cloning")
+
+        result = self._run_clone(repo, self.clone_cmd(repo))
+        self._end_clone(result)
+
+        return result
+
+    def _run_clone(self, repo: Repo, cmd: str) -> RepoResult:
+        """Run a clone command and get its result"""
+
+        result = RepoResult(repo)
+
+        def show_progress(stream: str, line: str) -> None:
+            # every update of a progress line of git is a line of output
+            message = line.strip()
+            if message and message != EXISTS_MARKER:
+                self._progress(repo, message)
+
+        cmd_result = self.ssh_conn.exec(cmd, on_output=show_progress)
+        result.duration = cmd_result.duration
+
+        if cmd_result.error:
+            result.status = "failed"
+            result.error = cmd_result.error
+        elif cmd_result.exit_status:
+            result.status = "failed"
+            lines = [
+                line.rsplit("\r", 1)[-1].strip()
+                for line in cmd_result.stderr.strip().split("\n")
+            ]
+            # the first fatal line says why git failed
+            fatal = [line for line in lines if line.startswith("fatal:")]
+            result.error = fatal[0] if fatal else lines[-1]
+            result.error = result.error or "git clone failed"
+        elif EXISTS_MARKER in cmd_result.stdout:
+            result.status = "exists"
+        else:
+            result.status = "cloned"
+
+        return result
+
+    def _end_clone(self, result: RepoResult) -> None:
+        """Log and report the result of a clone"""
+
+        if result.error:
+            logger.warning("%s: %s", result.repo.url, result.error)
+        else:
+            logger.info(
+                "%s: %s in %.1f s", result.repo.url, result.status, result.duration
+            )
+
+        self._progress(result.repo, result.status)
+
+    def clone_all(self, repos: List[Repo]) -> List[RepoResult]:
+        """Clone the repos, at most jobs repos at the same time
+
+        The results are returned in the order of the repos.
+        """
+
+        if not repos:
+            return []
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.jobs, len(repos)), thread_name_prefix="kaajal-repo"
+        ) as executor:
+            return list(executor.map(self.clone, repos))
+
+    def _progress(self, repo: Repo, message: str) -> None:
+        """Report the progress of a repo"""
+
+        if self.on_progress is None:
+            return
+
+        # the callback is not called from two threads at the same time
+        with self._lock:
+            try:
+                self.on_progress(repo, message)
+            except Exception:
+                logger.exception("Error in progress callback")
+
+
+def summary(results: List[RepoResult]) -> str:
+    """Get a text summary of the clone results"""
+
+    lines = []
+
+    for result in results:
+        line = f"{result.repo.url} -> {result.repo.get_path()}: "
+        if result.ok:
+            line += f"{result.status} in {result.duration:.1f} s"
+        else:
+            line += "failed: " + result.error
+        lines.append(line)
+
+    failed = [result for result in results if not result.ok]
+    lines.append(f"{len(results) - len(failed)} of {len(results)} repos cloned")
+
+    return "\n".join(lines)
@@ -0,0 +1,594 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal remote helper functions
+
+A small python helper runs on the remote host for the whole session, on
+one channel of the connection. The commands and the file operations are
+sent to it as JSON lines requests, so they do not open a channel and
+start a shell each. The requests do not wait for the previous replies,
+and the helper runs every request in its own thread.
+
+Request:  {"id": 1, "method": "run", "params": {"command": "uname -r"}}
+Reply:    {"id": 1, "result": {"stdout": "6.1.0\\n", ...}}
+Output:   {"id": 1, "output": ["stdout", "a line"]}
+"""
+
+import base64
+import itertools
+import json
+import logging
+import shlex
+import threading
+import time
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import paramiko
+
+from kaajal.connection import OUTPUT_TAIL_LINES
+from kaajal.connection import CommandResult
+from kaajal.connection import ConnectionPool
+from kaajal.connection import OutputCallback
+from kaajal.connection import SSHConnection
+from kaajal.connection import StdinData
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the helper to start
+HELPER_START_TIMEOUT = 15.0
+
+REMOTE_HELPER = r"""
+import base64, collections, json, os, re, subprocess, sys, threading
+
+write_lock = threading.Lock()
+
+
+def send(message):
+    data = json.dumps(message) + "\n"
+    with write_lock:
+        sys.stdout.write(data)
+        sys.stdout.flush()
+
+
+def read_lines(pipe, split_cr):
+    # with split_cr, a carriage return ends a line too, like progress lines
+    if not split_cr:
+        for line in iter(pipe.readline, b""):
+            yield line.rstrip(b"\n")
+        return
+    partial = b""
+    for data in iter(lambda: pipe.read1(65536), b""):
+        data = partial + data
+        end = len(data) - 1 if data.endswith(b"\r") else len(data)
+        lines = re.split(b"\r\n|\r|\n", data[:end])
+        partial = lines.pop() + data[end:]
+        for line in lines:
+            yield line
+    if partial:
+        yield partial.rstrip(b"\r")
+
+
+def run(request_id, params):
+    stdin = params.get("stdin")
+    env = dict(os.environ, **(params.get("environment") or {}))
+    process = subprocess.Popen(
+        params["command"],
+        shell=True,
+        stdin=subprocess.DEVNULL if stdin is None else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+    )
+    tail = params.get("tail")
+    output = {}
+
+    def read(name, pipe):
+        lines = collections.deque(maxlen=tail) if tail else []
+        for line in read_lines(pipe, params.get("output")):
+            line = line.decode("utf-8", "replace")
+            lines.append(line)
+            if params.get("output"):
+                send({"id": request_id, "output": [name, line.rstrip("\r")]})
+        output[name] = "\n".join(lines) + ("\n" if lines else "")
+
+    readers = [
+        threading.Thread(target=read, args=(name, pipe))
+        for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr))
+    ]
+    for reader in readers:
+        reader.start()
+
+    if stdin is not None:
+        try:
+            process.stdin.write(base64.b64decode(stdin))
+            process.stdin.close()
+        except OSError:
+            pass
+
+    try:
+        exit_status = process.wait(params.get("timeout"))
+    except subprocess.TimeoutExpired:
+        process.kill()
+        exit_status = process.wait()
+        timeout = True
+    else:
+        timeout = False
+
+    for reader in readers:
+        reader.join()
+
+    return {
+        "stdout": output["stdout"],
+        "stderr": output["stderr"],
+        "exit_status": exit_status,
+        "timeout": timeout,
+    }
+
+
+def stat(request_id, params):
+    try:
+        return 2 if os.stat(params["path"]).st_size == 0 else 1
+    except OSError:
+        return 0
+
+
+def read(request_id, params):
+    try:
+        with open(params["path"], "rb") as f:
+            return f.read().decode("utf-8")
+    except FileNotFoundError:
+        return ""
+
+
+def set_owner(path, params):
+    if params.get("owner"):
+        os.chown(path, params["owner"][0], params["owner"][1])
+
+
+def write(request_id, params):
+    path = params["path"]
+    tmp_path = path + ".kaajal-tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, params["mode"])
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(params["content"].encode("utf-8"))
+        os.chmod(tmp_path, params["mode"])
+        set_owner(tmp_path, params)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return ""
+
+
+def makedirs(request_id, params):
+    path = params["path"]
+    current = "/" if path.startswith("/") else ""
+    for part in path.strip("/").split("/"):
+        current = os.path.join(current, part) if current else part
+        if not os.path.exists(current):
+            os.mkdir(current, params["mode"])
+            os.chmod(current, params["mode"])
+            set_owner(current, params)
+    return ""
+
+
+def home(request_id, params):
+    return os.path.expanduser("~")
+
+
+def packages(request_id, params):
+    process = subprocess.run(
+        params["command"],
+        shell=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if process.returncode:
+        raise OSError(
+            "%s failed with exit status %d" % (params["command"], process.returncode)
+        )
+    return process.stdout.decode("utf-8", "replace")
+
+
+METHODS = {
+    "run": run,
+    "stat": stat,
+    "read": read,
+    "write": write,
+    "makedirs": makedirs,
+    "home": home,
+    "packages": packages,
+}
+
+
+def handle(request):
+    try:
+        result = METHODS[request["method"]](request["id"], request.get("params", {}))
+    except Exception as e:
+        send({"id": request["id"], "error": "%s: %s" % (type(e).__name__, e)})
+    else:
+        send({"id": request["id"], "result": result})
+
+
+for request_line in iter(sys.stdin.readline, ""):
+    thread = threading.Thread(target=handle, args=(json.loads(request_line),))
+    thread.daemon = True
+    thread.start()
+"""
+
+
+class HelperCall:
+    """Request sent to the remote helper, waiting for its reply"""
+
+    def __init__(self, on_output: Optional[OutputCallback] = None) -> None:
+        """Class constructor of Helper Call"""
+
+        self.on_output = on_output
+        self.result: Any = None
+        self.error = ""
+        self._done = threading.Event()
+
+    def set_reply(self, result: Any, error: str) -> None:
+        """Set the reply of the helper"""
+
+        self.result = result
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> Tuple[Any, str]:
+        """Wait for the reply
+
+        Returns the result and an error message.
+        """
+
+        if not self._done.wait(timeout):
+            return None, "No reply from the remote helper"
+
+        return self.result, self.error
+
+
+class RemoteHelper:
+    """Remote helper running on the host of a SSH connection"""
+
+    def __init__(self, ssh_conn: SSHConnection) -> None:
+        """Class constructor of Remote Helper"""
+
+        self.ssh_conn = ssh_conn
+        self.channel: Optional[paramiko.Channel] = None
+        self._ids = itertools.count(1)
+        self._calls: Dict[int, HelperCall] = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._reader: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        """True if the helper can take requests"""
+
+        return self.channel is not None and not self.channel.closed
+
+    def start(self) -> str:
+        """Start the helper on its own channel
+
+        Returns an error message.
+        """
+
+        transport = self.ssh_conn.client.get_transport()
+
+        if transport is None or not transport.is_active():
+            return "SSH transport is not active"
+
+        try:
+            self.channel = transport.open_session()
+            self.channel.exec_command(  # nosec B601
+                "python3 -u -c " + shlex.quote(REMOTE_HELPER)
+            )
+        except paramiko.SSHException as e:
+            return_message = "Can not start the remote helper: " + str(e)
+            logger.warning(return_message)
+            return return_message
+
+        self._reader = threading.Thread(
+            target=self._read_replies, name="kaajal-helper", daemon=True
+        )
+        self._reader.start()
+
+        home, error_msg = self.call("home", timeout=HELPER_START_TIMEOUT)
+
+        if error_msg:
+            self.close()
+            return_message = "Remote helper not started: " + error_msg
+            logger.info(return_message)
+            return return_message
+
+        self.ssh_conn.home = self.ssh_conn.home or home
+        logger.info("Remote helper started on %s", self.ssh_conn.hostname)
+
+        return ""
+
+    def close(self) -> None:
+        """Stop the helper, closing its input"""
+
+        if self.channel is not None:
+            try:
+                self.channel.shutdown_write()
+            except (OSError, paramiko.SSHException):
+                pass
+            self.channel.close()
+
+        if self._reader is not None:
+            self._reader.join(1.0)
+
+        self._end_calls("Remote helper closed")
+
+    def submit(
+        self,
+        method: str,
+        params: Optional[dict] = None,
+        on_output: Optional[OutputCallback] = None,
+    ) -> HelperCall:
+        """Send a request without waiting for its reply"""
+
+        call = HelperCall(on_output)
+
+        if self.channel is None:
+            call.set_reply(None, "Remote helper not started")
+            return call
+
+        request_id = next(self._ids)
+        with self._lock:
+            self._calls[request_id] = call
+
+        request = {"id": request_id, "method": method, "params": params or {}}
+
+        try:
+            with self._send_lock:
+                self.channel.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        except (OSError, paramiko.SSHException) as e:
+            with self._lock:
+                self._calls.pop(request_id, None)
+            call.set_reply(None, "Can not send to the remote helper: " + str(e))
+
+        return call
+
+    def call(
+        self,
+        method: str,
+        params: Optional[dict] = None,
+        on_output: Optional[OutputCallback] = None,
+        timeout: Optional[float] = None,
+    ) -> Tuple[Any, str]:
+        """Send a request and wait for its reply
+
+        Returns the result and an error message.
+        """
+
+        return self.submit(method, params, on_output).wait(timeout)
+
+    def _read_replies(self) -> None:
+        """Give the replies of the helper to their calls"""
+
+        if self.channel is None:
+            return
+
+        with self.channel.makefile("rb") as replies:
+            for line in replies:
+                try:
+                    reply = json.loads(line)
+                except ValueError:
+                    logger.debug("Wrong remote helper reply: %r", line)
+                    continue
+
+                with self._lock:
+                    call = self._calls.get(reply.get("id"))
+
+                if call is None:
+                    continue
+
+                if "output" in reply:
+                    if call.on_output is not None:
+                        try:
+                            call.on_output(*reply["output"])
+                        except Exception:
+                            logger.exception("Error in output callback")
+                    continue
+
+                with self._lock:
+                    self._calls.pop(reply["id"], None)
+                call.set_reply(reply.get("result"), reply.get("error", ""))
+
+        self._end_calls("Remote helper ended")
+
+    def _end_calls(self, error: str) -> None:
+        """Fail the calls that are waiting for a reply"""
+
+        with self._lock:
+            calls = list(self._calls.values())
+            self._calls.clear()
+
+        for call in calls:
+            call.set_reply(None, error)
+
+
+class HelperConnection(SSHConnection):
+    """SSH connection that runs its operations in the remote helper
+
+    If the helper can not run on the host, the operations use their own
+    channel as in SSHConnection.
+    """
+
+    def __init__(self, pool: Optional[ConnectionPool] = None) -> None:
+        """Class constructor of Helper Connection"""
+
+        super().__init__(pool)
+        self.helper: Optional[RemoteHelper] = None
+
+    def _connect(self, **conn_args) -> str:
+        """SSH Connect using parameters and start the remote helper"""
+
+        return_message = super()._connect(**conn_args)
+
+        if not return_message:
+            helper = RemoteHelper(self)
+            if not helper.start():
+                self.helper = helper
+
+        return return_message
+
+    def close(self) -> None:
+        """Stop the remote helper and close SSH connection"""
+
+        if self.helper is not None:
+            self.helper.close()
+            self.helper = None
+
+        super().close()
+
+    def _helper_call(self, method: str, **params) -> Tuple[Any, str]:
+        """Run a method in the helper"""
+
+        if self.helper is None:
+            return None, "Remote helper not started"
+
+        return self.helper.call(method, params)
+
+    def exec(
+        self,
+        command,
+        bufsize=-1,
+        timeout=None,
+        get_pty=False,
+        environment=None,
+        on_output: Optional[OutputCallback] = None,
+        stdin: Optional[StdinData] = None,
+    ) -> CommandResult:
+        """Execute a command on the SSH server through the remote helper
+
+        Commands with a pty or with a file as input get their own channel.
+        """
+
+        if (
+            self.helper is None
+            or not self.helper.is_running
+            or get_pty
+            or not command
+            or not (stdin is None or isinstance(stdin, (str, bytes)))
+        ):
+            return super().exec(
+                command, bufsize, timeout, get_pty, environment, on_output, stdin
+            )
+
+        result = CommandResult(command)
+        start = time.monotonic()
+
+        params: Dict[str, Any] = {
+            "command": command,
+            "timeout": timeout,
+            "environment": environment,
+            "output": on_output is not None,
+            "tail": OUTPUT_TAIL_LINES if on_output is not None else 0,
+        }
+        if isinstance(stdin, str):
+            stdin = stdin.encode("utf-8")
+        if stdin is not None:
+            params["stdin"] = base64.b64encode(stdin).decode("ascii")
+
+        value, result.error = self.helper.call("run", params, on_output)
+        result.duration = time.monotonic() - start
+
+        if value is not None:
+            result.stdout = value["stdout"]
+            result.stderr = value["stderr"]
+            result.exit_status = value["exit_status"]
+            if value["timeout"]:
+                result.error = f"Timeout: command did not end in {timeout} seconds"
+
+        if result.error:
+            logger.error(result.error)
+
+        logger.debug("%r", result)
+
+        return result
+
+    def stat(self, path: str, show_except: bool = False) -> int:
+        """Check if a file exists"""
+
+        value, error_msg = self._helper_call("stat", path=path)
+
+        if error_msg:
+            return super().stat(path, show_except)
+
+        return value
+
+    def read_file(self, path: str) -> Tuple[str, str]:
+        """Read a text file of the server"""
+
+        value, error_msg = self._helper_call("read", path=path)
+
+        if error_msg:
+            return super().read_file(path)
+
+        return value, ""
+
+    def write_file(
+        self,
+        path: str,
+        content: str,
+        mode: int = 0o600,
+        owner: Optional[Tuple[int, int]] = None,
+    ) -> str:
+        """Write a text file of the server"""
+
+        if self.helper is None:
+            return super().write_file(path, content, mode, owner)
+
+        error_msg = self._helper_call(
+            "write", path=path, content=content, mode=mode, owner=owner
+        )[1]
+
+        if error_msg:
+            return_message = f"Can not write {path}: {error_msg}"
+            logger.warning(return_message)
+            return return_message
+
+        return ""
+
+    def makedirs(
+        self, path: str, mode: int = 0o700, owner: Optional[Tuple[int, int]] = None
+    ) -> str:
+        """Create a directory of the server and its parents"""
+
+        if self.helper is None:
+            return super().makedirs(path, mode, owner)
+
+        error_msg = self._helper_call("makedirs", path=path, mode=mode, owner=owner)[1]
+
+        if error_msg:
+            return_message = f"Can not create {path}: {error_msg}"
+            logger.warning(return_message)
+            return return_message
+
+        return ""
+
+    def query_packages(self, command: str) -> Tuple[str, str]:
+        """Run the query of the installed packages in the remote helper"""
+
+        if self.helper is None:
+            return super().query_packages(command)
+
+        value, error_msg = self._helper_call("packages", command=command)
+
+        if error_msg:
+            logger.warning(error_msg)
+            return "", error_msg
+
+        return value, ""
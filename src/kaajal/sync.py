@@ -0,0 +1,524 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal file tree sync functions
+
+Copy a local directory to the remote host sending only the blocks that
+changed, like rsync does, without the need of rsync on any host.
+
+A small python helper runs on the remote host. It gets the checksums of
+the blocks of the remote files, and it applies the deltas read from its
+stdin: every file is rebuilt from the blocks of the old file and the new
+data, written to a temporary file and renamed. If the remote host has no
+python, the changed files are copied whole with SFTP.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+import stat
+import threading
+import time
+from typing import BinaryIO
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import paramiko
+
+from kaajal.connection import OutputCallback
+from kaajal.connection import SSHConnection
+
+logger = logging.getLogger(__name__)
+
+# Size of the blocks compared between the local and the remote files
+SYNC_BLOCK_SIZE = 65536
+
+# Hex digits of the block checksums
+SYNC_SUM_LENGTH = 32
+
+# Exit status of the shell when python is not found
+COMMAND_NOT_FOUND = 127
+
+SYNC_HELPER = r"""
+import hashlib, json, os, stat, sys
+
+action, root = sys.argv[1], sys.argv[2]
+block_size, sum_length = int(sys.argv[3]), int(sys.argv[4])
+stdin = sys.stdin.buffer
+
+
+def block_sums(path):
+    sums = []
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(block_size), b""):
+            sums.append(hashlib.sha256(data).hexdigest()[:sum_length])
+    return sums
+
+
+if action == "sums":
+    entries = {}
+    for name in json.loads(stdin.read().decode("utf-8")):
+        path = os.path.join(root, name)
+        try:
+            st = os.lstat(path)
+            if stat.S_ISLNK(st.st_mode):
+                entries[name] = {"link": os.readlink(path)}
+            elif stat.S_ISDIR(st.st_mode):
+                entries[name] = {"dir": True, "mode": stat.S_IMODE(st.st_mode)}
+            elif stat.S_ISREG(st.st_mode):
+                entries[name] = {
+                    "size": st.st_size,
+                    "mode": stat.S_IMODE(st.st_mode),
+                    "sums": block_sums(path),
+                }
+        except OSError:
+            pass
+    json.dump(entries, sys.stdout)
+    sys.exit(0)
+
+name = "."
+try:
+    os.makedirs(root, exist_ok=True)
+    for line in iter(stdin.readline, b""):
+        entry = json.loads(line.decode("utf-8"))
+        name = entry["path"]
+        path = os.path.join(root, name)
+        if entry.get("dir"):
+            os.makedirs(path, exist_ok=True)
+            os.chmod(path, entry["mode"])
+            continue
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".kaajal-sync"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        if "link" in entry:
+            os.symlink(entry["link"], tmp_path)
+        else:
+            old = None
+            with open(tmp_path, "wb") as new:
+                for op in entry["ops"]:
+                    if op[0] == "c":
+                        if old is None:
+                            old = open(path, "rb")
+                        old.seek(op[1] * block_size)
+                        new.write(old.read(op[2] * block_size))
+                    else:
+                        left = op[1]
+                        while left > 0:
+                            data = stdin.read(min(left, 1048576))
+                            if not data:
+                                raise EOFError("input ended")
+                            new.write(data)
+                            left -= len(data)
+            if old is not None:
+                old.close()
+            os.chmod(tmp_path, entry["mode"])
+        os.replace(tmp_path, path)
+except Exception as e:
+    sys.stderr.write("%s: %s\n" % (name, e))
+    sys.exit(1)
+"""
+
+# [["c", first block, blocks]] copies blocks of the remote file,
+# [["d", offset, length]] sends data of the local file
+DeltaOps = List[list]
+
+
+class SyncResult:
+    """Result of the sync of a file tree"""
+
+    def __init__(self, local_dir: str, remote_dir: str) -> None:
+        """Class constructor of Sync Result"""
+
+        self.local_dir = local_dir
+        self.remote_dir = remote_dir
+        self.new = 0
+        self.updated = 0
+        self.unchanged = 0
+        # bytes of file data sent and bytes of the local files
+        self.sent = 0
+        self.total = 0
+        self.error = ""
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if the remote tree is a copy of the local one"""
+
+        return not self.error
+
+
+class TreeSync:
+    """Sync local directories to the host of a SSH connection"""
+
+    def __init__(
+        self,
+        ssh_conn: SSHConnection,
+        block_size: int = SYNC_BLOCK_SIZE,
+        on_output: Optional[OutputCallback] = None,
+    ) -> None:
+        """Class constructor of Tree Sync"""
+
+        self.ssh_conn = ssh_conn
+        self.block_size = max(1, block_size)
+        self.on_output = on_output
+
+    @staticmethod
+    def remote_path(remote_dir: str) -> str:
+        """Get the remote dir relative to the home of the user"""
+
+        if remote_dir in ("", "~"):
+            return "."
+        if remote_dir.startswith("~/"):
+            return remote_dir[2:]
+
+        return remote_dir
+
+    def helper_cmd(self, action: str, remote_dir: str) -> str:
+        """Get the remote command that runs the helper"""
+
+        return " ".join(
+            [
+                "python3 -c",
+                shlex.quote(SYNC_HELPER),
+                action,
+                shlex.quote(self.remote_path(remote_dir)),
+                str(self.block_size),
+                str(SYNC_SUM_LENGTH),
+            ]
+        )
+
+    def sync(self, local_dir: str, remote_dir: str) -> SyncResult:
+        """Copy the local dir to the remote dir sending only the changes"""
+
+        result = SyncResult(local_dir, remote_dir)
+        start = time.monotonic()
+
+        if not os.path.isdir(local_dir):
+            result.error = local_dir + ": not a directory"
+            logger.warning(result.error)
+            return result
+
+        entries = self._local_entries(local_dir)
+        result.total = sum(
+            entry_stat.st_size
+            for _, entry_stat in entries
+            if stat.S_ISREG(entry_stat.st_mode)
+        )
+
+        cmd_result = self.ssh_conn.exec(
+            self.helper_cmd("sums", remote_dir),
+            stdin=json.dumps([name for name, _ in entries]),
+        )
+
+        if cmd_result.exit_status == COMMAND_NOT_FOUND:
+            logger.info("%s: no python on the host, copying whole files", remote_dir)
+            result.error = self._copy_sftp(local_dir, remote_dir, entries, result)
+        elif cmd_result.error or cmd_result.exit_status:
+            result.error = cmd_result.error or cmd_result.stderr.strip()
+            result.error = result.error or "Can not get the remote checksums"
+        else:
+            try:
+                remote_entries = json.loads(cmd_result.stdout)
+            except ValueError as e:
+                result.error = "Wrong remote checksums: " + str(e)
+            else:
+                result.error = self._send_deltas(
+                    local_dir, remote_dir, entries, remote_entries, result
+                )
+
+        result.duration = time.monotonic() - start
+
+        if result.error:
+            logger.warning("%s: %s", local_dir, result.error)
+        else:
+            logger.info(
+                "%s: %d new, %d updated, %d unchanged files in %.1f s",
+                local_dir,
+                result.new,
+                result.updated,
+                result.unchanged,
+                result.duration,
+            )
+
+        return result
+
+    @staticmethod
+    def _local_entries(local_dir: str) -> List[Tuple[str, os.stat_result]]:
+        """Get the relative name and the stat of the entries of a local dir"""
+
+        entries = []
+
+        for dir_path, dir_names, file_names in os.walk(local_dir):
+            dir_names.sort()
+            for name in dir_names + sorted(file_names):
+                path = os.path.join(dir_path, name)
+                rel_name = os.path.relpath(path, local_dir).replace(os.sep, "/")
+                try:
+                    entries.append((rel_name, os.lstat(path)))
+                except FileNotFoundError:
+                    # removed since the dir was listed
+                    continue
+
+        return entries
+
+    def _delta(self, path: str, remote: Optional[dict]) -> DeltaOps:
+        """Get the operations that rebuild a local file from the remote one"""
+
+        remote_sums: List[str] = []
+        if remote is not None and "sums" in remote:
+            remote_sums = remote["sums"]
+
+        remote_blocks: Dict[str, int] = {}
+        for block_index, block_sum in enumerate(remote_sums):
+            remote_blocks.setdefault(block_sum, block_index)
+
+        ops: DeltaOps = []
+        offset = 0
+
+        with open(path, "rb") as local_file:
+            for data in iter(lambda: local_file.read(self.block_size), b""):
+                block_sum = hashlib.sha256(data).hexdigest()[:SYNC_SUM_LENGTH]
+                index = remote_blocks.get(block_sum)
+
+                # a block repeated in the file is taken from the same place,
+                # so an unchanged file is one copy of all its blocks
+                position = offset // self.block_size
+                if position < len(remote_sums) and remote_sums[position] == block_sum:
+                    index = position
+
+                if index is None:
+                    if ops and ops[-1][0] == "d":
+                        ops[-1][2] += len(data)
+                    else:
+                        ops.append(["d", offset, len(data)])
+                elif ops and ops[-1][0] == "c" and ops[-1][1] + ops[-1][2] == index:
+                    ops[-1][2] += 1
+                else:
+                    ops.append(["c", index, 1])
+
+                offset += len(data)
+
+        return ops
+
+    def _send_deltas(
+        self,
+        local_dir: str,
+        remote_dir: str,
+        entries: List[Tuple[str, os.stat_result]],
+        remote_entries: Dict[str, dict],
+        result: SyncResult,
+    ) -> str:
+        """Send the changed entries to the helper
+
+        Returns an error message.
+        """
+
+        changes: List[Tuple[dict, DeltaOps]] = []
+        # a file that can not be read is not sent, the others are
+        errors: List[str] = []
+
+        for name, entry_stat in entries:
+            path = os.path.join(local_dir, name)
+
+            try:
+                change = self._change(
+                    name, path, entry_stat, remote_entries.get(name), result
+                )
+            except OSError as e:
+                return_message = f"Can not read {path}: {str(e)}"
+                logger.warning(return_message)
+                errors.append(return_message)
+                continue
+
+            if change is not None:
+                changes.append(change)
+
+        if not changes:
+            return "; ".join(errors)
+
+        read_fd, write_fd = os.pipe()
+
+        def write_deltas() -> None:
+            path = local_dir
+            try:
+                with os.fdopen(write_fd, "wb") as pipe_file:
+                    for header, ops in changes:
+                        path = os.path.join(local_dir, header["path"])
+                        pipe_file.write(json.dumps(header).encode("utf-8") + b"\n")
+                        if ops:
+                            result.sent += _write_data(path, ops, pipe_file)
+            except BrokenPipeError as e:
+                # the helper ended before reading all
+                logger.debug("%s: deltas not written: %s", local_dir, str(e))
+            except OSError as e:
+                # the input of the helper ends here, so it fails
+                return_message = f"Can not read {path}: {str(e)}"
+                logger.warning(return_message)
+                errors.insert(0, return_message)
+
+        writer = threading.Thread(target=write_deltas, name="kaajal-sync")
+        writer.start()
+
+        with os.fdopen(read_fd, "rb") as pipe_file:
+            cmd_result = self.ssh_conn.exec(
+                self.helper_cmd("apply", remote_dir),
+                on_output=self.on_output,
+                stdin=pipe_file,
+            )
+
+        writer.join()
+
+        if cmd_result.error:
+            errors.append(cmd_result.error)
+        elif cmd_result.exit_status and not errors:
+            errors.append(cmd_result.stderr.strip() or "Can not apply the deltas")
+
+        return "; ".join(errors)
+
+    def _change(
+        self,
+        name: str,
+        path: str,
+        entry_stat: os.stat_result,
+        remote: Optional[dict],
+        result: SyncResult,
+    ) -> Optional[Tuple[dict, DeltaOps]]:
+        """Get the header and the operations of a changed entry
+
+        Returns None if the entry is not changed or not synced.
+        Raises OSError if the local entry can not be read.
+        """
+
+        header: dict = {"path": name}
+        ops: DeltaOps = []
+
+        if stat.S_ISLNK(entry_stat.st_mode):
+            header["link"] = os.readlink(path)
+            if remote is not None and remote.get("link") == header["link"]:
+                return None
+        elif stat.S_ISDIR(entry_stat.st_mode):
+            header["dir"] = True
+            header["mode"] = stat.S_IMODE(entry_stat.st_mode)
+            if remote is not None and remote.get("mode") == header["mode"]:
+                return None
+        elif stat.S_ISREG(entry_stat.st_mode):
+            header["mode"] = stat.S_IMODE(entry_stat.st_mode)
+            ops = self._delta(path, remote)
+            unchanged = (
+                remote is not None
+                and remote.get("size") == entry_stat.st_size
+                and remote.get("mode") == header["mode"]
+                and all(op[0] == "c" for op in ops)
+                and [op[1:] for op in ops] in ([[0, len(remote["sums"])]], [])
+            )
+            if unchanged:
+                result.unchanged += 1
+                return None
+            if remote is not None and "sums" in remote:
+                result.updated += 1
+            else:
+                result.new += 1
+            header["ops"] = [op if op[0] == "c" else ["d", op[2]] for op in ops]
+        else:
+            logger.debug("%s: not a file, not synced", path)
+            return None
+
+        return header, ops
+
+    def _copy_sftp(
+        self,
+        local_dir: str,
+        remote_dir: str,
+        entries: List[Tuple[str, os.stat_result]],
+        result: SyncResult,
+    ) -> str:
+        """Copy the whole local files with SFTP
+
+        Returns an error message.
+        """
+
+        if self.ssh_conn.sftp is None:
+            return "No SFTP connection"
+
+        root = self.remote_path(remote_dir)
+        if not root.startswith("/"):
+            root = self.ssh_conn.get_home() + "/" + root
+
+        error_msg = self.ssh_conn.makedirs(root, 0o755)
+        if error_msg:
+            return error_msg
+
+        for name, entry_stat in entries:
+            path = os.path.join(local_dir, name)
+            remote_path = root.rstrip("/") + "/" + name
+            mode = stat.S_IMODE(entry_stat.st_mode)
+
+            try:
+                if stat.S_ISLNK(entry_stat.st_mode):
+                    if self.ssh_conn.stat(remote_path):
+                        self.ssh_conn.sftp.remove(remote_path)
+                    self.ssh_conn.sftp.symlink(os.readlink(path), remote_path)
+                elif stat.S_ISDIR(entry_stat.st_mode):
+                    error_msg = self.ssh_conn.makedirs(remote_path, mode)
+                    if error_msg:
+                        return error_msg
+                elif stat.S_ISREG(entry_stat.st_mode):
+                    self.ssh_conn.sftp.put(path, remote_path)
+                    self.ssh_conn.sftp.chmod(remote_path, mode)
+                    result.new += 1
+                    result.sent += entry_stat.st_size
+            except (OSError, paramiko.SSHException) as e:
+                return_message = f"Can not copy {path}: {str(e)}"
+                logger.warning(return_message)
+                return return_message
+
+        return ""
+
+
+def _write_data(path: str, ops: DeltaOps, pipe_file: BinaryIO) -> int:
+    """Write the data of the "d" operations of a file
+
+    Returns the bytes written.
+    """
+
+    sent = 0
+
+    with open(path, "rb") as local_file:
+        for op in ops:
+            if op[0] != "d":
+                continue
+            local_file.seek(op[1])
+            left = op[2]
+            while left > 0:
+                data = local_file.read(min(left, 1048576))
+                if not data:
+                    raise OSError("changed while it was sent")
+                pipe_file.write(data)
+                left -= len(data)
+                sent += len(data)
+
+    return sent
+
+
+def summary(result: SyncResult) -> str:
+    """Get a text summary of the sync result"""
+
+    line = f"{result.local_dir} -> {result.remote_dir}: "
+
+    if not result.ok:
+        return line + "failed: " + result.error
+
+    line += f"{result.new} new, {result.updated} updated, "
+    line += f"{result.unchanged} unchanged files in {result.duration:.1f} s, "
+    line += f"{result.sent} of {result.total} bytes sent"
+
+    return line
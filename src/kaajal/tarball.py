@@ -0,0 +1,645 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal tarball functions
+
+Install tarballs on the remote host by streaming them into "tar -x" on
+the channel of the command, so no copy of the tarball is saved on the
+local or the remote host.
+
+The source of a tarball is a local archive, a local directory, which is
+archived while it is sent, or a http(s) URL downloaded by the remote
+host. The tarball list file is a text file with one "source path" per
+line, or a YAML list::
+
+    - source: ~/Downloads/sdk-1.2.tar.zst
+      path: /opt/sdk
+
+The local archives are kept in a remote cache keyed by their sha256, so
+an archive is sent once, and it is not extracted again in a path that
+already has it.
+"""
+
+import gzip
+import hashlib
+import logging
+import lzma
+import os
+import shlex
+import tarfile
+import threading
+import time
+from typing import BinaryIO
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import cast
+
+import yaml
+
+from kaajal.config import JsonCache
+from kaajal.connection import CommandResult
+from kaajal.connection import OutputCallback
+from kaajal.connection import SSHConnection
+
+logger = logging.getLogger(__name__)
+
+# Remote command to decompress every compression type
+DECOMPRESS_CMDS = {
+    "": "cat",
+    "gz": "gzip -dc",
+    "bz2": "bzip2 -dc",
+    "xz": "xz -dc",
+    "zst": "zstd -dc",
+}
+
+# First bytes of the compressed files
+MAGIC_NUMBERS = {
+    b"\x1f\x8b": "gz",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "xz",
+    b"\x28\xb5\x2f\xfd": "zst",
+}
+
+# File extensions of the compressed files
+EXTENSIONS = {
+    ".tgz": "gz",
+    ".gz": "gz",
+    ".tbz2": "bz2",
+    ".bz2": "bz2",
+    ".txz": "xz",
+    ".xz": "xz",
+    ".tzst": "zst",
+    ".zst": "zst",
+}
+
+# Compression of the archives of local directories
+DIR_COMPRESSION = ""
+
+# Compressions of the archives of local directories, see _open_compressor
+DIR_COMPRESSIONS = ["", "gz", "xz"]
+
+# Dir of the artifact cache on the remote hosts, relative to the home
+REMOTE_ARTIFACT_DIR = ".cache/kaajal/artifacts"
+
+# File with the sha256 of the archives extracted in a path
+ARTIFACTS_RECORD = ".kaajal-artifacts"
+
+DIGEST_CACHE_NAME = "digests.json"
+
+# Size of the reads to hash a file
+HASH_READ_SIZE = 1048576
+
+# States of an archive in the remote artifact cache
+MISSING = "missing"
+CACHED = "cached"
+EXTRACTED = "extracted"
+
+
+class Tarball:
+    """Tarball to install"""
+
+    def __init__(self, source: str, path: str = "", compression: str = "") -> None:
+        """Class constructor of Tarball
+
+        path is the directory where the tarball is extracted, relative to
+        the home of the user if it is not absolute. compression is only
+        used to archive a local directory, "", "gz" or "xz".
+        """
+
+        self.source = source
+        self.path = path
+        self.compression = compression
+
+    def is_url(self) -> bool:
+        """True if the remote host downloads the tarball"""
+
+        return self.source.startswith(("http://", "https://"))
+
+    def get_source(self) -> str:
+        """Get the source with the user home expanded"""
+
+        if self.is_url():
+            return self.source
+
+        return os.path.expanduser(self.source)
+
+    def get_path(self) -> str:
+        """Get the directory where the tarball is extracted"""
+
+        path = self.path or "."
+
+        # the commands run in the home of the user
+        if path == "~":
+            return "."
+        if path.startswith("~/"):
+            return path[2:]
+
+        return path
+
+    def __repr__(self) -> str:
+        return f"Tarball({self.source!r}, {self.get_path()!r})"
+
+
+class TarballResult:
+    """Result of the install of one tarball"""
+
+    def __init__(self, tarball: Tarball) -> None:
+        """Class constructor of Tarball Result"""
+
+        self.tarball = tarball
+        # extracted, from cache or up to date
+        self.status = ""
+        self.error = ""
+        # bytes sent to the remote host
+        self.size = 0
+        self.duration = 0.0
+
+    @property
+    def ok(self) -> bool:
+        """True if the tarball was extracted"""
+
+        return not self.error
+
+
+class DigestCache(JsonCache):
+    """Local cache of the sha256 of the archives
+
+    The digest of a file is computed again only if its size or its
+    modification time changed.
+    """
+
+    file_name = DIGEST_CACHE_NAME
+    description = "digest cache"
+
+    def __init__(self, path: str = "") -> None:
+        """Class constructor of Digest Cache
+
+        If path is not given, the file is saved in the user config dir.
+        """
+
+        super().__init__(path)
+        self._entries: Optional[Dict[str, dict]] = None
+
+    def digest(self, file_path: str) -> str:
+        """Get the sha256 of a local file"""
+
+        file_path = os.path.abspath(file_path)
+        file_stat = os.stat(file_path)
+        stamp = [file_stat.st_size, file_stat.st_mtime_ns]
+
+        with self._lock:
+            entry = self._load().get(file_path)
+
+        if entry is not None and entry.get("stamp") == stamp:
+            return entry["sha256"]
+
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as hashed_file:
+            for chunk in iter(lambda: hashed_file.read(HASH_READ_SIZE), b""):
+                sha256.update(chunk)
+
+        with self._lock:
+            # the file can have the digests of other kaajal processes
+            self._entries = super()._load()
+            self._entries[file_path] = {"stamp": stamp, "sha256": sha256.hexdigest()}
+            self._save(self._entries)
+
+        return sha256.hexdigest()
+
+    def _load(self) -> Dict[str, dict]:
+        """Read the cache file once"""
+
+        if self._entries is None:
+            self._entries = super()._load()
+
+        return self._entries
+
+
+def detect_compression(path: str) -> str:
+    """Get the compression of a local or remote tarball
+
+    The first bytes of a local file are used, the extension otherwise.
+    """
+
+    if os.path.isfile(path):
+        with open(path, "rb") as tarball_file:
+            head = tarball_file.read(6)
+
+        for magic, compression in MAGIC_NUMBERS.items():
+            if head.startswith(magic):
+                return compression
+
+        return ""
+
+    for extension, compression in EXTENSIONS.items():
+        if path.split("?", 1)[0].endswith(extension):
+            return compression
+
+    return ""
+
+
+def load_tarball_list(path: str) -> Tuple[List[Tarball], str]:
+    """Load the tarballs from a tarball list file
+
+    Returns the list of tarballs and an error message.
+    """
+
+    tarballs: List[Tarball] = []
+
+    if not os.path.exists(path):
+        return_message = path + ": not found"
+        logger.warning(return_message)
+        return tarballs, return_message
+
+    try:
+        with open(path, encoding="utf-8") as tarball_list_file:
+            if path.endswith(".yaml") or path.endswith(".yml"):
+                for entry in yaml.safe_load(tarball_list_file) or []:
+                    tarballs.append(tarball_from_entry(entry))
+            else:
+                for line in tarball_list_file:
+                    if not line or not line.strip():
+                        continue
+                    if line.strip()[0] == "#":
+                        continue
+
+                    tarballs.append(_tarball_from_line(line))
+
+    except yaml.YAMLError as e:
+        return_message = "YAML Error: " + str(e)
+        logger.exception(return_message)
+        return tarballs, return_message
+    except (KeyError, TypeError, ValueError) as e:
+        return_message = f"{path}: wrong tarball entry: {str(e)}"
+        logger.exception(return_message)
+        return tarballs, return_message
+    except OSError as e:
+        return_message = "OS Error: " + str(e)
+        logger.exception(return_message)
+        return tarballs, return_message
+
+    return tarballs, ""
+
+
+def tarball_from_entry(entry) -> Tarball:
+    """Get the tarball of a YAML entry, a "source [path]" string or a mapping
+
+    Raises KeyError, TypeError or ValueError if the entry is wrong.
+    """
+
+    if isinstance(entry, str):
+        return _tarball_from_line(entry)
+
+    compression = entry.get("compression", "")
+    if compression not in DIR_COMPRESSIONS:
+        raise ValueError(f"unknown compression {compression!r}")
+
+    return Tarball(entry["source"], entry.get("path", ""), compression)
+
+
+def parse_tarball_items(items: List[str]) -> List[Tarball]:
+    """Get the tarballs from "source path" items"""
+
+    return [_tarball_from_line(item) for item in items if item.strip()]
+
+
+def _tarball_from_line(line: str) -> Tarball:
+    """Get the tarball of a "source [path]" line"""
+
+    values = line.strip().split(None, 1)
+
+    return Tarball(values[0], values[1] if len(values) > 1 else "")
+
+
+def _open_compressor(fileobj: BinaryIO, compression: str) -> BinaryIO:
+    """Get a file that compresses what is written to fileobj"""
+
+    # fast levels, the compression must not be slower than the link
+    if compression == "gz":
+        return cast(
+            BinaryIO, gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=1)
+        )
+
+    if compression == "xz":
+        return cast(BinaryIO, lzma.LZMAFile(fileobj, mode="wb", preset=1))
+
+    return fileobj
+
+
+class TarballInstaller:
+    """Install tarballs on the host of a SSH connection"""
+
+    def __init__(
+        self,
+        ssh_conn: SSHConnection,
+        sudo: str = "",
+        on_output: Optional[OutputCallback] = None,
+        use_cache: bool = True,
+        digests: Optional[DigestCache] = None,
+    ) -> None:
+        """Class constructor of Tarball Installer
+
+        sudo is the prefix of the commands that extract outside the home.
+        If use_cache is True, the local archives go through the remote
+        artifact cache.
+        """
+
+        self.ssh_conn = ssh_conn
+        self.sudo = sudo
+        self.on_output = on_output
+        self.use_cache = use_cache
+        self.digests = digests if digests is not None else digest_cache
+
+    def extract_cmd(self, tarball: Tarball, compression: str) -> str:
+        """Get the remote command that extracts the tarball"""
+
+        cmd = ""
+        if tarball.is_url():
+            url = shlex.quote(tarball.source)
+            cmd += f"(curl -fsSL {url} || wget -qO- {url}) | "
+        if compression:
+            cmd += DECOMPRESS_CMDS[compression] + " | "
+        # a failed download or decompression is a tar error, because the
+        # input of tar is not a whole archive
+        cmd += self._tar_cmd(tarball)
+
+        return "sh -c " + shlex.quote(cmd)
+
+    def artifact_cmd(
+        self, tarball: Tarball, compression: str, digest: str, state: str, size: int
+    ) -> str:
+        """Get the remote command that extracts an archive of the cache
+
+        If the archive is missing, it is read from stdin and saved in the
+        cache while it is extracted.
+        """
+
+        artifact = shlex.quote(self.remote_artifact_dir() + "/" + digest)
+        decompress = DECOMPRESS_CMDS[compression or ""]
+        tar_cmd = self._tar_cmd(tarball, digest)
+
+        if state == CACHED:
+            return "sh -c " + shlex.quote(f"{decompress} {artifact} | {tar_cmd}")
+
+        tmp_artifact = shlex.quote(self.remote_artifact_dir() + f"/.{digest}.tmp")
+        cmd = f"mkdir -p {shlex.quote(self.remote_artifact_dir())}"
+        cmd += f" && tee {tmp_artifact} | {decompress} | {tar_cmd}"
+        cmd += f" || {{ rc=$?; rm -f {tmp_artifact}; exit $rc; }}\n"
+        # a cache with no space left must not keep a broken archive
+        cmd += f'if [ "$(wc -c < {tmp_artifact})" -eq {size} ]; then '
+        cmd += f"mv -f {tmp_artifact} {artifact}; else rm -f {tmp_artifact}; fi"
+
+        return "sh -c " + shlex.quote(cmd)
+
+    def remote_artifact_dir(self) -> str:
+        """Get the dir of the artifact cache on the remote host"""
+
+        return self.ssh_conn.get_home() + "/" + REMOTE_ARTIFACT_DIR
+
+    def lookup(self, tarballs: List[Tarball]) -> Dict[int, Tuple[str, str]]:
+        """Get the digest and the cache state of the local archives
+
+        The state of all the archives is asked in one command.
+        Returns the digest and state of the archive at every index.
+        """
+
+        digests: Dict[int, str] = {}
+
+        for index, tarball in enumerate(tarballs):
+            source = tarball.get_source()
+            if not tarball.is_url() and os.path.isfile(source):
+                digests[index] = self.digests.digest(source)
+
+        if not digests:
+            return {}
+
+        script = ""
+        for index, digest in digests.items():
+            artifact = shlex.quote(self.remote_artifact_dir() + "/" + digest)
+            record = shlex.quote(tarballs[index].get_path() + "/" + ARTIFACTS_RECORD)
+            script += f"s={MISSING}; [ -f {artifact} ] && s={CACHED}; "
+            script += f"grep -qsx {digest} {record} && s={EXTRACTED}; "
+            script += f'echo "{index} $s"\n'
+
+        result = self.ssh_conn.exec("sh -c " + shlex.quote(script))
+        states = dict(line.split() for line in result.stdout.split("\n") if line)
+
+        return {
+            index: (digest, states.get(str(index), MISSING))
+            for index, digest in digests.items()
+        }
+
+    def install(
+        self, tarball: Tarball, artifact: Optional[Tuple[str, str]] = None
+    ) -> TarballResult:
+        """Install one tarball
+
+        artifact is the digest and the cache state of a local archive.
+        """
+
+        result = TarballResult(tarball)
+        result.status = "extracted"
+        start = time.monotonic()
+        source = tarball.get_source()
+
+        if artifact is not None and artifact[1] == EXTRACTED:
+            result.status = "up to date"
+            logger.info("%s: already in %s", tarball.source, tarball.get_path())
+            return result
+
+        if artifact is not None and os.path.isfile(source):
+            digest, state = artifact
+            compression = detect_compression(source)
+            cmd = self.artifact_cmd(
+                tarball, compression, digest, state, os.path.getsize(source)
+            )
+
+            if state == CACHED:
+                result.status = "from cache"
+                cmd_result = self.ssh_conn.exec(cmd, on_output=self.on_output)
+            else:
+                result.size = os.path.getsize(source)
+                with open(source, "rb") as tarball_file:
+                    cmd_result = self.ssh_conn.exec(
+                        cmd, on_output=self.on_output, stdin=tarball_file
+                    )
+        elif tarball.is_url():
+            compression = detect_compression(source)
+            cmd_result = self.ssh_conn.exec(
+                self.extract_cmd(tarball, compression), on_output=self.on_output
+            )
+        elif os.path.isdir(source):
+            cmd_result = self._install_dir(tarball, result)
+        elif os.path.isfile(source):
+            compression = detect_compression(source)
+            result.size = os.path.getsize(source)
+            with open(source, "rb") as tarball_file:
+                cmd_result = self.ssh_conn.exec(
+                    self.extract_cmd(tarball, compression),
+                    on_output=self.on_output,
+                    stdin=tarball_file,
+                )
+        else:
+            result.error = f"{tarball.source}: not found"
+            logger.warning(result.error)
+            return result
+
+        result.duration = time.monotonic() - start
+
+        if cmd_result.error:
+            result.error = cmd_result.error
+        elif cmd_result.exit_status:
+            # the first error is the cause of the others
+            result.error = cmd_result.stderr.strip().split("\n")[0] or "tar failed"
+
+        if result.error:
+            result.status = "failed"
+            logger.warning("%s: %s", tarball.source, result.error)
+        else:
+            logger.info(
+                "%s: %s in %s in %.1f s",
+                tarball.source,
+                result.status,
+                tarball.get_path(),
+                result.duration,
+            )
+
+        return result
+
+    def install_all(
+        self,
+        tarballs: List[Tarball],
+        on_result: Optional[Callable[[TarballResult], None]] = None,
+    ) -> List[TarballResult]:
+        """Install the tarballs one after the other
+
+        Every tarball uses all the bandwidth of the link, so there is no
+        gain in sending two at the same time.
+        """
+
+        results = []
+        artifacts = self.lookup(tarballs) if self.use_cache else {}
+
+        sent = set()
+
+        for index, tarball in enumerate(tarballs):
+            artifact = artifacts.get(index)
+            # an archive sent for another path is in the cache now
+            if artifact is not None and artifact[0] in sent and artifact[1] == MISSING:
+                artifact = (artifact[0], CACHED)
+
+            result = self.install(tarball, artifact)
+            results.append(result)
+            if artifact is not None and result.ok:
+                sent.add(artifact[0])
+            if on_result is not None:
+                on_result(result)
+
+        return results
+
+    def _install_dir(self, tarball: Tarball, result: TarballResult) -> CommandResult:
+        """Archive a local directory while it is sent"""
+
+        compression = tarball.compression or DIR_COMPRESSION
+        read_fd, write_fd = os.pipe()
+
+        def write_archive() -> None:
+            try:
+                with os.fdopen(write_fd, "wb") as pipe_file:
+                    with _open_compressor(pipe_file, compression) as compressed:
+                        with tarfile.open(fileobj=compressed, mode="w|") as archive:
+                            archive.add(tarball.get_source(), arcname=".")
+            except OSError as e:
+                # the remote command ended before reading all
+                logger.debug("%s: archive not written: %s", tarball.source, str(e))
+
+        writer = threading.Thread(target=write_archive, name="kaajal-tarball")
+        writer.start()
+
+        with os.fdopen(read_fd, "rb") as pipe_file:
+            counted = _CountingReader(pipe_file)
+            cmd_result = self.ssh_conn.exec(
+                self.extract_cmd(tarball, compression),
+                on_output=self.on_output,
+                stdin=cast(BinaryIO, counted),
+            )
+
+        writer.join()
+        result.size = counted.count
+
+        return cmd_result
+
+    def _tar_cmd(self, tarball: Tarball, digest: str = "") -> str:
+        """Get the remote command that extracts the archive read from stdin
+
+        If digest is given, it is recorded in the path.
+        """
+
+        path = shlex.quote(tarball.get_path())
+
+        cmd = f"mkdir -p {path} && tar -x -f - -C {path}"
+        if digest:
+            record = shlex.quote(tarball.get_path() + "/" + ARTIFACTS_RECORD)
+            cmd += f" && echo {digest} >> {record}"
+        cmd = "sh -c " + shlex.quote(cmd)
+
+        if self.sudo and self._needs_sudo(tarball.get_path()):
+            cmd = self.sudo + " " + cmd
+
+        return cmd
+
+    def _needs_sudo(self, path: str) -> bool:
+        """True if the path is not in the home of the user"""
+
+        if not path.startswith("/"):
+            return False
+
+        home = self.ssh_conn.get_home()
+
+        return not (home and (path == home or path.startswith(home.rstrip("/") + "/")))
+
+
+class _CountingReader:
+    """Binary file that counts the bytes read from other file"""
+
+    def __init__(self, fileobj: BinaryIO) -> None:
+        """Class constructor of counting reader"""
+
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.fileobj.read(size)
+        self.count += len(data)
+        return data
+
+
+def summary(results: List[TarballResult]) -> str:
+    """Get a text summary of the install results"""
+
+    lines = []
+
+    for result in results:
+        line = f"{result.tarball.source} -> {result.tarball.get_path()}: "
+        if result.ok:
+            line += f"{result.status} in {result.duration:.1f} s"
+            if result.size and result.duration:
+                line += f" ({result.size / result.duration / 1e6:.1f} MB/s)"
+        else:
+            line += "failed: " + result.error
+        lines.append(line)
+
+    failed = [result for result in results if not result.ok]
+    lines.append(f"{len(results) - len(failed)} of {len(results)} tarballs installed")
+
+    return "\n".join(lines)
+
+
+digest_cache = DigestCache()
@@ -0,0 +1,125 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal test fixtures"""
+
+import os
+import pathlib
+from typing import Callable
+from typing import Iterator
+from typing import List
+
+import pytest
+
+from kaajal.distro import Distro
+from kaajal.local import LocalConnection
+from kaajal.pkgmgr import PackageManager
+
+
+class FakePackageManager(PackageManager):
+    """Package manager whose commands are shell commands of the test"""
+
+    name = "fake"
+
+    def __init__(
+        self, update_cmds: List[str], install_cmd: str, installed_cmd: str
+    ) -> None:
+        """Class constructor of Fake Package Manager
+
+        PKGS in install_cmd is replaced by the packages to install.
+        """
+
+        self._update_cmds = update_cmds
+        self._install_cmd = install_cmd
+        self._installed_cmd = installed_cmd
+
+    def update_cmds(self, fast: bool = True, refresh: bool = True) -> List[str]:
+        return self._update_cmds
+
+    def install_cmd(self, str_pkgs_list: str, fast: bool = True) -> str:
+        return self._install_cmd.replace("PKGS", str_pkgs_list)
+
+    def installed_cmd(self) -> str:
+        return self._installed_cmd
+
+
+@pytest.fixture
+def local_conn(tmp_path, monkeypatch) -> Iterator[LocalConnection]:
+    """Connection to the local machine, with a home in the test directory"""
+
+    home = tmp_path / "home"
+    home.mkdir()
+    monkeypatch.setenv("HOME", str(home))
+    conn = LocalConnection()
+    assert conn.connect() == ""
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def local_distro(local_conn: LocalConnection) -> Distro:
+    """Distro of the local machine, allowed to update, with no package manager"""
+
+    distro = Distro()
+    distro.set_ssh_conn(local_conn)
+    distro.id = "fake"
+    distro.uid = "0"
+    distro.metadata_max_age = 0
+
+    return distro
+
+
+@pytest.fixture
+def fake_backend(local_distro: Distro) -> Callable[..., PackageManager]:
+    """Make the local distro use a package manager running test commands
+
+    The fixture is called with the update commands, the install command
+    and the command listing the installed packages.
+    """
+
+    def use_backend(
+        update_cmds: List[str], install_cmd: str = "", installed_cmd: str = ""
+    ) -> PackageManager:
+        backend = FakePackageManager(update_cmds, install_cmd, installed_cmd)
+        local_distro.get_pkg_manager = lambda: backend  # type: ignore[method-assign]
+        local_distro._installed = None
+        return backend
+
+    return use_backend
+
+
+@pytest.fixture
+def fake_users(tmp_path, monkeypatch) -> pathlib.Path:
+    """Make id, useradd and chpasswd work on a directory of fake users
+
+    A user is a file of the directory, with the password as content.
+    useradd fails for the user "broken", chpasswd for the user "weak".
+    """
+
+    users = tmp_path / "users"
+    users.mkdir()
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    scripts = {
+        "id": f'[ -e {users}/"$2" ]',
+        "useradd": (
+            'for user; do :; done\n[ "$user" != broken ] || '
+            "{ echo useradd: broken failed; exit 1; }\n"
+            f'touch {users}/"$user"'
+        ),
+        "chpasswd": (
+            "n=0; rc=0\nwhile IFS=: read -r user password; do n=$((n + 1))\n"
+            'if [ "$user" = weak ]; then echo "chpasswd: line $n: weak"; rc=1\n'
+            f'else printf %s "$password" > {users}/"$user"; fi\ndone\nexit $rc'
+        ),
+    }
+    for name, script in scripts.items():
+        (bin_dir / name).write_text("#!/bin/sh\n" + script + "\n")
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+
+    return users
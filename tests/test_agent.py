@@ -0,0 +1,37 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal agent tests"""
+
+import os
+
+from kaajal.agent import AgentConnection
+from kaajal.agent import _AgentSFTP
+
+
+def test_sftp_local_paths_are_absolute(monkeypatch, tmp_path) -> None:
+    calls = []
+
+    def call(method: str, *args, **kwargs):
+        calls.append(args)
+        return None, ""
+
+    ssh_conn = AgentConnection(str(tmp_path / "agent.sock"))
+    monkeypatch.setattr(ssh_conn, "_call", call)
+    monkeypatch.chdir(tmp_path)
+    sftp = _AgentSFTP(ssh_conn)
+
+    sftp.put("local.txt", "remote.txt")
+    sftp.get("remote.txt", "local.txt")
+    sftp.remove("remote.txt")
+
+    local_path = os.path.join(str(tmp_path), "local.txt")
+    assert calls == [
+        (local_path, "remote.txt"),
+        ("remote.txt", local_path),
+        ("remote.txt",),
+    ]
@@ -0,0 +1,110 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal asyncio tests"""
+
+import asyncio
+import threading
+import time
+from typing import Iterator
+
+import pytest
+
+from kaajal import aio
+from kaajal.aio import AsyncDistro
+from kaajal.aio import AsyncSSHConnection
+from kaajal.distro import Distro
+from kaajal.local import LocalConnection
+
+
+@pytest.fixture
+def max_workers() -> Iterator[None]:
+    """Give back the default size of the executor after the test"""
+
+    default = aio.MAX_WORKERS
+    yield
+    aio.set_max_workers(default)
+
+
+def test_run(local_conn: LocalConnection) -> None:
+    conn = AsyncSSHConnection(local_conn)
+
+    async def run_all():
+        return await asyncio.gather(
+            conn.run("echo out; echo err >&2; exit 4"),
+            conn.run("cat", stdin="input"),
+            conn.run_batch({"one": "echo 1", "two": "echo 2"}),
+            conn.stat("/"),
+        )
+
+    result, stdin_result, batch, stat = asyncio.run(run_all())
+
+    assert (result.stdout, result.stderr, result.exit_status) == ("out\n", "err\n", 4)
+    assert stdin_result.stdout == "input"
+    assert {name: probe.stdout for name, probe in batch.items()} == {
+        "one": "1\n",
+        "two": "2\n",
+    }
+    assert stat == 1
+    assert conn.is_connected
+    assert conn.home == local_conn.home
+
+
+def test_commands_run_at_the_same_time(local_conn: LocalConnection) -> None:
+    conn = AsyncSSHConnection(local_conn)
+
+    async def run_all():
+        return await asyncio.gather(*(conn.run("sleep 0.3") for _ in range(4)))
+
+    start = time.monotonic()
+    results = asyncio.run(run_all())
+
+    assert all(result.ok for result in results)
+    assert time.monotonic() - start < 1.0
+
+
+def test_executor_is_bounded(max_workers) -> None:
+    aio.set_max_workers(2)
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def call() -> None:
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+
+    async def run_all():
+        await asyncio.gather(*(aio.run_blocking(call) for _ in range(8)))
+
+    asyncio.run(run_all())
+
+    assert active[1] == 2
+
+
+def test_distro(local_distro: Distro, fake_backend, tmp_path) -> None:
+    installed = tmp_path / "installed"
+    fake_backend(["true"], f"echo PKGS > {installed}")
+    distro = AsyncDistro(local_distro)
+
+    async def provision():
+        return await distro.update(), await distro.install("vim git")
+
+    assert asyncio.run(provision()) == ("", "")
+    assert installed.read_text() == "vim git\n"
+    # the attributes come from the distro
+    assert distro.id == "fake"
+
+
+def test_distro_set_ssh_conn(local_conn: LocalConnection) -> None:
+    distro = AsyncDistro()
+
+    distro.set_ssh_conn(AsyncSSHConnection(local_conn))
+
+    assert distro.ssh_conn is local_conn
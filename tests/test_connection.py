@@ -0,0 +1,66 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal connection tests"""
+
+from kaajal.connection import ConnectionPool
+from kaajal.local import LocalConnection
+
+
+def test_pool_key_has_the_credential() -> None:
+    conn_args = {"hostname": "host", "username": "user", "password": "secret"}
+
+    key = ConnectionPool.make_key(conn_args)
+
+    assert key == ConnectionPool.make_key(dict(conn_args))
+    assert key != ConnectionPool.make_key(dict(conn_args, password="wrong"))
+    assert key != ConnectionPool.make_key(dict(conn_args, password=""))
+    assert "secret" not in key
+
+
+def test_query_packages(local_conn: LocalConnection) -> None:
+    assert local_conn.query_packages("printf 'vim\\ngit\\n'") == ("vim\ngit\n", "")
+
+    output, error_msg = local_conn.query_packages("exit 3")
+
+    assert output == ""
+    assert error_msg == "exit 3 failed with exit status 3"
+
+
+def test_exec_batch_splits_the_output(local_conn: LocalConnection) -> None:
+    results = local_conn.exec_batch(
+        {
+            "lines": "echo one; echo two; echo err >&2",
+            "status": "exit 3",
+            "no_newline": "printf 'no newline'",
+            "empty": "true",
+            "cd": "cd / && exit",
+            "after": "pwd",
+        }
+    )
+
+    assert results["lines"].stdout == "one\ntwo\n"
+    assert results["lines"].stderr == "err\n"
+    assert results["lines"].ok
+    assert results["status"].exit_status == 3
+    assert results["status"].stdout == ""
+    assert results["no_newline"].stdout == "no newline"
+    assert results["empty"].stdout == ""
+    assert results["empty"].ok
+    # the commands run in sub shells, exit and cd do not stop the batch
+    assert results["cd"].ok
+    assert results["after"].stdout == local_conn.home + "\n"
+
+
+def test_exec_batch_marker_in_output(local_conn: LocalConnection) -> None:
+    results = local_conn.exec_batch(
+        {"fake": "echo '__kaajal_0 END 0 9'", "next": "echo next"}
+    )
+
+    assert results["fake"].stdout == "__kaajal_0 END 0 9\n"
+    assert results["fake"].exit_status == 0
+    assert results["next"].stdout == "next\n"
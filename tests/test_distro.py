@@ -0,0 +1,227 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal distro tests"""
+
+import os
+import pathlib
+import time
+
+import pytest
+
+from kaajal.distro import Distro
+from kaajal.distro import NewUser
+from kaajal.pkgmgr import Apt
+
+
+def test_update_fails_on_nonzero_exit(
+    local_distro: Distro, fake_backend, tmp_path
+) -> None:
+    marker = tmp_path / "after"
+    fake_backend(["true", "exit 100", f"touch {marker}"])
+
+    error_msg = local_distro.update()
+
+    assert "exit 100 failed with exit status 100" in error_msg
+    # the update stops at the command that failed
+    assert not marker.exists()
+
+
+def test_update_ok(local_distro: Distro, fake_backend) -> None:
+    fake_backend(["true", "true"])
+
+    assert local_distro.update() == ""
+
+
+def test_install_fails_on_nonzero_exit(local_distro: Distro, fake_backend) -> None:
+    fake_backend([], "exit 100")
+
+    error_msg = local_distro.install("vim")
+
+    assert error_msg == "exit 100 failed with exit status 100"
+
+
+def test_install_ok(local_distro: Distro, fake_backend) -> None:
+    fake_backend([], "true")
+
+    assert local_distro.install("vim") == ""
+
+
+@pytest.mark.skipif(os.geteuid() != 0, reason="chown needs root")
+def test_update_user_file_sudo_owns_created_dirs(
+    local_distro: Distro, tmp_path
+) -> None:
+    owner = (12345, 12346)
+    home = tmp_path / "other"
+    home.mkdir()
+
+    error_msg = local_distro._update_user_file_sudo(
+        str(home),
+        ".config/github",
+        str(home / ".config/github/token"),
+        owner,
+        lambda content: content + "token\n",
+    )
+
+    assert error_msg == ""
+    for path in (home / ".config", home / ".config/github"):
+        assert (path.stat().st_uid, path.stat().st_gid) == owner
+        assert path.stat().st_mode & 0o777 == 0o700
+    token = home / ".config/github/token"
+    assert token.read_text() == "token\n"
+    assert (token.stat().st_uid, token.stat().st_gid) == owner
+    # the home exists, it is not changed
+    assert home.stat().st_uid == 0
+
+
+def test_install_only_missing_packages(
+    local_distro: Distro, fake_backend, tmp_path
+) -> None:
+    db = tmp_path / "installed"
+    db.write_text("vim\ngit\n")
+    queries = tmp_path / "queries"
+    fake_backend([], f"printf '%s\\n' PKGS >> {db}", f"echo >> {queries}; cat {db}")
+
+    assert local_distro.install("vim tmux git curl") == ""
+    assert db.read_text() == "vim\ngit\ntmux\ncurl\n"
+
+    # all installed, the package manager is not run
+    assert local_distro.install("tmux vim") == ""
+    assert db.read_text() == "vim\ngit\ntmux\ncurl\n"
+    # the list is queried again only after an install
+    assert local_distro.installed_packages() == {"vim", "git", "tmux", "curl"}
+    assert len(queries.read_text().split("\n")) - 1 == 2
+
+
+def test_install_all_when_the_query_fails(
+    local_distro: Distro, fake_backend, tmp_path
+) -> None:
+    installs = tmp_path / "installs"
+    fake_backend([], f"echo PKGS >> {installs}", "exit 1")
+
+    assert local_distro.installed_packages() is None
+    assert local_distro.install("vim git") == ""
+    assert installs.read_text() == "vim git\n"
+
+
+def test_apt_metadata_age(local_distro: Distro, fake_backend, tmp_path) -> None:
+    now = time.time()
+    lists = tmp_path / "lib/apt/lists"
+    (lists / "partial").mkdir(parents=True)
+    (tmp_path / "cache/apt").mkdir(parents=True)
+    release = lists / "deb.debian.org_debian_dists_stable_InRelease"
+    release.touch()
+    os.utime(release, (now - 7200, now - 7200))
+    backend = fake_backend([])
+    backend.metadata_files = Apt.metadata_files.replace("/var", str(tmp_path))
+
+    age = local_distro.metadata_age()
+
+    assert age is not None and 7190 < age < 7300
+
+    # an install rebuilds the cache, the metadata is not refreshed
+    (tmp_path / "cache/apt/pkgcache.bin").touch()
+    (lists / "partial").touch()
+
+    age = local_distro.metadata_age()
+
+    assert age is not None and 7190 < age < 7300
+
+    (tmp_path / "lib/apt/periodic").mkdir()
+    (tmp_path / "lib/apt/periodic/update-success-stamp").touch()
+
+    age = local_distro.metadata_age()
+
+    assert age is not None and age < 100
+
+
+def test_create_users(local_distro: Distro, fake_users: pathlib.Path) -> None:
+    results = local_distro.create_users(
+        [
+            NewUser("alice", "alice-password"),
+            NewUser("weak", "123"),
+            NewUser("bob", "bob-password"),
+            NewUser("broken", "password"),
+        ]
+    )
+
+    assert results["alice"] == ""
+    assert results["bob"] == ""
+    assert results["weak"] == "create_new_user: weak: password failed: " + (
+        "chpasswd: line 2: weak"
+    )
+    assert results["broken"] == (
+        "create_new_user: broken: useradd failed: useradd: broken failed"
+    )
+    assert (fake_users / "alice").read_text() == "alice-password"
+    assert (fake_users / "bob").read_text() == "bob-password"
+    assert not (fake_users / "broken").exists()
+
+
+def test_create_existing_users(local_distro: Distro, fake_users: pathlib.Path) -> None:
+    (fake_users / "alice").write_text("old-password")
+
+    results = local_distro.create_users(
+        [NewUser("alice", "new-password"), NewUser("bob", "bob-password")]
+    )
+
+    # the existing user is not changed, its password is not given to chpasswd
+    assert results == {"alice": "", "bob": ""}
+    assert (fake_users / "alice").read_text() == "old-password"
+    assert (fake_users / "bob").read_text() == "bob-password"
+
+
+def test_create_users_checks_the_users(local_distro: Distro) -> None:
+    results = local_distro.create_users(
+        [NewUser("Bad Name", "x"), NewUser("nokey"), NewUser("nl", "a\nb")]
+    )
+
+    assert results == {
+        "Bad Name": 'create_new_user: "Bad Name" is not a valid user',
+        "nokey": "create_new_user: NO password or SSH key given",
+        "nl": "create_new_user: password can not have new lines",
+    }
+
+
+def test_copy_ssh_keys_merges_authorized_keys(local_distro: Distro, tmp_path) -> None:
+    home = pathlib.Path(os.environ["HOME"])
+    ssh_dir = home / ".ssh"
+    ssh_dir.mkdir()
+    authorized_keys = ssh_dir / "authorized_keys"
+    authorized_keys.write_text("# keys\nssh-ed25519 AAAAold old@host\n")
+    key_path = tmp_path / "id_ed25519.pub"
+    key_path.write_text(
+        "ssh-ed25519 AAAAnew new@laptop\n"
+        "# comment\n"
+        'from="10.0.0.1" ssh-ed25519 AAAAold other comment\n'
+    )
+
+    assert local_distro.copy_ssh_keys([str(key_path)]) == ""
+
+    assert authorized_keys.read_text() == (
+        "# keys\nssh-ed25519 AAAAold old@host\nssh-ed25519 AAAAnew new@laptop\n"
+    )
+    assert authorized_keys.stat().st_mode & 0o777 == 0o600
+
+    # the keys are there, the file is not written again
+    inode = authorized_keys.stat().st_ino
+    assert local_distro.copy_ssh_keys([str(key_path)]) == ""
+    assert authorized_keys.stat().st_ino == inode
+
+
+def test_copy_github_token_creates_the_dirs(local_distro: Distro, tmp_path) -> None:
+    home = pathlib.Path(os.environ["HOME"])
+    token_path = tmp_path / "token"
+    token_path.write_text("ghp_secret\n")
+
+    assert local_distro.copy_github_token(str(token_path)) == ""
+
+    token = home / ".config/github/token"
+    assert token.read_text() == "ghp_secret\n"
+    assert token.stat().st_mode & 0o777 == 0o600
+    assert (home / ".config").stat().st_mode & 0o777 == 0o700
+    assert (home / ".config/github").stat().st_mode & 0o777 == 0o700
@@ -0,0 +1,59 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal distro facts cache tests"""
+
+import logging
+import os
+import threading
+
+from kaajal.facts import FactsCache
+
+FACTS = {"id": "debian", "pm": "apt-get", "uid": "1000"}
+
+
+def test_facts_of_a_host(tmp_path) -> None:
+    cache = FactsCache(str(tmp_path / "facts.json"))
+
+    cache.put("user@host:22", "SHA256:host", FACTS)
+
+    facts = FactsCache(cache.path).get("user@host:22", "SHA256:host")
+    assert facts is not None and facts["pm"] == "apt-get"
+    assert cache.get("user@other:22") is None
+    # a reinstalled host is identified again
+    assert cache.get("user@host:22", "SHA256:new") is None
+    assert cache.hosts() == {}
+
+
+def test_facts_expire(tmp_path) -> None:
+    cache = FactsCache(str(tmp_path / "facts.json"), ttl=-1)
+
+    cache.put("user@host:22", "SHA256:host", FACTS)
+
+    assert cache.get("user@host:22") is None
+
+
+def test_saves_at_the_same_time(tmp_path, caplog) -> None:
+    path = str(tmp_path / "facts.json")
+    caplog.set_level(logging.WARNING)
+
+    # every cache has its own lock, like caches of several processes
+    def put_facts(index: int) -> None:
+        cache = FactsCache(path)
+        for count in range(20):
+            cache.put(f"user@host{index}:22", "SHA256:host", FACTS)
+            cache.hosts()
+
+    threads = [threading.Thread(target=put_facts, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not caplog.records
+    assert FactsCache(path).hosts()
+    assert os.listdir(tmp_path) == ["facts.json"]
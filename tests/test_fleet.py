@@ -0,0 +1,114 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal fleet tests"""
+
+import asyncio
+import socket
+import threading
+from typing import Callable
+from typing import Iterator
+
+import pytest
+
+from kaajal.fleet import probe_host
+from kaajal.fleet import scan_hosts
+
+# Starts a server that sends a greeting, returns its port
+ServerStarter = Callable[[bytes], int]
+
+
+@pytest.fixture
+def server() -> Iterator[ServerStarter]:
+    """Local TCP servers that send a greeting and wait for the client"""
+
+    sockets = []
+    stop = threading.Event()
+
+    def start(greeting: bytes) -> int:
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        sockets.append(listener)
+
+        def serve() -> None:
+            conn = listener.accept()[0]
+            with conn:
+                conn.sendall(greeting)
+                stop.wait(10)
+
+        threading.Thread(target=serve, daemon=True).start()
+
+        return listener.getsockname()[1]
+
+    yield start
+
+    stop.set()
+    for listener in sockets:
+        listener.close()
+
+
+def free_port() -> int:
+    """Get a local port no one listens to"""
+
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        return unused.getsockname()[1]
+
+
+def test_probe_host(server: ServerStarter) -> None:
+    banner = server(b"SSH-2.0-OpenSSH_9.6\r\n")
+    late_banner = server(b"Welcome\r\n" * 3 + b"SSH-2.0-test\r\n")
+    silent = server(b"220 smtp ready\r\n")
+    closed = free_port()
+
+    assert asyncio.run(probe_host("127.0.0.1", banner)) == ""
+    assert asyncio.run(probe_host("127.0.0.1", late_banner)) == ""
+    assert asyncio.run(probe_host("127.0.0.1", silent, 0.2)) == (
+        f"127.0.0.1:{silent}: no answer in 0.2 s"
+    )
+    assert asyncio.run(probe_host("127.0.0.1", closed)).startswith(
+        f"127.0.0.1:{closed}: "
+    )
+
+
+def test_probe_host_without_banner() -> None:
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+
+        def greet_and_close() -> None:
+            conn = listener.accept()[0]
+            with conn:
+                conn.sendall(b"220 smtp ready\r\n")
+
+        threading.Thread(target=greet_and_close, daemon=True).start()
+
+        assert asyncio.run(probe_host("127.0.0.1", port)) == (
+            f"127.0.0.1:{port}: no SSH banner"
+        )
+
+
+def test_scan_hosts(server: ServerStarter, tmp_path) -> None:
+    up = server(b"SSH-2.0-test\r\n")
+    ssh_config = tmp_path / "ssh_config"
+    ssh_config.write_text(
+        f"Host up\n  HostName 127.0.0.1\n  Port {up}\n"
+        f"Host down\n  HostName 127.0.0.1\n  Port {free_port()}\n"
+    )
+    hosts = [
+        {"connection_type": "SSH host", "ssh_config": str(ssh_config)},
+        {"connection_type": "SSH host", "ssh_config": str(ssh_config)},
+        # the address of these hosts is not known, they are not probed
+        {"connection_type": "SSH host", "ssh_config": ""},
+        {"connection_type": "SSH host", "ssh_config": "/not/found"},
+    ]
+    hosts[0]["ssh_config_host"] = "up"
+    hosts[1]["ssh_config_host"] = "down"
+
+    assert list(scan_hosts(hosts, 1.0)) == [1]
@@ -0,0 +1,90 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal step journal tests"""
+
+import os
+import time
+
+from kaajal.journal import REMOTE_JOURNAL
+from kaajal.journal import StepJournal
+from kaajal.local import LocalConnection
+
+HOST_ID = "user@host:22"
+FINGERPRINT = "SHA256:host"
+
+
+def test_step_is_done_with_the_same_input(tmp_path) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"))
+
+    journal.record(HOST_ID, FINGERPRINT, "packages", "hash")
+
+    assert journal.is_done(HOST_ID, FINGERPRINT, "packages", "hash")
+    assert not journal.is_done(HOST_ID, FINGERPRINT, "packages", "other")
+    assert not journal.is_done(HOST_ID, FINGERPRINT, "users", "hash")
+    assert not journal.is_done("user@other:22", FINGERPRINT, "packages", "hash")
+    # a reinstalled host has another host key
+    assert not journal.is_done(HOST_ID, "SHA256:new", "packages", "hash")
+    # the journal is read from the file again
+    reloaded = StepJournal(journal.path)
+    assert reloaded.is_done(HOST_ID, FINGERPRINT, "packages", "hash")
+    assert os.listdir(tmp_path) == ["journal.json"]
+
+
+def test_step_expires(tmp_path) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"), ttl=3600)
+    step_time = time.time() - 600
+
+    journal.merge(HOST_ID, FINGERPRINT, {"update": {"hash": "h", "time": step_time}})
+
+    assert journal.is_done(HOST_ID, FINGERPRINT, "update", "h")
+    assert journal.is_done(HOST_ID, FINGERPRINT, "update", "h", max_age=900)
+    assert not journal.is_done(HOST_ID, FINGERPRINT, "update", "h", max_age=300)
+    # max_age can not make a step valid longer than the ttl
+    journal.ttl = 60
+    assert not journal.is_done(HOST_ID, FINGERPRINT, "update", "h", max_age=900)
+    # ttl 0 runs all the steps again
+    journal.ttl = 0
+    assert not journal.is_done(HOST_ID, FINGERPRINT, "update", "h")
+
+
+def test_merge_keeps_the_newest_step(tmp_path) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"))
+
+    journal.merge(HOST_ID, FINGERPRINT, {"users": {"hash": "new", "time": 20.0}})
+    journal.merge(HOST_ID, FINGERPRINT, {"users": {"hash": "old", "time": 10.0}})
+
+    assert journal.steps(HOST_ID, FINGERPRINT)["users"]["hash"] == "new"
+
+
+def test_forget(tmp_path) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"))
+    journal.record(HOST_ID, FINGERPRINT, "update", "h")
+    journal.record(HOST_ID, FINGERPRINT, "packages", "h")
+    journal.record("user@other:22", FINGERPRINT, "update", "h")
+
+    assert journal.forget(HOST_ID, "packages") == 1
+    assert list(journal.steps(HOST_ID)) == ["update"]
+    assert journal.forget(HOST_ID) == 1
+    assert journal.hosts() == {"user@other:22": 1}
+    assert journal.forget() == 1
+    assert journal.hosts() == {}
+
+
+def test_remote_copy(local_conn: LocalConnection, tmp_path) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"))
+    host_id = local_conn.host_id()
+    fingerprint = local_conn.host_key_fingerprint()
+    journal.record(host_id, fingerprint, "update", "h")
+
+    assert journal.save_remote(local_conn) == ""
+    assert os.path.isfile(os.path.join(local_conn.get_home(), REMOTE_JOURNAL))
+
+    # another machine finds the steps done on the host
+    other = StepJournal(str(tmp_path / "other.json"))
+    assert other.load_remote(local_conn) == ""
+    assert other.is_done(host_id, fingerprint, "update", "h")
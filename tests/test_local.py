@@ -0,0 +1,60 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal local connection tests"""
+
+from typing import List
+from typing import Tuple
+
+from kaajal.local import LocalConnection
+
+
+def is_running(pid: int) -> bool:
+    """True if a process is running, a zombie is not"""
+
+    try:
+        with open(f"/proc/{pid}/stat", encoding="utf-8") as stat_file:
+            return stat_file.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+def test_exec(local_conn: LocalConnection) -> None:
+    lines: List[Tuple[str, str]] = []
+
+    result = local_conn.exec(
+        "pwd; cat; echo err >&2; exit 4",
+        stdin="in\n",
+        on_output=lambda stream, line: lines.append((stream, line)),
+    )
+
+    assert result.exit_status == 4
+    assert result.error == ""
+    assert result.stdout == local_conn.get_home() + "\nin\n"
+    assert result.stderr == "err\n"
+    assert [line for stream, line in lines if stream == "stdout"] == [
+        local_conn.get_home(),
+        "in",
+    ]
+    assert ("stderr", "err") in lines
+    # a killed command gets the exit status of the shells
+    assert local_conn.exec("kill -TERM $$").exit_status == 143
+
+
+def test_timeout_kills_the_children(local_conn: LocalConnection, tmp_path) -> None:
+    pid_file = tmp_path / "pid"
+
+    # the child of the shell keeps stdout open
+    result = local_conn.exec(
+        f"sh -c 'echo $$ > {pid_file}; exec sleep 30'; echo done", timeout=0.5
+    )
+
+    assert result.error.startswith("Timeout")
+    assert result.exit_status == -1
+    assert result.stdout == ""
+    assert result.duration < 10
+    assert not is_running(int(pid_file.read_text()))
@@ -0,0 +1,120 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal git mirror tests"""
+
+import os
+import subprocess  # nosec B404
+from typing import List
+
+import pytest
+
+from kaajal.local import LocalConnection
+from kaajal.mirror import BundleCloner
+from kaajal.mirror import MirrorCache
+from kaajal.mirror import run_git
+
+
+@pytest.fixture
+def origin(tmp_path) -> str:
+    """Path of a local git repository with two commits on main"""
+
+    path = tmp_path / "origin"
+    path.mkdir()
+    run(path, "init", "-q", "-b", "main")
+    for name in ("first", "second"):
+        (path / "README").write_text(name + "\n")
+        run(path, "add", "README")
+        run(path, "commit", "-q", "-m", name)
+
+    return str(path)
+
+
+def run(path, *args: str) -> str:
+    """Run a git command in a repository of the test"""
+
+    git = ["git", "-C", str(path), "-c", "user.name=t", "-c", "user.email=t@t"]
+    process = subprocess.run(
+        git + list(args), check=True, capture_output=True, text=True
+    )
+
+    return process.stdout.strip()
+
+
+@pytest.fixture
+def cloner(local_conn: LocalConnection, tmp_path) -> BundleCloner:
+    """Bundle cloner to the local machine, with a mirror cache in the test"""
+
+    return BundleCloner(local_conn, MirrorCache(str(tmp_path / "mirrors"), max_age=0))
+
+
+def remote_ref(cloner: BundleCloner, url: str, ref: str) -> str:
+    """Get the commit of a ref of the remote bare repo"""
+
+    return run(cloner.remote_mirror_path(url), "rev-parse", ref)
+
+
+def bundles(cloner: BundleCloner) -> List[str]:
+    """Get the bundles left in the mirror cache"""
+
+    path = cloner.mirror_cache.get_path()
+
+    return [name for name in os.listdir(path) if name.endswith(".bundle")]
+
+
+def test_create_bundle_without_remote_commits(cloner: BundleCloner, origin) -> None:
+    cache = cloner.mirror_cache
+    assert cache.update(origin) == ""
+
+    bundle_path, error_msg = cache.create_bundle(origin, [])
+    assert error_msg == ""
+    assert run_git(["bundle", "verify", bundle_path])[1] == ""
+    os.remove(bundle_path)
+
+    # the remote has every commit, or commits the mirror does not know
+    head = run(origin, "rev-parse", "main")
+    assert cache.create_bundle(origin, [head, "0" * 40]) == ("", "")
+    assert bundles(cloner) == []
+
+
+def test_send_bundle_updates_the_remote(cloner: BundleCloner, origin) -> None:
+    assert cloner.mirror_cache.update(origin) == ""
+    assert cloner.send_bundle(origin) == ""
+    assert remote_ref(cloner, origin, "main") == run(origin, "rev-parse", "main")
+
+    with open(os.path.join(origin, "README"), "w", encoding="utf-8") as readme:
+        readme.write("third\n")
+    run(origin, "commit", "-q", "-a", "-m", "third")
+    assert cloner.mirror_cache.update(origin) == ""
+
+    assert cloner.send_bundle(origin) == ""
+    assert remote_ref(cloner, origin, "main") == run(origin, "rev-parse", "main")
+    assert bundles(cloner) == []
+
+
+def test_moved_refs_are_updated_without_bundle(cloner: BundleCloner, origin) -> None:
+    assert cloner.mirror_cache.update(origin) == ""
+    assert cloner.send_bundle(origin) == ""
+    second = run(origin, "rev-parse", "main")
+    first = run(origin, "rev-parse", "main~1")
+
+    # force-push back, and a new branch at a commit the remote has
+    run(origin, "reset", "-q", "--hard", first)
+    run(origin, "branch", "topic", second)
+    run(origin, "tag", "v1", first)
+    assert cloner.mirror_cache.update(origin) == ""
+    assert cloner.mirror_cache.create_bundle(origin, [second]) == ("", "")
+
+    assert cloner.send_bundle(origin) == ""
+    assert remote_ref(cloner, origin, "main") == first
+    assert remote_ref(cloner, origin, "topic") == second
+    assert remote_ref(cloner, origin, "v1") == first
+    assert bundles(cloner) == []
+
+    # nothing moved, nothing to do
+    assert cloner.send_bundle(origin) == ""
+    assert remote_ref(cloner, origin, "main") == first
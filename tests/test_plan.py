@@ -0,0 +1,200 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal plan tests"""
+
+import pathlib
+from typing import List
+from typing import Tuple
+
+from kaajal.distro import Distro
+from kaajal.journal import StepJournal
+from kaajal.local import LocalConnection
+from kaajal.plan import Plan
+from kaajal.plan import PlanCompiler
+from kaajal.plan import PlanExecutor
+from kaajal.plan import PlanTask
+from kaajal.plan import StepResult
+from kaajal.plan import check_plan
+
+
+def test_plan_stops_at_the_failed_step(local_conn: LocalConnection) -> None:
+    plan = Plan()
+    plan.add("first", "echo one; echo two >&2")
+    plan.add("second", "echo broken; cd /; exit 3")
+    plan.add("third", "echo three")
+    lines: List[Tuple[str, str]] = []
+    ended: List[StepResult] = []
+
+    result = plan.run(
+        local_conn,
+        on_output=lambda stream, line: lines.append((stream, line)),
+        on_step=ended.append,
+    )
+
+    assert result.error == "second failed with exit status 3: broken"
+    assert result.failed_step == "second"
+    assert [step.exit_status for step in result.steps] == [0, 3, -1]
+    assert result.steps[0].output == ["one", "two"]
+    assert [step.name for step in ended] == ["first", "second"]
+    # the markers are not output
+    assert [line for _, line in lines] == ["one", "two", "broken"]
+
+
+def test_compile_installs_only_missing_packages(
+    local_distro: Distro, fake_backend, tmp_path
+) -> None:
+    ssh_key = tmp_path / "id.pub"
+    ssh_key.write_text("ssh-ed25519 AAAAkey user@host\n")
+    fake_backend(["echo updated"], "echo installing PKGS", "echo vim")
+    compiler = PlanCompiler(local_distro)
+
+    plan, error_msg = compiler.compile("vim tmux", ssh_key_paths=[str(ssh_key)])
+
+    assert error_msg == ""
+    assert [step.name for step in plan.steps] == ["update", "install", "ssh_keys"]
+
+    conn = local_distro.ssh_conn
+    assert conn is not None
+    lines: List[str] = []
+    result = plan.run(conn, on_output=lambda stream, line: lines.append(line))
+
+    assert result.ok, result.error
+    assert lines == ["updated", "installing tmux"]
+    # the key is added once
+    assert plan.run(conn).ok
+    authorized_keys = conn.get_home() + "/.ssh/authorized_keys"
+    with open(authorized_keys, encoding="utf-8") as authorized_keys_file:
+        assert authorized_keys_file.read() == "ssh-ed25519 AAAAkey user@host\n"
+
+
+def test_compile_needs_a_package_manager(local_distro: Distro) -> None:
+    plan, error_msg = PlanCompiler(local_distro).compile("vim")
+
+    assert error_msg == "No package manager known for fake"
+    assert plan.steps == []
+
+
+def test_failed_install_is_not_journaled(
+    local_distro: Distro, fake_backend, tmp_path
+) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"))
+    conn = local_distro.ssh_conn
+    assert conn is not None
+    host_id = conn.host_id()
+    tasks = [PlanTask("packages", "packages", params={"packages": "vim"})]
+
+    fake_backend([], "exit 100")
+    result = PlanExecutor(local_distro, journal=journal).run(tasks)
+
+    assert result.failed_step == "packages"
+    assert "packages" not in journal.steps(host_id)
+
+    # the next run does the install again
+    fake_backend([], "true")
+    result = PlanExecutor(local_distro, journal=journal).run(tasks)
+
+    assert result.ok
+    assert not result.steps[0].skipped
+    assert "packages" in journal.steps(host_id)
+
+
+def test_resume_after_failed_step(local_distro: Distro, fake_backend, tmp_path) -> None:
+    journal = StepJournal(str(tmp_path / "journal.json"))
+    runs = tmp_path / "runs"
+    fixed = tmp_path / "fixed"
+    fake_backend([], f"echo PKGS >> {runs} && {{ [ PKGS != bad ] || [ -e {fixed} ]; }}")
+    tasks = [
+        PlanTask("first", "packages", params={"packages": "vim"}),
+        PlanTask("second", "packages", ["first"], {"packages": "bad"}),
+        PlanTask("third", "packages", ["second"], {"packages": "git"}),
+    ]
+
+    result = PlanExecutor(local_distro, journal=journal).run(tasks)
+
+    assert result.failed_step == "second"
+    assert runs.read_text() == "vim\nbad\n"
+
+    fixed.touch()
+    result = PlanExecutor(local_distro, journal=journal).run(tasks)
+
+    assert result.ok, result.error
+    assert [step.skipped for step in result.steps] == [True, False, False]
+    assert runs.read_text() == "vim\nbad\nbad\ngit\n"
+
+    # a changed step is run again with the steps that need it
+    tasks[1].params["packages"] = "bad tmux"
+    PlanExecutor(local_distro, journal=journal).run(tasks)
+
+    assert runs.read_text().endswith("git\nbad tmux\ngit\n")
+
+
+def test_users_step_can_run_again(
+    local_distro: Distro, fake_users: pathlib.Path
+) -> None:
+    (fake_users / "alice").write_text("old-password")
+    tasks = [
+        PlanTask(
+            "users",
+            "users",
+            params={
+                "users": [
+                    {"user": "alice", "password": "new-password"},
+                    {"user": "bob", "password": "bob-password"},
+                ]
+            },
+        )
+    ]
+
+    for _ in range(2):
+        result = PlanExecutor(local_distro).run(tasks)
+        assert result.ok, result.error
+
+    # the existing user is not changed, like in a compiled plan
+    assert (fake_users / "alice").read_text() == "old-password"
+    assert (fake_users / "bob").read_text() == "bob-password"
+
+    tasks[0].params["users"].append({"user": "broken", "password": "x"})
+    result = PlanExecutor(local_distro).run(tasks)
+
+    assert result.error == "users: Can not create the users"
+
+
+def test_check_plan() -> None:
+    assert (
+        check_plan(
+            [
+                PlanTask("update", "update"),
+                PlanTask("packages", "packages", ["update"]),
+                PlanTask("users", "users", ["update"]),
+                PlanTask("ssh_keys", "ssh_keys", ["users", "packages"]),
+            ]
+        )
+        == ""
+    )
+    assert check_plan([PlanTask("a", "shell")]) == "a: unknown step type shell"
+    assert (
+        check_plan([PlanTask("a", "update"), PlanTask("a", "packages")])
+        == "a: step given twice"
+    )
+    assert check_plan([PlanTask("a", "update", ["b"])]) == "a: needs unknown step b"
+
+
+def test_check_plan_cycles() -> None:
+    assert check_plan([PlanTask("a", "update", ["a"])]) == "steps need each other: a"
+    assert (
+        check_plan(
+            [
+                PlanTask("update", "update"),
+                PlanTask("a", "packages", ["update", "c"]),
+                PlanTask("b", "users", ["a"]),
+                PlanTask("c", "ssh_keys", ["b"]),
+                PlanTask("d", "repos", ["update"]),
+            ]
+        )
+        == "steps need each other: a, b, c"
+    )
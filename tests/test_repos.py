@@ -0,0 +1,107 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal repos tests"""
+
+import os
+import pathlib
+import subprocess  # nosec B404
+from typing import List
+from typing import Tuple
+
+import pytest
+
+from kaajal.connection import _OutputSink
+from kaajal.local import LocalConnection
+from kaajal.repos import Repo
+from kaajal.repos import RepoCloner
+
+
+@pytest.fixture
+def origin(tmp_path) -> str:
+    """URL of a local git repository with one commit"""
+
+    path = tmp_path / "origin"
+    path.mkdir()
+    git = ["git", "-C", str(path), "-c", "user.name=t", "-c", "user.email=t@t"]
+    subprocess.run(git + ["init", "-q", "-b", "main"], check=True)
+    (path / "README").write_text("readme\n")
+    subprocess.run(git + ["add", "README"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "first"], check=True)
+
+    return "file://" + str(path)
+
+
+def test_progress_lines_end_with_carriage_returns() -> None:
+    lines: List[Tuple[str, str]] = []
+    sink = _OutputSink("stderr", lambda stream, line: lines.append((stream, line)))
+
+    sink.feed(b"Receiving objects:  50% (1/2)\rReceiving")
+    sink.feed(b" objects: 100% (2/2), done.\r")
+    sink.feed(b"\nend without new line")
+
+    assert sink.close() == (
+        "Receiving objects:  50% (1/2)\n"
+        "Receiving objects: 100% (2/2), done.\n"
+        "end without new line\n"
+    )
+    assert [line for _, line in lines] == [
+        "Receiving objects:  50% (1/2)",
+        "Receiving objects: 100% (2/2), done.",
+        "end without new line",
+    ]
+
+
+def test_clone_progress(local_conn: LocalConnection, tmp_path, monkeypatch) -> None:
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    # git without a terminal updates its progress with carriage returns
+    (bin_dir / "git").write_text(
+        "#!/bin/sh\n"
+        "for path; do :; done\n"
+        "printf 'Cloning into %s...\\n' \"$path\" >&2\n"
+        "printf 'Receiving objects:  50%% (1/2)\\r' >&2\n"
+        "printf 'Receiving objects: 100%% (2/2), done.\\n' >&2\n"
+        'mkdir -p "$path/.git"\n'
+    )
+    (bin_dir / "git").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    messages: List[str] = []
+    cloner = RepoCloner(
+        local_conn, on_progress=lambda repo, message: messages.append(message)
+    )
+
+    result = cloner.clone(Repo("https://example.com/kaajal.git"))
+
+    assert result.status == "cloned"
+    assert messages == [
+        "cloning",
+        "Cloning into kaajal...",
+        "Receiving objects:  50% (1/2)",
+        "Receiving objects: 100% (2/2), done.",
+        "cloned",
+    ]
+
+
+def test_clone_all(local_conn: LocalConnection, origin: str) -> None:
+    home = pathlib.Path(local_conn.home)
+    repos = [
+        Repo(origin, "first"),
+        Repo(origin, "~/second", branch="main", depth=1),
+        Repo(origin + "-missing", "missing"),
+    ]
+
+    results = RepoCloner(local_conn, jobs=2).clone_all(repos)
+
+    assert [result.status for result in results] == ["cloned", "cloned", "failed"]
+    assert results[2].error.startswith("fatal:")
+    assert (home / "first/README").read_text() == "readme\n"
+    assert (home / "second/README").read_text() == "readme\n"
+
+    results = RepoCloner(local_conn).clone_all(repos[:1])
+
+    assert results[0].status == "exists"
@@ -0,0 +1,120 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal remote helper tests"""
+
+import base64
+import json
+import os
+import subprocess  # nosec B404
+import sys
+from typing import Any
+from typing import Callable
+from typing import Iterator
+from typing import List
+
+import pytest
+
+from kaajal.rpc import REMOTE_HELPER
+
+# Sends a request to the helper, returns its reply and its output messages
+HelperCaller = Callable[..., Any]
+
+
+@pytest.fixture
+def helper(tmp_path, monkeypatch) -> Iterator[HelperCaller]:
+    """Remote helper running on the local machine"""
+
+    monkeypatch.setenv("HOME", str(tmp_path))
+    process = subprocess.Popen(  # nosec B603
+        [sys.executable, "-u", "-c", REMOTE_HELPER],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    request_ids = iter(range(1, 1000))
+
+    def call(method: str, **params) -> Any:
+        assert process.stdin is not None and process.stdout is not None
+        request_id = next(request_ids)
+        request = {"id": request_id, "method": method, "params": params}
+        process.stdin.write(json.dumps(request) + "\n")
+        process.stdin.flush()
+
+        output: List[list] = []
+        for line in iter(process.stdout.readline, ""):
+            reply = json.loads(line)
+            assert reply["id"] == request_id
+            if "output" in reply:
+                output.append(reply["output"])
+                continue
+            return reply.get("result"), reply.get("error", ""), output
+
+        raise EOFError("the helper ended")
+
+    yield call
+
+    assert process.stdin is not None
+    process.stdin.close()
+    process.wait()
+
+
+def test_run(helper: HelperCaller) -> None:
+    result, error, output = helper(
+        "run",
+        command="cat; printf '50%%\\r100%%\\r\\n' >&2; exit 3",
+        stdin=base64.b64encode(b"in\n").decode("ascii"),
+        output=True,
+    )
+
+    assert error == ""
+    assert result == {
+        "stdout": "in\n",
+        "stderr": "50%\n100%\n",
+        "exit_status": 3,
+        "timeout": False,
+    }
+    assert sorted(output) == [["stderr", "100%"], ["stderr", "50%"], ["stdout", "in"]]
+
+    result, error, output = helper("run", command="exec sleep 5", timeout=0.1)
+
+    assert result["timeout"] is True
+    assert output == []
+
+
+def test_files(helper: HelperCaller, tmp_path) -> None:
+    path = str(tmp_path / "a" / "b")
+
+    assert helper("home")[:2] == (str(tmp_path), "")
+    assert helper("stat", path=path)[0] == 0
+    assert helper("read", path=path)[:2] == ("", "")
+    assert helper("makedirs", path=str(tmp_path / "a"), mode=0o750)[1] == ""
+    assert helper("write", path=path, content="text\n", mode=0o640)[1] == ""
+    assert helper("stat", path=path)[0] == 1
+    assert helper("read", path=path)[:2] == ("text\n", "")
+    assert os.stat(path).st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path / "a") == ["b"]
+
+
+def test_failed_write_removes_its_temporary_file(
+    helper: HelperCaller, tmp_path
+) -> None:
+    # a file can not replace a directory
+    (tmp_path / "dir" / "sub").mkdir(parents=True)
+
+    error = helper("write", path=str(tmp_path / "dir"), content="x", mode=0o600)[1]
+
+    assert error.startswith("IsADirectoryError: ")
+    assert sorted(os.listdir(tmp_path)) == ["dir"]
+
+
+def test_packages(helper: HelperCaller) -> None:
+    assert helper("packages", command="echo a; echo b")[:2] == ("a\nb\n", "")
+    assert helper("packages", command="exit 2")[1] == (
+        "OSError: exit 2 failed with exit status 2"
+    )
+    assert helper("unknown")[1] == "KeyError: 'unknown'"
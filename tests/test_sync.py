@@ -0,0 +1,115 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal tree sync tests"""
+
+import filecmp
+import os
+
+from kaajal.local import LocalConnection
+from kaajal.sync import SyncResult
+from kaajal.sync import TreeSync
+
+BLOCK_SIZE = 1024
+
+
+def same_trees(left: str, right: str) -> bool:
+    """True if two directories have the same files"""
+
+    compare = filecmp.dircmp(left, right)
+    if compare.left_only or compare.right_only or compare.funny_files:
+        return False
+    if filecmp.cmpfiles(left, right, compare.common_files, shallow=False)[1:] != (
+        [],
+        [],
+    ):
+        return False
+
+    return all(
+        same_trees(os.path.join(left, name), os.path.join(right, name))
+        for name in compare.common_dirs
+    )
+
+
+def test_sync_sends_only_the_changes(local_conn: LocalConnection, tmp_path) -> None:
+    local_dir = tmp_path / "local"
+    remote_dir = tmp_path / "remote"
+    (local_dir / "sub").mkdir(parents=True)
+    big = bytes(range(256)) * 64
+    (local_dir / "big.bin").write_bytes(big)
+    (local_dir / "sub" / "small.txt").write_text("small\n")
+    (local_dir / "link").symlink_to("sub/small.txt")
+    tree_sync = TreeSync(local_conn, BLOCK_SIZE)
+
+    result = tree_sync.sync(str(local_dir), str(remote_dir))
+
+    assert result.ok, result.error
+    assert result.new == 2
+    assert same_trees(str(local_dir), str(remote_dir))
+    assert os.readlink(remote_dir / "link") == "sub/small.txt"
+
+    # one block changed and data added at the end
+    changed = bytearray(big)
+    changed[BLOCK_SIZE * 3 + 10] ^= 0xFF
+    (local_dir / "big.bin").write_bytes(bytes(changed) + b"tail")
+
+    result = tree_sync.sync(str(local_dir), str(remote_dir))
+
+    assert result.ok, result.error
+    assert (result.new, result.updated, result.unchanged) == (0, 1, 1)
+    assert result.sent == BLOCK_SIZE + len(b"tail")
+    assert same_trees(str(local_dir), str(remote_dir))
+
+    result = tree_sync.sync(str(local_dir), str(remote_dir))
+
+    assert result.ok, result.error
+    assert (result.new, result.updated, result.sent) == (0, 0, 0)
+
+
+def test_unreadable_file_is_reported(local_conn: LocalConnection, tmp_path) -> None:
+    local_dir = tmp_path / "local"
+    remote_dir = tmp_path / "remote"
+    local_dir.mkdir()
+    (local_dir / "a.txt").write_text("a\n")
+    (local_dir / "b.txt").write_text("b\n")
+    tree_sync = TreeSync(local_conn, BLOCK_SIZE)
+    entries = tree_sync._local_entries(str(local_dir))
+    # b.txt is removed after the dir was listed
+    (local_dir / "b.txt").unlink()
+
+    result = tree_sync._send_deltas(
+        str(local_dir), str(remote_dir), entries, {}, SyncResult("", "")
+    )
+
+    assert result.startswith(f"Can not read {local_dir / 'b.txt'}: ")
+    assert (remote_dir / "a.txt").read_text() == "a\n"
+    assert not (remote_dir / "b.txt").exists()
+
+
+def test_file_changed_while_sent(
+    local_conn: LocalConnection, tmp_path, monkeypatch
+) -> None:
+    local_dir = tmp_path / "local"
+    remote_dir = tmp_path / "remote"
+    local_dir.mkdir()
+    (local_dir / "a.txt").write_text("a" * BLOCK_SIZE * 2)
+    tree_sync = TreeSync(local_conn, BLOCK_SIZE)
+    delta = tree_sync._delta
+
+    def truncate_after_delta(path: str, remote) -> list:
+        ops = delta(path, remote)
+        os.truncate(path, 1)
+        return ops
+
+    monkeypatch.setattr(tree_sync, "_delta", truncate_after_delta)
+
+    result = tree_sync.sync(str(local_dir), str(remote_dir))
+
+    assert result.error == (
+        f"Can not read {local_dir / 'a.txt'}: changed while it was sent"
+    )
+    assert not (remote_dir / "a.txt").exists()
@@ -0,0 +1,170 @@
+# c-basic-offset: 4; tab-width: 8; indent-tabs-mode: nil
+# vi: set shiftwidth=4 tabstop=8 expandtab:
+# :indentSize=4:tabSize=8:noTabs=true:
+#
+# SPDX-FileCopyrightText: 2025 Intel Corporation
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+"""Kaajal tarball tests"""
+
+import os
+import tarfile
+
+import pytest
+
+from kaajal.local import LocalConnection
+from kaajal.tarball import CACHED
+from kaajal.tarball import EXTRACTED
+from kaajal.tarball import MISSING
+from kaajal.tarball import DigestCache
+from kaajal.tarball import Tarball
+from kaajal.tarball import TarballInstaller
+from kaajal.tarball import load_tarball_list
+
+
+@pytest.fixture
+def sdk(tmp_path) -> str:
+    """Path of a local directory with two files"""
+
+    path = tmp_path / "sdk"
+    (path / "bin").mkdir(parents=True)
+    (path / "bin" / "tool").write_text("tool\n")
+    (path / "VERSION").write_text("1.2\n")
+
+    return str(path)
+
+
+@pytest.fixture
+def installer(local_conn: LocalConnection, tmp_path) -> TarballInstaller:
+    """Tarball installer to the local machine, without the artifact cache"""
+
+    return TarballInstaller(
+        local_conn, use_cache=False, digests=DigestCache(str(tmp_path / "d.json"))
+    )
+
+
+@pytest.fixture
+def sdk_archive(sdk, tmp_path) -> str:
+    """Path of a gzip archive of the SDK"""
+
+    archive = str(tmp_path / "sdk.tgz")
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(sdk, arcname=".")
+
+    return archive
+
+
+def extracted(local_conn: LocalConnection, path: str) -> str:
+    """Get the version file of the SDK extracted in a path of the home"""
+
+    with open(os.path.join(local_conn.get_home(), path, "VERSION")) as version:
+        return version.read()
+
+
+@pytest.mark.parametrize("mode,name", [("w:gz", "sdk.tgz"), ("w:xz", "sdk.tar.xz")])
+def test_install_archive(
+    installer: TarballInstaller, local_conn, sdk, tmp_path, mode, name
+) -> None:
+    archive = str(tmp_path / name)
+    with tarfile.open(archive, mode) as tar:
+        tar.add(sdk, arcname=".")
+
+    result = installer.install(Tarball(archive, "opt/sdk"))
+
+    assert result.error == ""
+    assert result.size == os.path.getsize(archive)
+    assert extracted(local_conn, "opt/sdk") == "1.2\n"
+
+
+@pytest.mark.parametrize("compression", ["", "gz", "xz"])
+def test_install_dir(installer: TarballInstaller, local_conn, sdk, compression) -> None:
+    result = installer.install(Tarball(sdk, "~/sdk", compression))
+
+    assert result.error == ""
+    assert extracted(local_conn, "sdk") == "1.2\n"
+    assert os.path.isfile(os.path.join(local_conn.get_home(), "sdk/bin/tool"))
+
+
+def test_install_broken_archive(installer: TarballInstaller, tmp_path) -> None:
+    archive = tmp_path / "broken.tgz"
+    archive.write_bytes(b"\x1f\x8b not gzip")
+
+    result = installer.install(Tarball(str(archive), "broken"))
+
+    assert result.status == "failed"
+    assert result.error != ""
+
+
+def test_unknown_compression(tmp_path) -> None:
+    tarball_list = tmp_path / "tarballs.yaml"
+    tarball_list.write_text("- source: sdk\n  compression: zst\n")
+
+    tarballs, error_msg = load_tarball_list(str(tarball_list))
+
+    assert "unknown compression 'zst'" in error_msg
+    assert tarballs == []
+
+
+def test_digest_cache(sdk_archive, tmp_path) -> None:
+    cache_path = tmp_path / "digests.json"
+    digest = DigestCache(str(cache_path)).digest(sdk_archive)
+
+    assert len(digest) == 64
+    assert sdk_archive in cache_path.read_text()
+    # another process finds the saved digest and keeps it
+    other = DigestCache(str(cache_path))
+    assert other.digest(sdk_archive) == digest
+
+    with open(sdk_archive, "ab") as archive:
+        archive.write(b"\0" * 512)
+    assert other.digest(sdk_archive) != digest
+    assert [name for name in os.listdir(tmp_path) if "digests" in name] == [
+        "digests.json"
+    ]
+
+
+def test_artifact_cache(local_conn: LocalConnection, sdk_archive, tmp_path) -> None:
+    installer = TarballInstaller(
+        local_conn, digests=DigestCache(str(tmp_path / "d.json"))
+    )
+    tarballs = [Tarball(sdk_archive, "a"), Tarball(sdk_archive, "b")]
+    digest = installer.digests.digest(sdk_archive)
+
+    assert installer.lookup(tarballs) == {0: (digest, MISSING), 1: (digest, MISSING)}
+    assert "tee" in installer.artifact_cmd(tarballs[0], "gz", digest, MISSING, 1)
+    assert "tee" not in installer.artifact_cmd(tarballs[0], "gz", digest, CACHED, 1)
+
+    results = installer.install_all(tarballs)
+
+    # the archive is sent once, the second path extracts it from the cache
+    assert [result.status for result in results] == ["extracted", "from cache"]
+    assert [result.size for result in results] == [os.path.getsize(sdk_archive), 0]
+    assert extracted(local_conn, "b") == "1.2\n"
+    assert installer.lookup(tarballs + [Tarball(sdk_archive, "c")]) == {
+        0: (digest, EXTRACTED),
+        1: (digest, EXTRACTED),
+        2: (digest, CACHED),
+    }
+
+    results = installer.install_all(tarballs)
+
+    assert [result.status for result in results] == ["up to date", "up to date"]
+
+
+def test_truncated_artifact_is_not_cached(
+    local_conn: LocalConnection, sdk_archive, tmp_path
+) -> None:
+    installer = TarballInstaller(
+        local_conn, digests=DigestCache(str(tmp_path / "d.json"))
+    )
+    tarball = Tarball(sdk_archive, "a")
+    digest = installer.digests.digest(sdk_archive)
+    size = os.path.getsize(sdk_archive)
+
+    # the size of the archive is not the size the cache wants
+    cmd = installer.artifact_cmd(tarball, "gz", digest, MISSING, size + 1)
+    with open(sdk_archive, "rb") as archive:
+        assert local_conn.exec(cmd, stdin=archive).ok
+
+    assert installer.lookup([tarball]) == {0: (digest, EXTRACTED)}
+    assert installer.lookup([Tarball(sdk_archive, "b")]) == {0: (digest, MISSING)}